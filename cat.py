@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 import sys
-import base64
+import argparse
 from common import *
 
-path = sys.argv[1]
+parser = argparse.ArgumentParser(description='Prints contents of the remote file.')
+parser.add_argument('path', help='path on remote filesystem')
+parser.add_argument('-o', '--output', help='write contents to local file instead of stdout')
+parser.add_argument('-v', '--verbose', action='store_true', help='print throughput to stderr')
+args = parser.parse_args()
 
-c = connect()
-handle = unwrap(c.FileSystem.open(path, 1, {}))
-content_b64 = unwrap(c.FileSystem.read(handle, 0, 4096))[0]
-content = base64.b64decode(content_b64).decode('utf-8')
+client = open_client()
+out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+try:
+    result = client.download(args.path, out)
+except Exception as e:
+    print('Error: ', error_text(e), file=sys.stderr)
+    sys.exit(1)
+finally:
+    out.flush()
+    if args.output:
+        out.close()
 
-print(content)
-
-unwrap(c.FileSystem.close(handle))
+if args.verbose:
+    print(result, file=sys.stderr)
@@ -1,13 +1,34 @@
+import sys
 import tcf
+from tcf.util import daemon
 from tcf.util.sync import CommandControl
 
-def connect():
+TARGET = 'TCP:172.16.0.254:1534'
+
+def open_channel():
     tcf.protocol.startEventQueue()
-    return CommandControl(tcf.connect('TCP:172.16.0.254:1534'))
+    return tcf.connect(TARGET)
+
+def open_client():
+    # Use the warm channel of tcfd.py if it is running
+    client = daemon.getDaemonClient(TARGET)
+    if client is None:
+        client = daemon.DirectClient(open_channel())
+    return client
+
+def connect():
+    return CommandControl(open_channel())
 
 def unwrap(response):
     error, result = response
     if error:
         print('Error: ', error)
         sys.exit(1)
-    return result
\ No newline at end of file
+    return result
+
+def error_text(e):
+    # errors of the dispatch thread are wrapped by tcf.util.task
+    if len(e.args) == 2 and e.args[0] == 'TCF task aborted':
+        e = e.args[1]
+    # FileSystem errors made from another exception have no message
+    return str(e) or str(getattr(e, 'caused_by', '')) or type(e).__name__
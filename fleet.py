@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import sys
+import json
+import argparse
+import tcf
+from tcf.channel import IOLoop
+from tcf.util import fleet, transfer
+
+parser = argparse.ArgumentParser(description='Runs the same operation on many agents concurrently.')
+parser.add_argument('-t', '--target', action='append', default=[], help='agent, e.g. TCP:10.0.0.5:1534 (repeatable)')
+parser.add_argument('-f', '--targets-file', help='file with one target per line')
+parser.add_argument('-D', '--discover', type=float, metavar='SECONDS', help='add agents discovered by the Locator service')
+parser.add_argument('-w', '--window', type=int, default=fleet.CONNECT_WINDOW, help='channels opened at the same time')
+parser.add_argument('--timeout', type=float, default=fleet.TIMEOUT, help='seconds to wait for the connect and for every reply of an agent')
+ops = parser.add_subparsers(dest='op', required=True)
+op = ops.add_parser('stat', help='FileSystem.stat of a remote path')
+op.add_argument('path', help='path on remote filesystem')
+op = ops.add_parser('command', help='any service command, e.g. SysMonitor getChildren null')
+op.add_argument('service')
+op.add_argument('name')
+op.add_argument('args', nargs='*', help='command arguments, JSON')
+op = ops.add_parser('push', help='upload a local file')
+op.add_argument('local_path', help='path on local filesystem')
+op.add_argument('remote_path', help='path on remote filesystem')
+op.add_argument('-p', '--preserve', action='store_true', help='preserve permissions and modification time')
+args = parser.parse_args()
+
+# one I/O thread for all the channels instead of two threads per channel
+IOLoop.enable()
+tcf.protocol.startEventQueue()
+targets = list(args.target)
+if args.targets_file:
+    with open(args.targets_file) as f:
+        targets += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+if args.discover is not None:
+    targets += fleet.discover(args.discover)
+if not targets:
+    parser.error('no targets')
+
+if args.op == 'stat':
+    operation = fleet.command('FileSystem', 'stat', args.path)
+elif args.op == 'command':
+    operation = fleet.command(args.service, args.name, *[json.loads(a) for a in args.args])
+else:
+    attrs = transfer.getLocalFileAttrs(args.local_path) if args.preserve else None
+    inp = open(args.local_path, 'rb')
+    operation = fleet.push(inp, args.remote_path, attrs)
+
+f = fleet.Fleet(targets, connect_window=args.window, timeout=args.timeout)
+results = []
+for result in f.run(operation):
+    results.append(result)
+    if result.error:
+        text = f'Error: {result.error}'
+    elif args.op == 'push':
+        text = str(result.value)
+    else:
+        text = json.dumps(result.value)
+    print(f'{result.target} {result.time * 1000:.1f} ms {text}', flush=True)
+f.close()
+if args.op == 'push':
+    inp.close()
+summary = fleet.Summary(results)
+print(summary, file=sys.stderr)
+if summary.failed:
+    sys.exit(1)
@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 import sys
+import argparse
 from common import *
+from tcf.util import walker
 
-path = sys.argv[1]
+parser = argparse.ArgumentParser(description='Lists all files and directories in the given path.')
+parser.add_argument('path', help='path on remote filesystem')
+parser.add_argument('-R', '--recursive', action='store_true', help='list subdirectories recursively')
+args = parser.parse_args()
 
-c = connect()
-handle = unwrap(c.FileSystem.opendir(path))
-files = unwrap(c.FileSystem.readdir(handle))[0]
+def print_error(path, error):
+    print(f'Error: {path}: {error}', file=sys.stderr)
 
+client = open_client()
 print('Permissions Name Size')
-for file in files:
-    filename = file["FileName"]
-    attrs = file["Attrs"]
-    permissions = attrs["Permissions"]
-    size = attrs["Size"]
-    print(f'{permissions:b} {filename} {size} bytes')
-
-unwrap(c.FileSystem.close(handle))
+try:
+    for dirpath, entry in client.walk(args.path, recursive=args.recursive, onerror=print_error):
+        filename = entry.filename
+        if args.recursive:
+            filename = walker.joinPath(dirpath, filename)
+        attrs = entry.attrs
+        print(f'{attrs.permissions:b} {filename} {attrs.size} bytes')
+except Exception as e:
+    print('Error: ', e)
+    sys.exit(1)
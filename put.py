@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 import sys
-import base64
+import argparse
 from common import *
+from tcf.util import transfer
 
-local_path = sys.argv[1]
-remote_path = sys.argv[2]
+parser = argparse.ArgumentParser(description='Overwrites remote file with contents from the local file.')
+parser.add_argument('local_path', help='path on local filesystem')
+parser.add_argument('remote_path', help='path on remote filesystem')
+parser.add_argument('-p', '--preserve', action='store_true', help='preserve permissions and modification time')
+parser.add_argument('-d', '--delta', action='store_true', help='only write blocks that differ from the remote file')
+parser.add_argument('-v', '--verbose', action='store_true', help='print throughput to stderr')
+args = parser.parse_args()
 
-with open(local_path, 'r') as f:
-    content = f.read()
+attrs = transfer.getLocalFileAttrs(args.local_path) if args.preserve else None
 
-content_b64 = base64.b64encode(bytes(content, 'utf-8'))
+client = open_client()
+with open(args.local_path, 'rb') as f:
+    try:
+        result = client.upload(args.remote_path, f, attrs=attrs, delta=args.delta)
+    except Exception as e:
+        print('Error: ', error_text(e), file=sys.stderr)
+        sys.exit(1)
 
-c = connect()
-handle = unwrap(c.FileSystem.open(remote_path, 2, {}))
-unwrap(c.FileSystem.write(handle, 0, content_b64))
-
-unwrap(c.FileSystem.close(handle))
+if args.verbose:
+    print(result, file=sys.stderr)
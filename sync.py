@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+from common import *
+from tcf.util import dirsync
+
+parser = argparse.ArgumentParser(description='Copies changed files from the local directory to the remote directory.')
+parser.add_argument('local_path', help='directory on local filesystem')
+parser.add_argument('remote_path', help='directory on remote filesystem')
+parser.add_argument('--delete', action='store_true', help='remove remote files that do not exist locally')
+parser.add_argument('-v', '--verbose', action='store_true', help='print failed files to stderr')
+args = parser.parse_args()
+
+channel = open_channel()
+try:
+    result = dirsync.sync(channel, args.local_path, args.remote_path, args.delete)
+except Exception as e:
+    print('Error: ', error_text(e), file=sys.stderr)
+    sys.exit(1)
+
+if args.verbose:
+    for path, error in result.errors:
+        print(path, error, file=sys.stderr)
+print(result)
+if result.errors:
+    sys.exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import sys
+import time
+import argparse
+import tcf
+import common
+from tcf.channel import IOLoop
+from tcf.util import follow
+
+parser = argparse.ArgumentParser(description='Prints the last lines of remote files and the lines appended to them, like tail -F.')
+parser.add_argument('paths', nargs='+', metavar='path', help='path on remote filesystem')
+parser.add_argument('-t', '--target', action='append', default=[], help='agent, e.g. TCP:10.0.0.5:1534 (repeatable, default %s)' % common.TARGET)
+parser.add_argument('-n', '--lines', type=int, default=10, help='number of last lines to print first')
+parser.add_argument('--max-delay', type=float, default=follow.MAX_DELAY / 1000, help='longest poll interval in seconds')
+args = parser.parse_args()
+
+# followed files are the last 64 KiB that the first lines are taken from
+TAIL_BYTES = 0x10000
+
+
+class Output(follow.FollowListener):
+    def __init__(self, name, many):
+        self.name = name
+        self.header = many
+        self.tail = bytearray()
+
+    def write(self, data):
+        global last
+        if self.header and last is not self:
+            sep = '\n' if last is not None else ''
+            sys.stdout.buffer.write(f'{sep}==> {self.name} <==\n'.encode())
+        last = self
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    def writeTail(self):
+        # only the last lines of the initial tail read are printed
+        lines = bytes(self.tail).splitlines(True)
+        self.tail = bytearray()
+        if lines and args.lines > 0:
+            self.write(b''.join(lines[-args.lines:]))
+
+    def data(self, follower, data):
+        end = follower.tail_end
+        start = follower.offset - len(data)
+        if end is not None and start < end:
+            self.tail += data[:end - start]
+            data = data[end - start:]
+            if follower.offset < end:
+                return
+            self.writeTail()
+        if data:
+            self.write(data)
+
+    def truncated(self, follower):
+        self.writeTail()
+        print(f'tail.py: {self.name}: file truncated', file=sys.stderr)
+
+    def rotated(self, follower):
+        self.writeTail()
+        print(f'tail.py: {self.name}: file replaced, following the new file', file=sys.stderr)
+
+    def error(self, follower, error):
+        print(f'tail.py: {self.name}: {error}', file=sys.stderr)
+
+
+last = None
+targets = args.target or [common.TARGET]
+if len(targets) > 1:
+    # one I/O thread for all the channels instead of two threads per channel
+    IOLoop.enable()
+tcf.protocol.startEventQueue()
+followers = []
+for target in targets:
+    try:
+        channel = tcf.connect(target)
+    except Exception as e:
+        print(f'tail.py: {target}: {e}', file=sys.stderr)
+        continue
+    for path in args.paths:
+        name = f'{target}:{path}' if len(targets) > 1 else path
+        output = Output(name, len(targets) * len(args.paths) > 1)
+        followers.append(follow.follow(channel, path, output, tail_bytes=TAIL_BYTES,
+                                       max_delay=int(args.max_delay * 1000)))
+if not followers:
+    sys.exit(1)
+try:
+    while True:
+        time.sleep(3600)
+except KeyboardInterrupt:
+    pass
@@ -9,6 +9,7 @@
 # *     Wind River Systems - initial API and implementation
 # *****************************************************************************
 
+import collections
 import threading
 
 
@@ -22,7 +23,8 @@ class EventQueue(object):
         self.__is_shutdown = False
         self.__on_shutdown = on_shutdown
         self.__lock = threading.Condition()
-        self.__queue = []
+        self.__queue = collections.deque()
+        self.__batch = collections.deque()
 
     def start(self):
         self.__thread.start()
@@ -51,18 +53,25 @@ class EventQueue(object):
             protocol.log("Unhandled exception in TCF event dispatch", x)
 
     def __call__(self):
+        batch = self.__batch
         while True:
-            try:
-                with self.__lock:
-                    while not self.__queue:
-                        if self.__is_shutdown:
-                            return
-                        self.__is_waiting = True
-                        self.__lock.wait()
-                    r, args, kwargs = self.__queue.pop(0)
-                r(*args, **kwargs)
-            except Exception as x:
-                self.__error(x)
+            # Take all pending jobs at once, new jobs are queued into the
+            # (empty) deque of the previous batch while this one is running.
+            with self.__lock:
+                while not self.__queue:
+                    if self.__is_shutdown:
+                        return
+                    self.__is_waiting = True
+                    self.__lock.wait()
+                batch, self.__queue = self.__queue, batch
+                self.__batch = batch
+            popleft = batch.popleft
+            while batch:
+                r, args, kwargs = popleft()
+                try:
+                    r(*args, **kwargs)
+                except Exception as x:
+                    self.__error(x)
 
     def invokeLater(self, r, *args, **kwargs):
         assert r
@@ -77,9 +86,23 @@ class EventQueue(object):
     def isDispatchThread(self):
         return threading.currentThread() is self.__thread
 
+    def getQueueSize(self):
+        """
+        @return number of jobs waiting to be taken by the dispatch thread.
+        """
+        with self.__lock:
+            return len(self.__queue)
+
+    def getJobCount(self):
+        """
+        @return number of jobs taken by the dispatch thread, but not executed
+        yet.
+        """
+        return len(self.__batch)
+
     def getCongestion(self):
         with self.__lock:
-            job_cnt = 0
+            job_cnt = len(self.__batch)
             l0 = int(job_cnt / 10) - 100
             l1 = int(len(self.__queue) / 10) - 100
             if l1 > l0:
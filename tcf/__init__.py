@@ -38,9 +38,11 @@ def connect(params, wait=True):
 
 
 def peers():
-    "Return list of discovered remote peers"
+    """Return list of discovered remote peers. Discovery is started by the
+    first call, so peers are added as they respond."""
     locator = protocol.getLocator()
     if locator:
+        protocol.startDiscovery()
         return protocol.invokeAndWait(locator.getPeers)
 
 
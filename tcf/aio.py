@@ -0,0 +1,376 @@
+"""
+asyncio client API for TCF.
+
+The module implements TCF channel framing directly on an asyncio transport,
+so commands and events are handled by the event loop thread, without the
+TCF dispatch thread and without thread handoffs. Many channels and
+thousands of concurrent commands can be driven from one event loop.
+
+Remote services are accessed the same way as with
+tcf.util.sync.CommandControl, every command is a coroutine:
+
+    channel = await tcf.aio.connect("TCP:127.0.0.1:1534")
+    handle = await channel.FileSystem.open("/etc/hosts", 1, None)
+    data, eof = await channel.FileSystem.read(handle, 0, 1024)
+    async for name, args in channel.events("RunControl"):
+        ...
+    await channel.close()
+
+A command raises the error reported by the remote peer, otherwise it
+returns the result arguments; a single result argument is unwrapped.
+While the remote peer reports congestion, a new command waits until the
+commands in flight are done, like tcf.util.transfer.Upload does. Commands
+sent by the remote peer are rejected as not recognized.
+
+This module requires Python 3.7 or later.
+"""
+
+import asyncio
+import collections
+import itertools
+
+from . import errors
+from .channel import toJSONSequence, fromJSONSequence
+from .channel.StreamChannel import StreamDecoder
+from .util.sync import decodeResult
+
+LOCATOR = "Locator"
+
+# maximum number of events waiting in an EventStream
+EVENT_QUEUE_SIZE = 1024
+
+
+def encodeMessage(typeCode, fields, data):
+    """
+    Encode a message in TCF stream framing.
+    @param typeCode - message type character.
+    @param fields - header fields (token, service, name), str.
+    @param data - message data, str or bytearray from toJSONSequence().
+    @return bytes.
+    """
+    res = bytearray(typeCode.encode("ascii"))
+    res.append(0)
+    for f in fields:
+        res += f.encode("UTF-8")
+        res.append(0)
+    if data:
+        if not isinstance(data, bytearray):
+            data = data.encode("UTF-8")
+        res += data.replace(b'\x03', b'\x03\x00')
+    res += b'\x03\x01'
+    return bytes(res)
+
+
+class EventStream(object):
+    """Async iterator over events of a remote service.
+
+    Items are (event name, event arguments) tuples. The stream ends when the
+    channel is closed or close() is called.
+
+    Events are received on the event loop together with command results, so
+    a slow consumer cannot hold back the channel. When maxsize events are
+    waiting, the oldest one is dropped to make room for a new one, and the
+    dropped field counts the events lost this way.
+    """
+
+    def __init__(self, channel, service, name, maxsize=EVENT_QUEUE_SIZE):
+        self.channel = channel
+        self.service = service
+        self.name = name
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, name, args):
+        if self.name is None or self.name == name:
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait((name, args))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.channel._removeEventStream(self)
+            if not self.queue.full():
+                # wake up a waiting consumer
+                self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self.queue.empty():
+            raise StopAsyncIteration
+        item = await self.queue.get()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+
+class ServiceWrapper(object):
+    def __init__(self, channel, service):
+        self._channel = channel
+        self._service = service
+
+    def __getattr__(self, attr):
+        channel = self._channel
+        service = self._service
+
+        def command(*args):
+            return channel.command(service, attr, *args)
+        command.__name__ = attr
+        return command
+
+
+class Channel(asyncio.Protocol):
+    """TCF channel over an asyncio transport."""
+
+    def __init__(self, local_services=("ZeroCopy",)):
+        self.loop = None
+        self.transport = None
+        self.local_services = list(local_services)
+        self.remote_services = None
+        self.zero_copy = False
+        self.remote_congestion_level = 0
+        self.decoder = StreamDecoder()
+        self.pending = {}
+        self.event_streams = collections.defaultdict(list)
+        self.out_buf = []
+        self.flush_scheduled = False
+        self.closed = False
+        self.close_error = None
+        self._tokens = itertools.count(1)
+        self._opened = None
+        self._can_write = None
+        self._uncongested = None
+
+    # asyncio.Protocol interface
+
+    def connection_made(self, transport):
+        self.loop = asyncio.get_running_loop()
+        self.transport = transport
+        self._opened = self.loop.create_future()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self._uncongested = asyncio.Event()
+        self._uncongested.set()
+        self._write(encodeMessage('E', (LOCATOR, "Hello"),
+                                  toJSONSequence((self.local_services,))))
+
+    def data_received(self, data):
+        try:
+            for msg in self.decoder.feed(data):
+                if msg is None:
+                    self._terminate(IOError(
+                        "Communication channel is closed by remote peer"))
+                    self.transport.close()
+                    return
+                self._handleMessage(msg)
+        except Exception as x:
+            self._terminate(x)
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        self._terminate(exc or IOError("Channel is closed"))
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    # message handling
+
+    def _handleMessage(self, msg):
+        typeCode = chr(msg[0])
+        if msg[1:2] != b'\0':
+            raise IOError("Protocol syntax error")
+        if typeCode == 'C':
+            # no local services, reject commands like AbstractChannel does
+            # for services it does not implement
+            end = msg.index(b'\0', 2)
+            self._write(encodeMessage('N', (msg[2:end].decode("UTF-8"),),
+                                      None))
+        elif typeCode in 'RPN':
+            end = msg.index(b'\0', 2)
+            token = msg[2:end].decode("UTF-8")
+            data = msg[end + 1:]
+            if typeCode == 'P':
+                return
+            entry = self.pending.pop(token, None)
+            if entry is None:
+                return
+            self._updateCongestion()
+            future, service, name, args = entry
+            if future.done():
+                return
+            if typeCode == 'N':
+                future.set_exception(errors.ErrorReport(
+                    "Command is not recognized",
+                    errors.TCF_ERROR_INV_COMMAND))
+            else:
+                self._doneCommand(future, service, name, args, data)
+        elif typeCode == 'E':
+            end1 = msg.index(b'\0', 2)
+            end2 = msg.index(b'\0', end1 + 1)
+            service = msg[2:end1].decode("UTF-8")
+            name = msg[end1 + 1:end2].decode("UTF-8")
+            args = fromJSONSequence(msg[end2 + 1:])
+            if service == LOCATOR and name == "Hello":
+                self.remote_services = list(args[0])
+                self.zero_copy = "ZeroCopy" in self.remote_services
+                if not self._opened.done():
+                    self._opened.set_result(self)
+            for stream in list(self.event_streams.get(service, ())):
+                stream._put(name, args)
+        elif typeCode == 'F':
+            data = msg[2:].rstrip(b'\0')
+            self.remote_congestion_level = int(data)
+            self._updateCongestion()
+        else:
+            raise IOError("Protocol syntax error")
+
+    def _doneCommand(self, future, service, name, args, data):
+        try:
+            error, res = decodeResult(service, name, args, data)
+        except Exception as x:
+            error = x
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(res)
+
+    def _updateCongestion(self):
+        if self.pending and self.remote_congestion_level > 0:
+            self._uncongested.clear()
+        else:
+            self._uncongested.set()
+
+    def _terminate(self, error):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_error = error
+        if self._opened is not None and not self._opened.done():
+            self._opened.set_exception(error)
+        pending = list(self.pending.values())
+        self.pending.clear()
+        if self._uncongested is not None:
+            # let waiting commands fail
+            self._can_write.set()
+            self._uncongested.set()
+        for future, service, name, args in pending:
+            if not future.done():
+                future.set_exception(error)
+        for streams in list(self.event_streams.values()):
+            for stream in list(streams):
+                stream.close()
+
+    # output
+
+    def _write(self, data):
+        self.out_buf.append(data)
+        if not self.flush_scheduled:
+            # coalesce messages sent in one loop iteration
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        self.flush_scheduled = False
+        if self.out_buf and not self.transport.is_closing():
+            self.transport.write(b"".join(self.out_buf))
+        del self.out_buf[:]
+
+    # public API
+
+    async def waitOpen(self):
+        """Wait for the Hello message of the remote peer."""
+        return await self._opened
+
+    def getRemoteServices(self):
+        return self.remote_services
+
+    def sendCommand(self, service, name, *args):
+        """
+        Send a command.
+        @return future of the command result.
+        """
+        if self.closed:
+            raise IOError("Channel is closed")
+        token = "A%d" % next(self._tokens)
+        future = self.loop.create_future()
+        self.pending[token] = (future, service, name, args)
+        self._updateCongestion()
+        self._write(encodeMessage(
+            'C', (token, service, name),
+            toJSONSequence(args, self.zero_copy)))
+        return future
+
+    async def command(self, service, name, *args):
+        """Send a command and wait for the result."""
+        while not self._can_write.is_set() or \
+                not self._uncongested.is_set():
+            await self._can_write.wait()
+            await self._uncongested.wait()
+        return await self.sendCommand(service, name, *args)
+
+    def sendEvent(self, service, name, *args):
+        if self.closed:
+            raise IOError("Channel is closed")
+        self._write(encodeMessage('E', (service, name),
+                                  toJSONSequence(args, self.zero_copy)))
+
+    def events(self, service, name=None, maxsize=EVENT_QUEUE_SIZE):
+        """
+        Get async iterator over events of a remote service.
+        @param name - event name, or None for all events of the service.
+        @param maxsize - number of events kept for a slow consumer, see
+                         EventStream.
+        """
+        stream = EventStream(self, service, name, maxsize)
+        if self.closed:
+            stream.close()
+        else:
+            self.event_streams[service].append(stream)
+        return stream
+
+    def _removeEventStream(self, stream):
+        streams = self.event_streams.get(stream.service)
+        if streams and stream in streams:
+            streams.remove(stream)
+
+    async def close(self):
+        """Send end of stream and close the channel."""
+        if self.transport is None or self.transport.is_closing():
+            return
+        self._flush()
+        self.transport.write(b'\x03\x02\x03\x01')
+        self.transport.close()
+        self._terminate(IOError("Channel is closed"))
+
+    def __getattr__(self, attr):
+        services = self.__dict__.get("remote_services")
+        if services and attr in services:
+            return ServiceWrapper(self, attr)
+        raise AttributeError("Unknown service: %s. Use one of %s" %
+                             (attr, services))
+
+
+async def connect(params, local_services=("ZeroCopy",)):
+    """
+    Open a channel and wait for the Hello message of the remote peer.
+    @param params - string "TCP:<host>:<port>" or (host, port) tuple.
+    @return open Channel.
+    """
+    if isinstance(params, str):
+        parts = params.split(":")
+        if len(parts) != 3 or parts[0] != "TCP":
+            raise ValueError("Expected TCP:<host>:<port>, got " + params)
+        host, port = parts[1], int(parts[2])
+    else:
+        host, port = params
+    loop = asyncio.get_running_loop()
+    _, channel = await loop.create_connection(
+        lambda: Channel(local_services), host, port)
+    return await channel.waitOpen()
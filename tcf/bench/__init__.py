@@ -0,0 +1,11 @@
+"""
+Performance benchmarks for TCF framework.
+
+Each module can be run as a script, e.g.:
+    python -m tcf.bench.framing
+
+tcf.bench.suite runs the main benchmarks together and compares the results
+with the baselines saved on the same machine:
+    python -m tcf.bench.suite --save
+    python -m tcf.bench.suite
+"""
@@ -0,0 +1,114 @@
+"""
+Many-channels benchmark.
+
+Opens a number of channels to the in-memory stand-in agent, which runs in a
+separate process, and sends FileSystem.stat commands on all of them
+concurrently. The "threads" mode uses the reader and transmitter threads of
+every channel, the "shared" mode uses the shared I/O loop, see
+tcf.channel.IOLoop. Each mode runs in a new interpreter and reports the
+number of threads, resident memory used by the open channels, the time to
+open them and the command throughput.
+
+Usage: python -m tcf.bench.channels [channels] [commands per channel]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+AGENT = r'''
+import sys
+from tcf.bench.fsagent import StandInFileSystem
+agent = StandInFileSystem()
+agent.files["/stat"] = bytearray(b"stat\n")
+print(agent.port)
+sys.stdout.flush()
+agent.run()
+'''
+
+CLIENT = r'''
+import json, os, sys, threading, time
+import tcf
+from tcf import protocol
+from tcf.channel import IOLoop
+from tcf.services import filesystem
+port, mode, count, commands = sys.argv[1], sys.argv[2], int(sys.argv[3]), \
+    int(sys.argv[4])
+
+def rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except IOError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+if mode == "shared":
+    IOLoop.enable()
+protocol.startEventQueue()
+mem0 = rss()
+t0 = time.time()
+channels = [tcf.connect("TCP:127.0.0.1:" + port) for i in range(count)]
+t1 = time.time()
+mem1 = rss()
+threads = threading.active_count()
+finished = threading.Event()
+left = [count * commands]
+
+class DoneStat(filesystem.DoneStat):
+    def doneStat(self, token, error, attrs):
+        left[0] -= 1
+        if not left[0]:
+            finished.set()
+
+def send():
+    for c in channels:
+        fs = c.getRemoteService(filesystem.NAME)
+        for i in range(commands):
+            fs.stat("/stat", DoneStat())
+t2 = time.time()
+protocol.invokeLater(send)
+finished.wait()
+t3 = time.time()
+for c in channels:
+    protocol.invokeAndWait(c.close)
+print(json.dumps([threads, mem1 - mem0, t1 - t0, t3 - t2]))
+'''
+
+
+def run(script, args, env, **kwargs):
+    return subprocess.Popen([sys.executable, "-c", script] + args, env=env,
+                            stdout=subprocess.PIPE, **kwargs)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 500
+    commands = int(argv[1]) if len(argv) > 1 else 20
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    agent = run(AGENT, [], env)
+    try:
+        port = agent.stdout.readline().decode("ascii").strip()
+        print("%d channels, %d stat commands per channel" %
+              (count, commands))
+        print("%-8s %8s %10s %10s %12s" %
+              ("mode", "threads", "memory MB", "open s", "commands/s"))
+        for mode in ("threads", "shared"):
+            client = run(CLIENT, [port, mode, str(count), str(commands)],
+                         env)
+            out = client.communicate()[0]
+            threads, mem, t_open, t_cmds = json.loads(out.decode("ascii"))
+            print("%-8s %8d %10.1f %10.2f %12.0f" %
+                  (mode, threads, mem / 1048576.0, t_open,
+                   count * commands / t_cmds))
+    finally:
+        agent.kill()
+        agent.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+JSON codec benchmark.
+
+Encodes message arguments with toJSONSequence() and decodes them with
+fromJSONSequence(), with every installed JSON codec, see
+tcf.channel.setCodec(). The arguments are those of typical messages: a
+RunControl context, a FileSystem directory listing, and a 64 KB
+FileSystem.read reply with base64 and with ZeroCopy data. Reports messages
+per second and MB/s of encoded data.
+
+Usage: python -m tcf.bench.codec [seconds per measurement]
+"""
+
+import sys
+import time
+
+from .. import channel
+
+CONTEXT = ({"ID": "P1.T1", "ParentID": "P1", "ProcessID": "P1",
+            "Name": "main", "CanSuspend": True, "CanResume": 15,
+            "CanCount": 6, "CanTerminate": True, "HasState": True,
+            "IsContainer": False},)
+
+LISTING = ([{"FileName": "file%d" % i,
+             "Attrs": {"Size": i * 1000, "UID": 1000, "GID": 1000,
+                       "Permissions": 0o100644,
+                       "ATime": 1700000000000 + i,
+                       "MTime": 1700000000000 + i}}
+            for i in range(256)], None, False)
+
+READ = (bytearray(i & 0xff for i in range(0x10000)), None, False)
+
+MESSAGES = (("context", CONTEXT, False), ("listing", LISTING, False),
+            ("read base64", READ, False), ("read ZeroCopy", READ, True))
+
+
+def rate(fn, duration):
+    """@return calls of fn per second."""
+    cnt = 0
+    t0 = time.time()
+    while True:
+        for i in range(10):
+            fn()
+        cnt += 10
+        t = time.time() - t0
+        if t >= duration:
+            return cnt / t
+
+
+def measure(args, zero_copy, duration):
+    """@return encode rate, decode rate, size of encoded arguments."""
+    data = channel.toJSONSequence(args, zero_copy)
+    if not isinstance(data, bytearray):
+        data = bytearray(data.encode("UTF-8"))
+    encode = rate(lambda: channel.toJSONSequence(args, zero_copy), duration)
+    decode = rate(lambda: channel.fromJSONSequence(data), duration)
+    return encode, decode, len(data)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    duration = float(argv[0]) if len(argv) > 0 else 1.0
+    default = channel.getCodec()
+    try:
+        for name, cls in channel.CODECS:
+            try:
+                channel.setCodec(name)
+            except ImportError:
+                print("%-7s not installed" % name)
+                continue
+            for msg, args, zero_copy in MESSAGES:
+                encode, decode, size = measure(args, zero_copy, duration)
+                print("%-7s %-14s %7d bytes  encode %9.0f msgs/s %8.1f MB/s"
+                      "  decode %9.0f msgs/s %8.1f MB/s" %
+                      (name, msg, size, encode, encode * size / 1e6,
+                       decode, decode * size / 1e6))
+    finally:
+        channel.setCodec(default)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Multi-channel decode benchmark.
+
+Opens a number of channels to the loopback agent, which runs in a separate
+process, and sends pipelined Diagnostics.echo commands with a directory
+listing as payload on all of them, so that every result has to be decoded.
+The results are decoded on the dispatch thread ("dispatch"), on the reader
+thread of every channel ("reader") or by a pool of decoder threads ("pool"),
+see tcf.channel.DecodePool, with the reader threads of every channel
+("threads") and with the shared I/O loop ("shared"), see
+tcf.channel.IOLoop. Each mode runs in a new interpreter and reports results
+and MB of result data per second, and the share of the time that the
+dispatch thread was busy.
+
+Usage: python -m tcf.bench.decode [channels] [commands per channel]
+                                  [commands in flight per channel]
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from .suite import startAgent
+
+CLIENT = r'''
+import json, sys, threading, time
+import tcf
+from tcf import channel, protocol
+from tcf.channel import DecodePool, IOLoop
+from tcf.services import diagnostics
+target, decode, io, count, commands, inflight = sys.argv[1:4] + \
+    [int(a) for a in sys.argv[4:]]
+
+LISTING = [{"FileName": "file%d" % i,
+            "Attrs": {"Size": i * 1000, "UID": 1000, "GID": 1000,
+                      "Permissions": 0o100644,
+                      "ATime": 1700000000000 + i,
+                      "MTime": 1700000000000 + i}}
+           for i in range(64)]
+size = len(channel.toJSONSequence((LISTING,)))
+
+if decode == "reader":
+    DecodePool.enable()
+elif decode == "pool":
+    DecodePool.enable(threads=2)
+if io == "shared":
+    IOLoop.enable()
+protocol.startEventQueue()
+channels = [tcf.connect(target) for i in range(count)]
+finished = threading.Event()
+left = [count * commands]
+
+class DoneEcho(diagnostics.DoneEcho):
+    def __init__(self, service, sent):
+        self.service = service
+        self.sent = sent
+
+    def doneEcho(self, token, error, s):
+        assert error is None and len(s) == len(LISTING)
+        left[0] -= 1
+        if not left[0]:
+            finished.set()
+        elif self.sent[0] < commands:
+            self.sent[0] += 1
+            self.service.echo(LISTING, self)
+
+def send():
+    for c in channels:
+        service = c.getRemoteService(diagnostics.NAME)
+        done = DoneEcho(service, [min(inflight, commands)])
+        for i in range(done.sent[0]):
+            service.echo(LISTING, done)
+
+cpu0 = protocol.invokeAndWait(time.thread_time)
+t0 = time.time()
+protocol.invokeLater(send)
+finished.wait()
+t1 = time.time()
+cpu1 = protocol.invokeAndWait(time.thread_time)
+for c in channels:
+    protocol.invokeAndWait(c.close)
+print(json.dumps([t1 - t0, cpu1 - cpu0, size]))
+'''
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 8
+    commands = int(argv[1]) if len(argv) > 1 else 2000
+    inflight = int(argv[2]) if len(argv) > 2 else 16
+    root = tempfile.mkdtemp(prefix="tcfbench")
+    agent, target = startAgent(root)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))) + os.pathsep + env.get("PYTHONPATH", "")
+    try:
+        print("%d channels, %d echo commands per channel, %d in flight" %
+              (count, commands, inflight))
+        print("%-9s %-8s %10s %8s %14s" %
+              ("decode", "io", "results/s", "MB/s", "dispatch busy"))
+        for io in ("threads", "shared"):
+            for decode in ("dispatch", "reader", "pool"):
+                client = subprocess.Popen(
+                    [sys.executable, "-c", CLIENT, target, decode, io,
+                     str(count), str(commands), str(inflight)],
+                    env=env, stdout=subprocess.PIPE)
+                out = client.communicate()[0]
+                t, cpu, size = json.loads(out.decode("ascii"))
+                results = count * commands / t
+                print("%-9s %-8s %10.0f %8.1f %13.0f%%" %
+                      (decode, io, results, results * size / 1e6,
+                       cpu * 100 / t))
+    finally:
+        agent.kill()
+        agent.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Delta upload benchmark.
+
+A remote image is kept by the in-memory stand-in FileSystem agent, the
+local copy has a given percentage of its bytes changed in scattered 4 KB
+patches. The image is uploaded once in full and once with DeltaUpload, and
+the bytes sent to and received from the agent are reported for both. The
+result is verified against the local image.
+
+Usage: python -m tcf.bench.delta [size_mb] [changed_percent] [chunk_size]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from .. import connect, protocol
+from ..util import transfer
+from .fsagent import StandInFileSystem
+
+PATCH_SIZE = 0x1000
+
+
+def makeImages(size, percent, seed=1):
+    """@return (remote image bytearray, local image bytes)."""
+    rnd = random.Random(seed)
+    remote = bytearray(os.urandom(size))
+    local = bytearray(remote)
+    patches = max(1, int(size * percent / 100.0) // PATCH_SIZE)
+    for i in range(patches):
+        pos = rnd.randrange(0, max(1, size - PATCH_SIZE))
+        local[pos:pos + PATCH_SIZE] = os.urandom(PATCH_SIZE)
+    return remote, bytes(local)
+
+
+def measure(channel, agent, path, local_path, remote, delta, chunk_size):
+    agent.files[path] = bytearray(remote)
+    agent.resetCounters()
+    t0 = time.time()
+    with open(local_path, 'rb') as f:
+        if delta:
+            transfer.deltaUpload(channel, path, f, chunk_size)
+        else:
+            transfer.upload(channel, path, f, chunk_size)
+    t = time.time() - t0
+    return agent.bytes_in, agent.bytes_out, t
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = int(float(argv[0]) * 0x100000) if len(argv) > 0 else 0x20000000
+    percent = float(argv[1]) if len(argv) > 1 else 1.0
+    chunk_size = int(argv[2]) if len(argv) > 2 else transfer.CHUNK_SIZE
+    remote, local = makeImages(size, percent)
+    fd, local_path = tempfile.mkstemp(prefix="tcf-bench-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(local)
+        agent = StandInFileSystem()
+        agent.start()
+        protocol.startEventQueue()
+        channel = connect("TCP:127.0.0.1:%d" % agent.port)
+        path = "/image.bin"
+        print("%d MB image, %.2f%% changed, %d byte blocks" %
+              (size >> 20, percent, chunk_size))
+        for name, delta in (("full upload", False), ("delta upload", True)):
+            sent, received, t = measure(channel, agent, path, local_path,
+                                        remote, delta, chunk_size)
+            assert agent.files[path] == local
+            print("%-13s %12d bytes sent %12d bytes received %8.3f s" %
+                  (name, sent, received, t))
+        protocol.invokeAndWait(channel.close)
+        agent.close()
+    finally:
+        os.remove(local_path)
+
+
+if __name__ == '__main__':
+    main()
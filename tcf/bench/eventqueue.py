@@ -0,0 +1,60 @@
+"""
+EventQueue benchmark.
+
+Measures invokeLater() throughput in jobs/s, with jobs posted by another
+thread in a burst and with each job posting the next one from the dispatch
+thread.
+"""
+
+import sys
+import threading
+import time
+
+from ..EventQueue import EventQueue
+
+
+def measureBurst(queue, count):
+    done = threading.Event()
+    cnt = [0]
+
+    def job():
+        cnt[0] += 1
+        if cnt[0] == count:
+            done.set()
+    t0 = time.time()
+    for i in range(count):
+        queue.invokeLater(job)
+    done.wait()
+    return time.time() - t0
+
+
+def measureChain(queue, count):
+    done = threading.Event()
+
+    def job(n):
+        if n == count:
+            done.set()
+        else:
+            queue.invokeLater(job, n + 1)
+    t0 = time.time()
+    queue.invokeLater(job, 1)
+    done.wait()
+    return time.time() - t0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 200000
+    queue = EventQueue()
+    queue.start()
+    try:
+        for name, fn in (("burst", measureBurst), ("chain", measureChain)):
+            t = fn(queue, count)
+            print("%-6s %8d jobs %8.3f s %10.0f jobs/s" %
+                  (name, count, t, count / t))
+    finally:
+        queue.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Message framing benchmark.
+
+A stand-in agent thread listens on a local loopback TCP port and streams a
+pre-encoded sequence of FileSystem.read-like replies. The client side decodes
+the messages with ReaderThread.readMessage(), once using per-byte
+StreamChannel.read() calls (the old decoder) and once using bulk
+StreamChannel.readBytes(), and reports throughput in MB/s.
+"""
+
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+
+from ..channel.AbstractChannel import AbstractChannel, ReaderThread
+from ..channel.StreamChannel import StreamChannel, ESC
+
+
+def encodeMessage(typeCode, fields, data):
+    """Encode message in StreamChannel wire format.
+    @param typeCode - message type character.
+    @param fields - list of message header fields (token, service, name).
+    @param data - message payload bytes.
+    @return bytes, message with EOM marker.
+    """
+    res = bytearray(typeCode.encode("UTF8"))
+    res.append(0)
+    for f in fields:
+        res += f.encode("UTF8")
+        res.append(0)
+    res += data.replace(bytes((ESC,)), bytes((ESC, 0)))
+    res += bytes((ESC, 1))
+    return bytes(res)
+
+
+def makeReadReplies(count, size):
+    """Make a stream of FileSystem.read replies carrying size bytes each."""
+    payload = bytes(bytearray(i & 0xff for i in range(size)))
+    data = json.dumps(base64.b64encode(payload).decode("ascii"))
+    data = (data + "\0null\0false\0").encode("UTF8")
+    stream = bytearray()
+    for i in range(count):
+        stream += encodeMessage('R', (str(i),), data)
+    stream += bytes((ESC, 2, ESC, 1))
+    return bytes(stream)
+
+
+class StandInAgent(threading.Thread):
+    """Loopback server that sends the same byte stream to every client."""
+
+    def __init__(self, stream):
+        super(StandInAgent, self).__init__(name="TCF Bench Agent")
+        self.daemon = True
+        self.stream = stream
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                conn.sendall(self.stream)
+            except socket.error:
+                pass
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class SocketChannel(StreamChannel):
+    """Minimal stream channel that only reads from a connected socket."""
+
+    def __init__(self, port, per_byte=False):
+        super(SocketChannel, self).__init__(None)
+        self.socket = socket.create_connection(("127.0.0.1", port))
+        if per_byte:
+            self.readBytes = self.readBytesPerByte
+
+    def readBytesPerByte(self, end, buf):
+        return AbstractChannel.readBytes(self, end, buf)
+
+    def getBuf(self, buf):
+        return self.socket.recv_into(buf)
+
+    def stop(self):
+        self.socket.close()
+
+
+def measure(port, per_byte):
+    channel = SocketChannel(port, per_byte)
+    reader = ReaderThread(channel, None)
+    nbytes = 0
+    cnt = 0
+    t0 = time.time()
+    while True:
+        msg = reader.readMessage()
+        if msg is None:
+            break
+        nbytes += len(msg.data)
+        cnt += 1
+    t = time.time() - t0
+    channel.stop()
+    return cnt, nbytes, t
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 2000
+    size = int(argv[1]) if len(argv) > 1 else 0x4000
+    agent = StandInAgent(makeReadReplies(count, size))
+    agent.start()
+    try:
+        for name, per_byte in (("per-byte read()", True),
+                               ("bulk readBytes()", False)):
+            cnt, nbytes, t = measure(agent.port, per_byte)
+            print("%-18s %6d msgs %10d bytes %8.3f s %8.2f MB/s" %
+                  (name, cnt, nbytes, t, nbytes / t / 1e6))
+    finally:
+        agent.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+In-memory FileSystem stand-in agent for transfer benchmarks.
+
+The agent listens on a local loopback TCP port and serves a subset of the
+FileSystem service (open, close, read, write, stat, fstat, fsetstat) over
+files kept in memory, with ZeroCopy binary data. It counts bytes received
+from and sent to the clients.
+
+A slow link can be simulated: replies are delayed by latency seconds, and
+every connection sends and receives at most rate bytes per second in each
+direction, as a single TCP connection limited by its window would.
+"""
+
+import socket
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # @UnresolvedImport
+
+from .. import errors
+from ..channel import toJSONSequence, fromJSONSequence, toByteArray
+from ..channel.AbstractChannel import Message, ReaderThread
+from ..channel.StreamChannel import StreamChannel
+from ..services import filesystem
+
+
+class _Pacer(object):
+    """Limits a byte stream to rate bytes per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.time = time.time()
+
+    def pace(self, n):
+        now = time.time()
+        self.time = max(self.time, now) + float(n) / self.rate
+        if self.time > now:
+            time.sleep(self.time - now)
+
+
+class AgentChannel(StreamChannel):
+    """Server side stream channel over a connected socket."""
+
+    def __init__(self, sock, agent):
+        super(AgentChannel, self).__init__(None)
+        self.socket = sock
+        self.agent = agent
+        self.in_pacer = self.out_pacer = None
+        if agent.rate:
+            self.in_pacer = _Pacer(agent.rate)
+            self.out_pacer = _Pacer(agent.rate)
+        self.delayed = None
+        if agent.latency or agent.rate:
+            self.delayed = queue.Queue()
+            t = threading.Thread(target=self._sendDelayed,
+                                 name="TCF Bench FileSystem Sender")
+            t.daemon = True
+            t.start()
+
+    def getBuf(self, buf):
+        n = self.socket.recv_into(buf)
+        self.agent.bytes_in += n
+        if self.in_pacer is not None and n > 0:
+            self.in_pacer.pace(n)
+        return n
+
+    def putBufs(self, bufs):
+        if self.delayed is not None:
+            self.delayed.put((time.time() + self.agent.latency,
+                              b"".join(bytes(b) for b in bufs)))
+            return
+        for buf in bufs:
+            self.socket.sendall(buf)
+            self.agent.bytes_out += len(buf)
+
+    def stopSender(self):
+        if self.delayed is not None:
+            self.delayed.put(None)
+
+    def _sendDelayed(self):
+        while True:
+            item = self.delayed.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if self.out_pacer is not None:
+                self.out_pacer.pace(len(data))
+            try:
+                self.socket.sendall(data)
+            except socket.error:
+                return
+            self.agent.bytes_out += len(data)
+
+
+class StandInFileSystem(threading.Thread):
+    """Loopback FileSystem server, every connection is served by its own
+    thread. Files are bytearrays in the files dictionary.
+
+    @param latency - seconds every reply is delayed by.
+    @param rate - bytes per second limit of every connection, or None.
+    """
+
+    def __init__(self, latency=0, rate=None):
+        super(StandInFileSystem, self).__init__(name="TCF Bench FileSystem")
+        self.daemon = True
+        self.latency = latency
+        self.rate = rate
+        self.files = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+
+    def resetCounters(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            t = threading.Thread(target=self.serve, args=(conn,),
+                                 name="TCF Bench FileSystem Connection")
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        self.sock.close()
+
+    def serve(self, conn):
+        channel = AgentChannel(conn, self)
+        reader = ReaderThread(channel, None)
+        handles = {}
+        self._send(channel, 'E', None, "Locator", "Hello",
+                   (["FileSystem", "ZeroCopy"],))
+        try:
+            while True:
+                msg = reader.readMessage()
+                if msg is None:
+                    break
+                if msg.type != 'C':
+                    continue
+                if msg.service != "FileSystem":
+                    self._send(channel, 'N', msg.token)
+                    continue
+                args = fromJSONSequence(msg.data)
+                with self.lock:
+                    res = self.command(handles, msg.name, args)
+                if res is None:
+                    self._send(channel, 'N', msg.token)
+                else:
+                    self._send(channel, 'R', msg.token, data=res)
+        except (IOError, socket.error):
+            pass
+        channel.stopSender()
+        conn.close()
+
+    def _send(self, channel, typeCode, token, service=None, name=None,
+              data=None):
+        msg = Message(typeCode)
+        msg.token = token
+        msg.service = service
+        msg.name = name
+        msg.data = toJSONSequence(data, True)
+        channel.writeMessage(msg)
+        channel.flush()
+
+    def _error(self, code, text):
+        return {errors.ERROR_CODE: code, errors.ERROR_FORMAT: text}
+
+    def _attrs(self, data):
+        return {"Size": len(data), "Permissions": 0o100644}
+
+    def command(self, handles, name, args):
+        """Execute a FileSystem command.
+        @return list of reply arguments, or None if the command is unknown.
+        """
+        if name == "open":
+            path, flags = args[0], args[1]
+            if path not in self.files:
+                if not flags & filesystem.TCF_O_CREAT:
+                    return [self._error(filesystem.STATUS_NO_SUCH_FILE,
+                                        "No such file"), None]
+                self.files[path] = bytearray()
+            if flags & filesystem.TCF_O_TRUNC:
+                del self.files[path][:]
+            handle = "FS%d" % len(handles)
+            while handle in handles:
+                handle += "_"
+            handles[handle] = path
+            return [None, handle]
+        if name == "close":
+            handles.pop(args[0], None)
+            return [None]
+        if name in ("stat", "fstat"):
+            path = handles.get(args[0]) if name == "fstat" else args[0]
+            if path not in self.files:
+                return [self._error(filesystem.STATUS_NO_SUCH_FILE,
+                                    "No such file"), None]
+            return [None, self._attrs(self.files[path])]
+        if name == "read":
+            data = self.files[handles[args[0]]]
+            offset, length = args[1], args[2]
+            res = data[offset:offset + length]
+            return [res, None, offset + len(res) >= len(data)]
+        if name == "write":
+            data = self.files[handles[args[0]]]
+            offset, buf = args[1], toByteArray(args[2])
+            if len(data) < offset:
+                data.extend(bytearray(offset - len(data)))
+            data[offset:offset + len(buf)] = buf
+            return [None]
+        if name == "fsetstat":
+            data = self.files[handles[args[0]]]
+            size = args[1].get("Size")
+            if size is not None:
+                if size < len(data):
+                    del data[size:]
+                else:
+                    data.extend(bytearray(size - len(data)))
+            return [None]
+        return None
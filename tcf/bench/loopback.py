@@ -0,0 +1,769 @@
+"""
+Pure Python loopback TCF agent.
+
+The agent listens on a localhost TCP port and serves real TCF channels,
+ChannelTCP over accepted sockets, with command servers registered through
+addCommandServer and replies and events sent with sendResult and
+sendEvent. It provides:
+
+  FileSystem   - files of a local directory, which is the root "/".
+  Memory       - one memory context backed by a bytearray.
+  RunControl   - a synthetic process with a number of threads that can be
+                 suspended, resumed and stepped.
+  Registers    - 16 32-bit registers of every thread, PC follows RunControl.
+  StackTrace   - a fixed number of synthetic frames of suspended threads.
+  Diagnostics  - echo commands.
+
+Throughput and latency of the client code paths can be measured against it
+on any machine, without a tcf-agent on a board. The agent runs on the
+dispatch thread of the process; run it in a separate process, so that it
+does not share the interpreter with the client being measured:
+
+    python -m tcf.bench.loopback [root directory] [port]
+"""
+
+import errno
+import os
+import posixpath
+import shutil
+import socket
+import stat
+import sys
+import threading
+import time
+
+from .. import errors, peer, protocol, services
+from .. import channel as tcfchannel
+from ..channel import fromJSONSequence, toJSONSequence, toByteArray
+from ..channel.ChannelTCP import ChannelTCP
+from ..services import diagnostics, filesystem, memory, registers, \
+    runcontrol, stacktrace
+
+MEMORY_SIZE = 0x100000
+THREADS = 4
+STACK_DEPTH = 8
+READDIR_COUNT = 64
+
+PROCESS_ID = "P1"
+REGISTER_NAMES = ["R%d" % i for i in range(13)] + ["SP", "LR", "PC"]
+REGISTER_SIZE = 4
+
+# position of the error report in results of failed commands
+_ERR = object()
+
+
+def _errorReport(code, text, alt_code=None):
+    report = {errors.ERROR_TIME: int(time.time() * 1000),
+              errors.ERROR_CODE: code,
+              errors.ERROR_FORMAT: text}
+    if alt_code is not None:
+        report[errors.ERROR_ALT_CODE] = alt_code
+        report[errors.ERROR_ALT_ORG] = "POSIX"
+    return report
+
+
+def _osErrorReport(x):
+    if x.errno == errno.ENOENT:
+        code = filesystem.STATUS_NO_SUCH_FILE
+    elif x.errno in (errno.EACCES, errno.EPERM):
+        code = filesystem.STATUS_PERMISSION_DENIED
+    else:
+        code = errors.TCF_ERROR_OTHER
+    return _errorReport(code, x.strerror or str(x), x.errno)
+
+
+class _Error(Exception):
+    """Command failure, replied with an error report."""
+
+    def __init__(self, code, text):
+        super(_Error, self).__init__(text)
+        self.report = _errorReport(code, text)
+
+
+class _LocalService(services.Service):
+    def __init__(self, name):
+        self.name = name
+
+    def getName(self):
+        return self.name
+
+
+class _CommandServer(tcfchannel.CommandServer):
+    """Serves the commands of one service on one channel.
+
+    Commands are methods named after the commands, listed in commands. They
+    get the decoded arguments and return the result arguments. _Error and
+    OSError are replied with the result of error_results, where the error
+    report replaces _ERR.
+    """
+
+    name = None
+    commands = ()
+    error_results = {}
+
+    def __init__(self, agent, channel):
+        self.agent = agent
+        self.channel = channel
+        self.service = _LocalService(self.name)
+
+    def command(self, token, name, data):
+        if name not in self.commands:
+            self.channel.rejectCommand(token)
+            return
+        try:
+            args = fromJSONSequence(data) if data else []
+            try:
+                res = getattr(self, name)(*args)
+            except _Error as x:
+                res = self._errorResult(name, x.report)
+            except (OSError, IOError) as x:
+                res = self._errorResult(name, _osErrorReport(x))
+            self.channel.sendResult(token, toJSONSequence(
+                res, self.channel.isZeroCopySupported()))
+        except Exception as x:
+            self.channel.terminate(x)
+
+    def _errorResult(self, name, report):
+        return [report if r is _ERR else r
+                for r in self.error_results.get(name, (_ERR,))]
+
+    def onClose(self):
+        pass
+
+
+class FileSystemServer(_CommandServer):
+    name = filesystem.NAME
+    commands = ("open", "close", "read", "write", "stat", "lstat", "fstat",
+                "setstat", "fsetstat", "opendir", "readdir", "mkdir",
+                "rmdir", "roots", "remove", "realpath", "rename", "readlink",
+                "symlink", "copy", "user")
+    error_results = {
+        "open": (_ERR, None), "read": (None, _ERR, False),
+        "stat": (_ERR, None), "lstat": (_ERR, None), "fstat": (_ERR, None),
+        "opendir": (_ERR, None), "readdir": (None, _ERR, True),
+        "roots": (None, _ERR), "realpath": (_ERR, None),
+        "readlink": (_ERR, None)}
+
+    def __init__(self, agent, channel):
+        super(FileSystemServer, self).__init__(agent, channel)
+        self.handles = {}
+        self.handle_cnt = 0
+
+    def onClose(self):
+        for h in self.handles.values():
+            if isinstance(h, int):
+                os.close(h)
+        self.handles.clear()
+
+    def _path(self, path):
+        path = posixpath.normpath("/" + path)
+        return os.path.join(self.agent.root, path.lstrip("/"))
+
+    def _remotePath(self, local):
+        rel = os.path.relpath(local, self.agent.root)
+        if rel == os.curdir:
+            return "/"
+        if rel.startswith(os.pardir):
+            return local
+        return "/" + rel.replace(os.sep, "/")
+
+    def _addHandle(self, obj):
+        self.handle_cnt += 1
+        h = "FS%d" % self.handle_cnt
+        self.handles[h] = obj
+        return h
+
+    def _getHandle(self, h, directory=False):
+        obj = self.handles.get(h)
+        if obj is None or isinstance(obj, int) == directory:
+            raise _Error(errors.TCF_ERROR_OTHER, "Invalid file handle")
+        return obj
+
+    def _attrs(self, st):
+        return {"Size": st.st_size, "UID": st.st_uid, "GID": st.st_gid,
+                "Permissions": st.st_mode,
+                "ATime": int(st.st_atime * 1000),
+                "MTime": int(st.st_mtime * 1000)}
+
+    def _setAttrs(self, path, fd, attrs):
+        if "Size" in attrs:
+            if fd is not None:
+                os.ftruncate(fd, attrs["Size"])
+            else:
+                with open(path, "r+b") as f:
+                    f.truncate(attrs["Size"])
+        target = fd if fd is not None else path
+        if "Permissions" in attrs:
+            os.chmod(target, stat.S_IMODE(attrs["Permissions"]))
+        if "UID" in attrs and "GID" in attrs:
+            st = os.fstat(fd) if fd is not None else os.stat(path)
+            if (st.st_uid, st.st_gid) != (attrs["UID"], attrs["GID"]):
+                os.chown(target, attrs["UID"], attrs["GID"])
+        if "ATime" in attrs and "MTime" in attrs:
+            os.utime(target, (attrs["ATime"] / 1000.0,
+                              attrs["MTime"] / 1000.0))
+
+    def open(self, path, flags, attrs):
+        mode = 0
+        if flags & filesystem.TCF_O_READ and flags & filesystem.TCF_O_WRITE:
+            mode = os.O_RDWR
+        elif flags & filesystem.TCF_O_WRITE:
+            mode = os.O_WRONLY
+        if flags & filesystem.TCF_O_APPEND:
+            mode |= os.O_APPEND
+        if flags & filesystem.TCF_O_CREAT:
+            mode |= os.O_CREAT
+        if flags & filesystem.TCF_O_TRUNC:
+            mode |= os.O_TRUNC
+        if flags & filesystem.TCF_O_EXCL:
+            mode |= os.O_EXCL
+        perms = 0o666
+        if attrs and "Permissions" in attrs:
+            perms = stat.S_IMODE(attrs["Permissions"])
+        fd = os.open(self._path(path), mode | getattr(os, "O_BINARY", 0),
+                     perms)
+        return [None, self._addHandle(fd)]
+
+    def close(self, h):
+        obj = self.handles.pop(h, None)
+        if obj is None:
+            raise _Error(errors.TCF_ERROR_OTHER, "Invalid file handle")
+        if isinstance(obj, int):
+            os.close(obj)
+        return [None]
+
+    def read(self, h, offset, length):
+        fd = self._getHandle(h)
+        os.lseek(fd, offset, os.SEEK_SET)
+        data = bytearray(os.read(fd, length))
+        return [data, None, len(data) < length]
+
+    def write(self, h, offset, data):
+        fd = self._getHandle(h)
+        data = toByteArray(data)
+        os.lseek(fd, offset, os.SEEK_SET)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        return [None]
+
+    def stat(self, path):
+        return [None, self._attrs(os.stat(self._path(path)))]
+
+    def lstat(self, path):
+        return [None, self._attrs(os.lstat(self._path(path)))]
+
+    def fstat(self, h):
+        return [None, self._attrs(os.fstat(self._getHandle(h)))]
+
+    def setstat(self, path, attrs):
+        self._setAttrs(self._path(path), None, attrs or {})
+        return [None]
+
+    def fsetstat(self, h, attrs):
+        self._setAttrs(None, self._getHandle(h), attrs or {})
+        return [None]
+
+    def opendir(self, path):
+        local = self._path(path)
+        names = sorted(os.listdir(local))
+        return [None, self._addHandle([local, names])]
+
+    def readdir(self, h):
+        d = self._getHandle(h, True)
+        local, names = d
+        entries = []
+        for name in names[:READDIR_COUNT]:
+            try:
+                attrs = self._attrs(os.lstat(os.path.join(local, name)))
+            except OSError:
+                attrs = None
+            entries.append({"FileName": name, "Attrs": attrs})
+        del names[:READDIR_COUNT]
+        return [entries, None, not names]
+
+    def mkdir(self, path, attrs):
+        perms = 0o777
+        if attrs and "Permissions" in attrs:
+            perms = stat.S_IMODE(attrs["Permissions"])
+        os.mkdir(self._path(path), perms)
+        return [None]
+
+    def rmdir(self, path):
+        os.rmdir(self._path(path))
+        return [None]
+
+    def roots(self):
+        return [[{"FileName": "/",
+                  "Attrs": self._attrs(os.stat(self.agent.root))}], None]
+
+    def remove(self, path):
+        os.remove(self._path(path))
+        return [None]
+
+    def realpath(self, path):
+        return [None, self._remotePath(os.path.realpath(self._path(path)))]
+
+    def rename(self, old_path, new_path):
+        os.rename(self._path(old_path), self._path(new_path))
+        return [None]
+
+    def readlink(self, path):
+        return [None, os.readlink(self._path(path))]
+
+    def symlink(self, link_path, target_path):
+        os.symlink(target_path, self._path(link_path))
+        return [None]
+
+    def copy(self, src_path, dst_path, copy_permissions, copy_ownership):
+        src = self._path(src_path)
+        dst = self._path(dst_path)
+        shutil.copyfile(src, dst)
+        st = os.stat(src)
+        if copy_permissions:
+            os.chmod(dst, stat.S_IMODE(st.st_mode))
+        if copy_ownership:
+            os.chown(dst, st.st_uid, st.st_gid)
+        return [None]
+
+    def user(self):
+        getuid = getattr(os, "getuid", lambda: 0)
+        geteuid = getattr(os, "geteuid", getuid)
+        getgid = getattr(os, "getgid", lambda: 0)
+        getegid = getattr(os, "getegid", getgid)
+        return [getuid(), geteuid(), getgid(), getegid(), "/"]
+
+
+class MemoryServer(_CommandServer):
+    name = memory.NAME
+    commands = ("getContext", "getChildren", "get", "set", "fill")
+    error_results = {"getContext": (_ERR, None), "getChildren": (_ERR, None),
+                     "get": (None, _ERR, None), "set": (_ERR, None),
+                     "fill": (_ERR, None)}
+
+    def _check(self, ctx_id, addr, size):
+        if ctx_id != PROCESS_ID and ctx_id not in self.agent.threads:
+            raise _Error(errors.TCF_ERROR_INV_CONTEXT, "Invalid context")
+        if addr < 0 or size < 0 or addr + size > len(self.agent.memory):
+            raise _Error(errors.TCF_ERROR_INV_ADDRESS, "Invalid address")
+
+    def getContext(self, ctx_id):
+        if ctx_id != PROCESS_ID:
+            raise _Error(errors.TCF_ERROR_INV_CONTEXT, "Invalid context")
+        return [None, {memory.PROP_ID: PROCESS_ID,
+                       memory.PROP_NAME: "loopback",
+                       memory.PROP_BIG_ENDIAN: False,
+                       memory.PROP_ADDRESS_SIZE: 4,
+                       memory.PROP_START_BOUND: 0,
+                       memory.PROP_END_BOUND: len(self.agent.memory) - 1}]
+
+    def getChildren(self, parent_id):
+        return [None, [PROCESS_ID] if parent_id is None else []]
+
+    def get(self, ctx_id, addr, word_size, size, mode):
+        self._check(ctx_id, addr, size)
+        return [self.agent.memory[addr:addr + size], None, None]
+
+    def set(self, ctx_id, addr, word_size, size, mode, data):
+        data = toByteArray(data)
+        self._check(ctx_id, addr, len(data))
+        self.agent.memory[addr:addr + len(data)] = data
+        self.agent.sendEvent(memory.NAME, "memoryChanged",
+                             (PROCESS_ID, [{"addr": addr,
+                                            "size": len(data)}]))
+        return [None, None]
+
+    def fill(self, ctx_id, addr, word_size, size, mode, value):
+        self._check(ctx_id, addr, size)
+        value = bytearray(value or [0])
+        pattern = value * (size // len(value) + 1)
+        self.agent.memory[addr:addr + size] = pattern[:size]
+        self.agent.sendEvent(memory.NAME, "memoryChanged",
+                             (PROCESS_ID, [{"addr": addr, "size": size}]))
+        return [None, None]
+
+
+class _Thread(object):
+    """Synthetic thread of the loopback process."""
+
+    def __init__(self, index):
+        self.id = "%s.T%d" % (PROCESS_ID, index)
+        self.name = "T%d" % index
+        self.pc = 0x1000 + index * 0x100
+        self.suspended = True
+        self.reason = runcontrol.REASON_USER_REQUEST
+        self.regs = bytearray(len(REGISTER_NAMES) * REGISTER_SIZE)
+
+    def getRegs(self):
+        pc = REGISTER_NAMES.index("PC") * REGISTER_SIZE
+        self.regs[pc:pc + REGISTER_SIZE] = bytearray(
+            (self.pc >> (8 * i)) & 0xff for i in range(REGISTER_SIZE))
+        return self.regs
+
+    def setRegs(self, offs, data):
+        self.getRegs()[offs:offs + len(data)] = data
+        pc = REGISTER_NAMES.index("PC") * REGISTER_SIZE
+        self.pc = sum(b << (8 * i) for i, b in
+                      enumerate(self.regs[pc:pc + REGISTER_SIZE]))
+
+
+class RunControlServer(_CommandServer):
+    name = runcontrol.NAME
+    commands = ("getContext", "getChildren", "getState", "suspend", "resume",
+                "terminate", "detach")
+    error_results = {"getContext": (_ERR, None), "getChildren": (_ERR, None),
+                     "getState": (_ERR, False, None, None, None)}
+    resume_modes = (1 << runcontrol.RM_RESUME) | \
+        (1 << runcontrol.RM_STEP_INTO) | (1 << runcontrol.RM_STEP_OVER)
+
+    def getContext(self, ctx_id):
+        if ctx_id == PROCESS_ID:
+            return [None, {runcontrol.PROP_ID: PROCESS_ID,
+                           runcontrol.PROP_NAME: "loopback",
+                           runcontrol.PROP_IS_CONTAINER: True,
+                           runcontrol.PROP_HAS_STATE: False,
+                           runcontrol.PROP_CAN_SUSPEND: True,
+                           runcontrol.PROP_CAN_RESUME: self.resume_modes}]
+        t = self.agent.getThread(ctx_id)
+        return [None, {runcontrol.PROP_ID: t.id,
+                       runcontrol.PROP_PARENT_ID: PROCESS_ID,
+                       runcontrol.PROP_PROCESS_ID: PROCESS_ID,
+                       runcontrol.PROP_NAME: t.name,
+                       runcontrol.PROP_IS_CONTAINER: False,
+                       runcontrol.PROP_HAS_STATE: True,
+                       runcontrol.PROP_CAN_SUSPEND: True,
+                       runcontrol.PROP_CAN_RESUME: self.resume_modes,
+                       runcontrol.PROP_CAN_COUNT: self.resume_modes}]
+
+    def getChildren(self, parent_id):
+        if parent_id is None:
+            return [None, [PROCESS_ID]]
+        if parent_id == PROCESS_ID:
+            return [None, list(self.agent.threads)]
+        return [None, []]
+
+    def getState(self, ctx_id):
+        t = self.agent.getThread(ctx_id)
+        if not t.suspended:
+            return [None, False, None, None, None]
+        return [None, True, t.pc, t.reason, {}]
+
+    def suspend(self, ctx_id):
+        for t in self.agent.getThreads(ctx_id):
+            self.agent.suspendThread(t, runcontrol.REASON_USER_REQUEST)
+        return [None]
+
+    def resume(self, ctx_id, mode, count, params=None):
+        if mode not in (runcontrol.RM_RESUME, runcontrol.RM_STEP_INTO,
+                        runcontrol.RM_STEP_OVER):
+            raise _Error(errors.TCF_ERROR_UNSUPPORTED,
+                         "Unsupported resume mode")
+        for t in self.agent.getThreads(ctx_id):
+            self.agent.resumeThread(t, mode, max(1, count))
+        return [None]
+
+    def terminate(self, ctx_id):
+        raise _Error(errors.TCF_ERROR_UNSUPPORTED, "Cannot terminate")
+
+    def detach(self, ctx_id):
+        raise _Error(errors.TCF_ERROR_UNSUPPORTED, "Cannot detach")
+
+
+class RegistersServer(_CommandServer):
+    name = registers.NAME
+    commands = ("getContext", "getChildren", "get", "set", "getm", "setm")
+    error_results = {"getContext": (_ERR, None), "getChildren": (_ERR, None),
+                     "get": (_ERR, None), "getm": (_ERR, None)}
+
+    def _getRegister(self, reg_id):
+        thread_id, _, name = reg_id.rpartition(".")
+        t = self.agent.threads.get(thread_id)
+        if t is None or name not in REGISTER_NAMES:
+            raise _Error(errors.TCF_ERROR_INV_CONTEXT, "Invalid context")
+        return t, REGISTER_NAMES.index(name) * REGISTER_SIZE
+
+    def _getSuspended(self, reg_id):
+        t, offs = self._getRegister(reg_id)
+        if not t.suspended:
+            raise _Error(errors.TCF_ERROR_IS_RUNNING, "Context is running")
+        return t, offs
+
+    def getContext(self, reg_id):
+        t, offs = self._getRegister(reg_id)
+        name = reg_id.rpartition(".")[2]
+        props = {registers.PROP_ID: reg_id,
+                 registers.PROP_PARENT_ID: t.id,
+                 registers.PROP_PROCESS_ID: PROCESS_ID,
+                 registers.PROP_NAME: name,
+                 registers.PROP_SIZE: REGISTER_SIZE,
+                 registers.PROP_READBLE: True,
+                 registers.PROP_WRITEABLE: True,
+                 registers.PROP_BIG_ENDIAN: False,
+                 registers.PROP_OFFSET: offs}
+        if name in (registers.ROLE_PC, registers.ROLE_SP):
+            props[registers.PROP_ROLE] = name
+        return [None, props]
+
+    def getChildren(self, parent_id):
+        if parent_id not in self.agent.threads:
+            return [None, []]
+        return [None, ["%s.%s" % (parent_id, n) for n in REGISTER_NAMES]]
+
+    def get(self, reg_id):
+        t, offs = self._getSuspended(reg_id)
+        return [None, t.getRegs()[offs:offs + REGISTER_SIZE]]
+
+    def set(self, reg_id, value):
+        t, offs = self._getSuspended(reg_id)
+        t.setRegs(offs, toByteArray(value)[:REGISTER_SIZE])
+        self.agent.sendEvent(registers.NAME, "registerChanged", (reg_id,))
+        return [None]
+
+    def getm(self, locs):
+        data = bytearray()
+        for reg_id, offs, size in locs:
+            t, base = self._getSuspended(reg_id)
+            data += t.getRegs()[base + offs:base + offs + size]
+        return [None, data]
+
+    def setm(self, locs, value):
+        value = toByteArray(value)
+        pos = 0
+        for reg_id, offs, size in locs:
+            t, base = self._getSuspended(reg_id)
+            t.setRegs(base + offs, value[pos:pos + size])
+            pos += size
+        for reg_id, _, _ in locs:
+            self.agent.sendEvent(registers.NAME, "registerChanged",
+                                 (reg_id,))
+        return [None]
+
+
+class StackTraceServer(_CommandServer):
+    name = stacktrace.NAME
+    commands = ("getContext", "getChildren", "getChildrenRange")
+    error_results = {"getContext": (None, _ERR), "getChildren": (_ERR, None),
+                     "getChildrenRange": (_ERR, None)}
+
+    def _frames(self, parent_id):
+        if parent_id not in self.agent.threads:
+            return []
+        t = self.agent.threads[parent_id]
+        if not t.suspended:
+            raise _Error(errors.TCF_ERROR_IS_RUNNING, "Context is running")
+        return ["%s.F%d" % (t.id, level)
+                for level in range(self.agent.stack_depth)]
+
+    def getContext(self, ids):
+        ctxs = []
+        for frame_id in ids:
+            thread_id, _, frame = frame_id.rpartition(".")
+            t = self.agent.threads.get(thread_id)
+            if t is None or frame_id not in self._frames(thread_id):
+                raise _Error(errors.TCF_ERROR_INV_CONTEXT, "Invalid context")
+            level = int(frame[1:])
+            ip = t.pc if level == 0 else 0x2000 + level * 0x10
+            ctxs.append({stacktrace.PROP_ID: frame_id,
+                         stacktrace.PROP_PARENT_ID: t.id,
+                         stacktrace.PROP_PROCESS_ID: PROCESS_ID,
+                         stacktrace.PROP_LEVEL: level,
+                         stacktrace.PROP_TOP_FRAME: level == 0,
+                         stacktrace.PROP_INSTRUCTION_ADDRESS: ip,
+                         stacktrace.PROP_FRAME_ADDRESS: 0x80000 - level * 0x20,
+                         stacktrace.PROP_RETURN_ADDRESS: 0x2000 +
+                         (level + 1) * 0x10})
+        return [ctxs, None]
+
+    def getChildren(self, parent_id):
+        return [None, self._frames(parent_id)]
+
+    def getChildrenRange(self, parent_id, range_start, range_end):
+        return [None, self._frames(parent_id)[range_start:range_end + 1]]
+
+
+class DiagnosticsServer(_CommandServer):
+    name = diagnostics.NAME
+    commands = ("echo", "echoFP", "echoERR", "getTestList")
+    error_results = {"echoERR": (_ERR, None), "getTestList": (_ERR, None)}
+
+    def echo(self, s):
+        return [s]
+
+    def echoFP(self, n):
+        return [n]
+
+    def echoERR(self, err):
+        return [err, errors.toErrorString(err)]
+
+    def getTestList(self):
+        return [None, []]
+
+
+SERVERS = (FileSystemServer, MemoryServer, RunControlServer, RegistersServer,
+           StackTraceServer, DiagnosticsServer)
+
+
+class _ServiceProvider(services.ServiceProvider):
+    """Provides the agent services on the channels accepted by the agent
+    only, other channels of the process are not affected."""
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    def getLocalService(self, channel):
+        if channel not in self.agent.channels:
+            return None
+        servers = [cls(self.agent, channel) for cls in SERVERS]
+        for server in servers:
+            channel.addCommandServer(server.service, server)
+
+        class ChannelListener(tcfchannel.ChannelListener):
+            def onChannelClosed(self, error):
+                for server in servers:
+                    server.onClose()
+        channel.addChannelListener(ChannelListener())
+        return [server.service for server in servers]
+
+
+class LoopbackAgent(object):
+    """TCF agent that serves the loopback services on a localhost port.
+
+    @param root - local directory served by the FileSystem service.
+    @param port - TCP port, 0 to pick a free one, see the port field.
+    """
+
+    def __init__(self, root=None, host="127.0.0.1", port=0,
+                 memory_size=MEMORY_SIZE, threads=THREADS,
+                 stack_depth=STACK_DEPTH):
+        self.root = os.path.abspath(root or os.getcwd())
+        self.memory = bytearray(memory_size)
+        self.threads = {}
+        for i in range(threads):
+            t = _Thread(i + 1)
+            self.threads[t.id] = t
+        self.stack_depth = stack_depth
+        self.channels = []
+        self.provider = _ServiceProvider(self)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.host = host
+        self.port = self.sock.getsockname()[1]
+        self.thread = None
+
+    def getTarget(self):
+        """@return "TCP:host:port" target string of the agent."""
+        return "TCP:%s:%d" % (self.host, self.port)
+
+    def start(self):
+        """Start accepting connections. The event queue must be running."""
+        services.addServiceProvider(self.provider)
+        self.thread = threading.Thread(target=self._accept,
+                                       name="TCF Loopback Agent")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """Stop accepting connections and close the channels."""
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+        services.removeServiceProvider(self.provider)
+
+        def closeChannels():
+            for c in list(self.channels):
+                if c.getState() != tcfchannel.STATE_CLOSED:
+                    c.close()
+        protocol.invokeLater(closeChannels)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            protocol.invokeLater(self._open, conn, addr)
+
+    def _open(self, conn, addr):
+        attrs = {peer.ATTR_ID: "TCP:%s:%d" % addr,
+                 peer.ATTR_TRANSPORT_NAME: "TCP",
+                 peer.ATTR_IP_HOST: addr[0],
+                 peer.ATTR_IP_PORT: str(addr[1])}
+        c = ChannelTCP(peer.TransientPeer(attrs), addr[0], addr[1], conn)
+        self.channels.append(c)
+        agent = self
+
+        class ChannelListener(tcfchannel.ChannelListener):
+            def onChannelClosed(self, error):
+                agent.channels.remove(c)
+        c.addChannelListener(ChannelListener())
+
+    def sendEvent(self, service, name, args):
+        """Send an event to all open channels."""
+        data = toJSONSequence(args)
+        for c in self.channels:
+            if c.getState() == tcfchannel.STATE_OPEN:
+                c.sendEvent(service, name, data)
+
+    # run control model
+
+    def getThread(self, ctx_id):
+        t = self.threads.get(ctx_id)
+        if t is None:
+            raise _Error(errors.TCF_ERROR_INV_CONTEXT, "Invalid context")
+        return t
+
+    def getThreads(self, ctx_id):
+        if ctx_id == PROCESS_ID:
+            return list(self.threads.values())
+        return [self.getThread(ctx_id)]
+
+    def suspendThread(self, t, reason):
+        if t.suspended:
+            return
+        t.suspended = True
+        t.reason = reason
+        if reason == runcontrol.REASON_USER_REQUEST:
+            # the thread has executed some instructions while running
+            t.pc += 0x40
+        self.sendEvent(runcontrol.NAME, "contextSuspended",
+                       (t.id, t.pc, reason, {}))
+
+    def resumeThread(self, t, mode, count):
+        if not t.suspended:
+            raise _Error(errors.TCF_ERROR_ALREADY_RUNNING,
+                         "Already running")
+        t.suspended = False
+        t.reason = None
+        self.sendEvent(runcontrol.NAME, "contextResumed", (t.id,))
+        if mode != runcontrol.RM_RESUME:
+            agent = self
+
+            def step():
+                if not t.suspended:
+                    t.pc += 4 * count
+                    agent.suspendThread(t, runcontrol.REASON_STEP)
+            protocol.invokeLater(step)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    root = argv[0] if len(argv) > 0 else None
+    port = int(argv[1]) if len(argv) > 1 else 0
+    protocol.startEventQueue()
+    agent = LoopbackAgent(root, port=port)
+    agent.start()
+    print(agent.port)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    agent.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Startup time benchmark.
+
+Runs a short-lived client in a new interpreter, the way command line tools
+run, and measures the time from import of tcf to the result of the first
+command: import, event queue start, channel open (including Hello) and a
+FileSystem download of a small file from the in-memory stand-in agent.
+The "lean" mode is the default startup, in "discovery" mode the client also
+starts UDP discovery of peers, as tools that call peers() do. Reports the
+median of each phase in milliseconds.
+
+Usage: python -m tcf.bench.startup [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .fsagent import StandInFileSystem
+
+CHILD = r'''
+import sys, time
+t0 = time.time()
+import io
+import tcf
+from tcf import protocol
+t1 = time.time()
+protocol.startEventQueue()
+if sys.argv[2] == "discovery":
+    protocol.startDiscovery()
+t2 = time.time()
+c = tcf.connect("TCP:127.0.0.1:" + sys.argv[1])
+t3 = time.time()
+from tcf.util import transfer
+transfer.download(c, "/startup", io.BytesIO())
+t4 = time.time()
+print("[%f, %f, %f, %f, %f]" % (t0, t1, t2, t3, t4))
+'''
+
+PHASES = ("import", "start", "connect", "command", "total", "process")
+
+
+def measure(port, mode):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    t = time.time()
+    out = subprocess.check_output(
+        [sys.executable, "-c", CHILD, str(port), mode], env=env)
+    t_end = time.time()
+    t0, t1, t2, t3, t4 = json.loads(out.decode("ascii"))
+    return (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t4 - t0, t_end - t)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    runs = int(argv[0]) if len(argv) > 0 else 10
+    agent = StandInFileSystem()
+    agent.files["/startup"] = bytearray(b"startup\n")
+    agent.start()
+    print("%-10s" % "ms" + "".join("%9s" % p for p in PHASES))
+    for mode in ("lean", "discovery"):
+        results = [measure(agent.port, mode) for i in range(runs)]
+        print("%-10s" % mode + "".join(
+            "%9.1f" % (median(r[i] for r in results) * 1000)
+            for i in range(len(PHASES))))
+    agent.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Striped transfer benchmark.
+
+The in-memory stand-in agent runs in a separate process and simulates a
+slow link: replies are delayed and every connection is limited to a fixed
+rate in each direction. A file is downloaded and uploaded once over a
+single channel with Download and Upload, then with StripedDownload and
+StripedUpload over 2, 4 and 8 channels. Every result is verified and the
+throughput is reported.
+
+Usage: python -m tcf.bench.striped [size_mb] [latency_ms] [rate_mb_per_s]
+"""
+
+import io
+import os
+import subprocess
+import sys
+
+from .. import connect, protocol
+from ..util import transfer
+
+AGENT = r'''
+import sys
+from tcf.bench.fsagent import StandInFileSystem
+agent = StandInFileSystem(float(sys.argv[1]), float(sys.argv[2]))
+print(agent.port)
+sys.stdout.flush()
+agent.run()
+'''
+
+CHANNELS = (1, 2, 4, 8)
+
+
+def startAgent(latency, rate):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    agent = subprocess.Popen([sys.executable, "-c", AGENT, str(latency),
+                              str(rate)], env=env, stdout=subprocess.PIPE)
+    port = int(agent.stdout.readline().decode("ascii").strip())
+    return agent, port
+
+
+def measure(channels, path, data):
+    """@return (upload, download) transfer objects."""
+    if len(channels) == 1:
+        up = transfer.upload(channels[0], path, io.BytesIO(data))
+    else:
+        up = transfer.stripedUpload(channels, path, io.BytesIO(data))
+    out = io.BytesIO()
+    if len(channels) == 1:
+        down = transfer.download(channels[0], path, out)
+    else:
+        down = transfer.stripedDownload(channels, path, out)
+    assert out.getvalue() == data
+    return up, down
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = int(float(argv[0]) * 0x100000) if len(argv) > 0 else 0x2000000
+    latency = float(argv[1]) / 1000 if len(argv) > 1 else 0.02
+    rate = float(argv[2]) * 1e6 if len(argv) > 2 else 10e6
+    data = os.urandom(size)
+    agent, port = startAgent(latency, rate)
+    try:
+        protocol.startEventQueue()
+        channels = [connect("TCP:127.0.0.1:%d" % port)
+                    for _ in range(max(CHANNELS))]
+        print("%d MB file, %g ms latency, %s per connection" %
+              (size >> 20, latency * 1000,
+               "%g MB/s" % (rate / 1e6) if rate else "unlimited"))
+        print("%-9s %14s %14s" % ("channels", "upload MB/s", "download MB/s"))
+        for count in CHANNELS:
+            up, down = measure(channels[:count], "/striped.bin", data)
+            print("%-9d %14.2f %14.2f" % (count, up.getThroughput() / 1e6,
+                                          down.getThroughput() / 1e6))
+        for c in channels:
+            protocol.invokeAndWait(c.close)
+    finally:
+        agent.kill()
+        agent.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""
+End-to-end benchmark suite.
+
+Runs the benchmarks below, prints a table and compares the results with
+stored baselines. A result that is worse than its baseline by more than the
+tolerance of the metric is a regression, and the exit status is 1.
+
+  framing       - message framing of FileSystem.read-like replies, MB/s.
+  json_encode   - JSON encoding of typical command arguments, ops/s.
+  json_decode   - JSON decoding of the same arguments, ops/s.
+  eventqueue    - invokeLater() jobs posted by another thread, jobs/s.
+  rtt_p50       - Diagnostics.echo round-trip time, median, ms.
+  rtt_p99       - Diagnostics.echo round-trip time, 99th percentile, ms.
+  fs_read       - FileSystem download throughput, MB/s.
+  fs_write      - FileSystem upload throughput, MB/s.
+  event_fanout  - Memory.memoryChanged events delivered to the listeners of
+                  several channels, events/s.
+
+The channel benchmarks run against the loopback agent, tcf.bench.loopback,
+started in a separate process. Every benchmark is run a number of times and
+the median result is kept, so that one slow or fast run does not decide.
+
+Baselines depend on the machine, so none are shipped: --save stores the
+results of a run as the baselines of this machine, in
+~/.tcf-bench-baseline.json or in the file given with --baseline, and later
+runs are compared with them. --quick runs smaller sizes, which give other
+results, so quick and full runs have separate baselines in the file. --json
+writes the results and the comparison in machine-readable form.
+
+Usage: python -m tcf.bench.suite [options] [benchmark ...]
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .. import channel as tcfchannel, connect, protocol
+from ..channel import toJSONSequence, fromJSONSequence
+from ..EventQueue import EventQueue
+from ..services import diagnostics, memory
+from ..util import transfer
+from . import eventqueue, framing
+
+BASELINE = os.path.join(os.path.expanduser("~"), ".tcf-bench-baseline.json")
+# results of repeated runs on a shared machine differ by up to a third,
+# a regression is a slowdown beyond that
+TOLERANCE = 0.4
+
+# name: (unit, higher is better, tolerance)
+METRICS = {
+    "framing": ("MB/s", True, TOLERANCE),
+    "json_encode": ("ops/s", True, TOLERANCE),
+    "json_decode": ("ops/s", True, TOLERANCE),
+    "eventqueue": ("jobs/s", True, TOLERANCE),
+    "rtt_p50": ("ms", False, 1.0),
+    "rtt_p99": ("ms", False, 1.5),
+    "fs_read": ("MB/s", True, TOLERANCE),
+    "fs_write": ("MB/s", True, TOLERANCE),
+    "event_fanout": ("events/s", True, TOLERANCE),
+}
+
+ORDER = ("framing", "json_encode", "json_decode", "eventqueue", "rtt_p50",
+         "rtt_p99", "fs_read", "fs_write", "event_fanout")
+
+# arguments of typical commands and replies: FileSystem.stat reply,
+# RunControl context, Memory.get command
+JSON_ARGS = (
+    None,
+    {"Size": 123456, "UID": 1000, "GID": 1000, "Permissions": 0o100644,
+     "ATime": 1700000000000, "MTime": 1700000000000,
+     "Attributes": {"INode": 1234567, "Dev": 2049}},
+    {"ID": "P1.T1", "ParentID": "P1", "ProcessID": "P1", "Name": "main",
+     "CanSuspend": True, "CanResume": 15, "CanCount": 6,
+     "CanTerminate": True, "HasState": True, "IsContainer": False},
+    ["P1", 0x8000, 4, 256, 0],
+)
+
+
+class Options(object):
+    """Sizes of the benchmarks, full or quick."""
+
+    def __init__(self, quick=False):
+        scale = 10 if quick else 1
+        # name of the baselines of the sizes
+        self.mode = "quick" if quick else "full"
+        # odd, so that the median is one of the results
+        self.repeat = 5
+        self.framing_count = 2000 // scale
+        self.json_count = 20000 // scale
+        self.eventqueue_count = 200000 // scale
+        self.rtt_count = 2000 // scale
+        self.fs_size = 0x1000000 // scale
+        self.fanout_channels = 4
+        self.fanout_events = 5000 // scale
+
+
+# benchmarks without channels
+
+
+def measureFraming(opts):
+    agent = framing.StandInAgent(framing.makeReadReplies(opts.framing_count,
+                                                         0x4000))
+    agent.start()
+    try:
+        cnt, nbytes, t = framing.measure(agent.port, False)
+    finally:
+        agent.close()
+    return {"framing": nbytes / t / 1e6}
+
+
+def measureJSON(opts):
+    count = opts.json_count
+    t0 = time.time()
+    for i in range(count):
+        data = toJSONSequence(JSON_ARGS)
+    # messages are received as bytearrays
+    if not isinstance(data, bytearray):
+        data = bytearray(data.encode("UTF-8"))
+    t1 = time.time()
+    for i in range(count):
+        fromJSONSequence(data)
+    t2 = time.time()
+    return {"json_encode": count / (t1 - t0),
+            "json_decode": count / (t2 - t1)}
+
+
+def measureEventQueue(opts):
+    queue = EventQueue()
+    queue.start()
+    try:
+        t = eventqueue.measureBurst(queue, opts.eventqueue_count)
+    finally:
+        queue.shutdown()
+    return {"eventqueue": opts.eventqueue_count / t}
+
+
+# benchmarks against the loopback agent
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measureRoundTrip(channel, count):
+    """Send echo commands one at a time.
+    @return list of round-trip times in seconds."""
+    times = []
+    finished = threading.Event()
+
+    class DoneEcho(diagnostics.DoneEcho):
+        def doneEcho(self, token, error, s):
+            times.append(time.time() - self.t0)
+            if error or len(times) == count:
+                finished.error = error
+                finished.set()
+            else:
+                send()
+
+    def send():
+        done = DoneEcho()
+        done.t0 = time.time()
+        channel.getRemoteService(diagnostics.NAME).echo("echo", done)
+    protocol.invokeLater(send)
+    finished.wait()
+    if finished.error:
+        raise IOError(str(finished.error))
+    return times
+
+
+def measureFanout(channels, count):
+    """Send Memory.fill commands on the first channel, every command makes
+    the agent send a memoryChanged event to every channel.
+    @return time until all the events are received."""
+    expected = count * len(channels)
+    received = [0]
+    finished = threading.Event()
+
+    class MemoryListener(memory.MemoryListener):
+        def memoryChanged(self, context, addr, size):
+            received[0] += 1
+            if received[0] == expected:
+                finished.set()
+    listeners = []
+
+    class CommandListener(tcfchannel.CommandListener):
+        def result(self, token, data):
+            pass
+
+        def terminated(self, token, error):
+            finished.error = error
+            finished.set()
+
+    def start():
+        for c in channels:
+            svc = c.getRemoteService(memory.NAME)
+            listener = MemoryListener()
+            svc.addListener(listener)
+            listeners.append((svc, listener))
+        finished.t0 = time.time()
+        for i in range(count):
+            channels[0].sendCommand(
+                memory.NAME, "fill",
+                toJSONSequence(("P1", i & 0xff, 1, 4, 0, [i & 0xff])),
+                CommandListener())
+
+    def stop():
+        for svc, listener in listeners:
+            svc.removeListener(listener)
+    finished.error = None
+    protocol.invokeLater(start)
+    finished.wait()
+    t = time.time() - finished.t0
+    protocol.invokeAndWait(stop)
+    if finished.error:
+        raise IOError(str(finished.error))
+    return t
+
+
+def startAgent(root):
+    path = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = path + os.pathsep + env.get("PYTHONPATH", "")
+    agent = subprocess.Popen([sys.executable, "-m", "tcf.bench.loopback",
+                              root], env=env, stdout=subprocess.PIPE)
+    port = int(agent.stdout.readline().decode("ascii").strip())
+    return agent, "TCP:127.0.0.1:%d" % port
+
+
+class LoopbackBench(object):
+    """Channels to a loopback agent in another process."""
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.root = tempfile.mkdtemp(prefix="tcfbench")
+        self.agent = None
+        self.channels = []
+
+    def open(self):
+        protocol.startEventQueue()
+        self.agent, target = startAgent(self.root)
+        for i in range(self.opts.fanout_channels):
+            self.channels.append(connect(target))
+        with open(os.path.join(self.root, "read.bin"), "wb") as f:
+            f.write(os.urandom(self.opts.fs_size))
+
+    def close(self):
+        for c in self.channels:
+            protocol.invokeAndWait(c.close)
+        if self.agent is not None:
+            self.agent.kill()
+            self.agent.wait()
+        shutil.rmtree(self.root, True)
+
+    def measureRoundTrip(self, opts):
+        times = measureRoundTrip(self.channels[0], opts.rtt_count)
+        return {"rtt_p50": percentile(times, 0.5) * 1000,
+                "rtt_p99": percentile(times, 0.99) * 1000}
+
+    def measureFileSystem(self, opts):
+        down = transfer.download(self.channels[0], "/read.bin", io.BytesIO())
+        data = os.urandom(opts.fs_size)
+        up = transfer.upload(self.channels[0], "/write.bin", io.BytesIO(data))
+        return {"fs_read": down.getThroughput() / 1e6,
+                "fs_write": up.getThroughput() / 1e6}
+
+    def measureFanout(self, opts):
+        t = measureFanout(self.channels, opts.fanout_events)
+        return {"event_fanout": opts.fanout_events * len(self.channels) / t}
+
+
+def run(names, opts, log=None):
+    """Run the benchmarks that produce the given metrics.
+    @return dict of metric name -> median result."""
+    bench = None
+    benchmarks = [(("framing",), measureFraming),
+                  (("json_encode", "json_decode"), measureJSON),
+                  (("eventqueue",), measureEventQueue)]
+    if set(names) & set(("rtt_p50", "rtt_p99", "fs_read", "fs_write",
+                         "event_fanout")):
+        bench = LoopbackBench(opts)
+        benchmarks += [(("rtt_p50", "rtt_p99"), bench.measureRoundTrip),
+                       (("fs_read", "fs_write"), bench.measureFileSystem),
+                       (("event_fanout",), bench.measureFanout)]
+    values = {}
+    try:
+        if bench is not None:
+            bench.open()
+        for metrics, fn in benchmarks:
+            if not set(metrics) & set(names):
+                continue
+            if log:
+                log("running %s" % ", ".join(metrics))
+            for i in range(opts.repeat):
+                for name, value in fn(opts).items():
+                    if name in names:
+                        values.setdefault(name, []).append(value)
+    finally:
+        if bench is not None:
+            bench.close()
+    return dict((name, percentile(v, 0.5)) for name, v in values.items())
+
+
+def compare(results, baselines, tolerance=None):
+    """Compare results with baselines.
+    @param tolerance - allowed relative regression, None for the tolerance
+                       of every metric.
+    @return dict of metric name -> (baseline, limit, regressed), only for
+            the metrics that have a baseline."""
+    report = {}
+    for name, value in results.items():
+        base = baselines.get(name)
+        if base is None:
+            continue
+        unit, higher, tol = METRICS[name]
+        if tolerance is not None:
+            tol = tolerance
+        if higher:
+            limit = base * (1 - tol)
+            regressed = value < limit
+        else:
+            limit = base * (1 + tol)
+            regressed = value > limit
+        report[name] = (base, limit, regressed)
+    return report
+
+
+def _readBaselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("modes", {})
+
+
+def loadBaselines(path, mode):
+    """@return dict of metric name -> baseline of the sizes of mode."""
+    return _readBaselines(path).get(mode, {}).get("results", {})
+
+
+def saveBaselines(path, mode, results):
+    """Store results as the baselines of mode, the baselines of other
+    modes in the file are kept."""
+    modes = _readBaselines(path)
+    modes[mode] = {"python": sys.version.split()[0], "results": results}
+    with open(path, "w") as f:
+        json.dump({"modes": modes}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tcf.bench.suite",
+        description="Run TCF benchmarks and compare with baselines.")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help="metrics to measure: %s (default all)" %
+                        ", ".join(ORDER))
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="baselines file (default %(default)s)")
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float,
+                        help="allowed relative regression for all metrics")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write results to FILE, - for stdout")
+    parser.add_argument("--quick", action="store_true",
+                        help="smaller sizes, for a smoke test, compared "
+                        "with the baselines of quick runs")
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in METRICS:
+            parser.error("unknown benchmark: %s" % name)
+    names = [n for n in ORDER if n in args.names] if args.names else ORDER
+
+    def log(s):
+        sys.stderr.write(s + "\n")
+    opts = Options(args.quick)
+    results = run(names, opts, log)
+    baselines = loadBaselines(args.baseline, opts.mode)
+    report = compare(results, baselines, args.tolerance)
+    out = sys.stderr if args.json == "-" else sys.stdout
+    failed = []
+    out.write("%-13s %14s %9s %14s  %s\n" %
+              ("benchmark", "result", "unit", "baseline", "status"))
+    for name in names:
+        value = results[name]
+        unit = METRICS[name][0]
+        if name in report:
+            base, limit, regressed = report[name]
+            status = "REGRESSION (limit %.4g)" % limit if regressed else \
+                "ok %+.1f%%" % ((value - base) / base * 100)
+            if regressed:
+                failed.append(name)
+            out.write("%-13s %14.4g %9s %14.4g  %s\n" %
+                      (name, value, unit, base, status))
+        else:
+            out.write("%-13s %14.4g %9s %14s  %s\n" %
+                      (name, value, unit, "-", "no baseline"))
+    if args.json:
+        doc = {"results": results,
+               "units": dict((n, METRICS[n][0]) for n in names),
+               "baselines": dict((n, r[0]) for n, r in report.items()),
+               "regressions": failed}
+        if args.json == "-":
+            json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write("\n")
+        else:
+            with open(args.json, "w") as f:
+                json.dump(doc, f, indent=2, sort_keys=True)
+    if args.save:
+        baselines.update(results)
+        saveBaselines(args.baseline, opts.mode, baselines)
+        out.write("%s baselines saved to %s\n" % (opts.mode, args.baseline))
+        return 0
+    if not report:
+        out.write("no %s baselines in %s, run with --save to store them\n" %
+                  (opts.mode, args.baseline))
+    if failed:
+        out.write("%d regression(s): %s\n" % (len(failed), ", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
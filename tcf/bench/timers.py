@@ -0,0 +1,68 @@
+"""
+Timer queue benchmark.
+
+Schedules a large number of delayed events with invokeLaterWithDelay(),
+cancels every other one before any of them is due, and waits for the rest
+to fire. Reports insert and cancel rates and how late the events were
+dispatched.
+"""
+
+import random
+import sys
+import threading
+import time
+
+from .. import protocol
+from ..EventQueue import EventQueue
+
+
+def startDispatcher():
+    """Start event and timer dispatch threads without Locator service."""
+    protocol._event_queue = EventQueue()
+    protocol._event_queue.start()
+    thread = threading.Thread(target=protocol._dispatch_timers,
+                              name="TCF Timer Dispatcher")
+    thread.daemon = True
+    thread.start()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 100000
+    span = int(argv[1]) if len(argv) > 1 else 2000
+    startDispatcher()
+    done = threading.Event()
+    state = {"fired": 0, "late": 0.0}
+    expected = count - count // 2
+
+    def fire(due):
+        late = time.time() - due
+        if late > state["late"]:
+            state["late"] = late
+        state["fired"] += 1
+        if state["fired"] == expected:
+            done.set()
+
+    rnd = random.Random(0)
+    # leave enough time to schedule and cancel before the first one fires
+    delays = [span + rnd.randint(1, span) for i in range(count)]
+    t0 = time.time()
+    timers = [protocol.invokeLaterWithDelay(d, fire, time.time() + d / 1000.)
+              for d in delays]
+    t1 = time.time()
+    for t in timers[::2]:
+        t.cancel()
+    t2 = time.time()
+    done.wait()
+    t3 = time.time()
+    print("schedule %8d timers %8.3f s %10.0f timers/s" %
+          (count, t1 - t0, count / (t1 - t0)))
+    print("cancel   %8d timers %8.3f s %10.0f timers/s" %
+          (count // 2, t2 - t1, count // 2 / (t2 - t1)))
+    print("fired    %8d timers %8.3f s, max lateness %.1f ms" %
+          (state["fired"], t3 - t0, state["late"] * 1000))
+    protocol._event_queue.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Output path benchmark.
+
+Writes a burst of FileSystem.write-like commands through StreamChannel to a
+loopback sink and reports the number of socket send calls and throughput.
+The per-byte variant transmits every encoded byte with its own send() call,
+which is how the channel used to behave, the buffered variant uses the
+channel output buffer with one flush per batch of messages.
+"""
+
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+
+from ..channel import Token
+from ..channel.AbstractChannel import Message
+from ..channel.ChannelTCP import ChannelTCP
+from ..channel.StreamChannel import StreamChannel
+
+
+class Sink(threading.Thread):
+    """Loopback server that reads and discards everything it receives."""
+
+    def __init__(self):
+        super(Sink, self).__init__(name="TCF Bench Sink")
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.received = 0
+
+    def run(self):
+        conn, _ = self.sock.accept()
+        buf = bytearray(0x10000)
+        while True:
+            n = conn.recv_into(buf)
+            if n <= 0:
+                break
+            self.received += n
+        conn.close()
+        self.sock.close()
+
+
+class CountingSocket(object):
+    """Socket wrapper that counts send calls."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def send(self, data):
+        self.calls += 1
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.calls += 1
+        return self.sock.sendall(data)
+
+    def sendmsg(self, bufs):
+        self.calls += 1
+        return self.sock.sendmsg(bufs)
+
+    def close(self):
+        self.sock.close()
+
+
+class SocketChannel(ChannelTCP):
+    """ChannelTCP connected directly, without TCF event dispatch thread."""
+
+    def __init__(self, port, per_byte=False):
+        StreamChannel.__init__(self, None)
+        self.closed = False
+        self.started = True
+        self.io_loop = None
+        self.io_conn = None
+        self.socket = CountingSocket(
+            socket.create_connection(("127.0.0.1", port)))
+        if per_byte:
+            self.putBufs = self.putBufsPerByte
+
+    def putBufsPerByte(self, bufs):
+        for buf in bufs:
+            for b in bytearray(buf):
+                self.put(b)
+
+
+def makeMessages(count, size):
+    payload = bytearray(i & 0xff for i in range(size))
+    data = json.dumps(base64.b64encode(payload).decode("ascii"))
+    data = '"ID0"\0%d\0%s\0' % (0, data)
+    msgs = []
+    for i in range(count):
+        msg = Message('C')
+        msg.token = Token(str(i))
+        msg.service = "FileSystem"
+        msg.name = "write"
+        msg.data = data
+        msgs.append(msg)
+    return msgs
+
+
+def measure(msgs, per_byte, batch):
+    sink = Sink()
+    sink.start()
+    channel = SocketChannel(sink.port, per_byte)
+    nbytes = 0
+    t0 = time.time()
+    for i, msg in enumerate(msgs):
+        channel.writeMessage(msg)
+        nbytes += len(msg.data)
+        if (i + 1) % batch == 0:
+            channel.flush()
+    channel.flush()
+    t = time.time() - t0
+    calls = channel.socket.calls
+    channel.stop()
+    sink.join()
+    return calls, nbytes, t
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 200
+    size = int(argv[1]) if len(argv) > 1 else 0x1000
+    batch = int(argv[2]) if len(argv) > 2 else 8
+    msgs = makeMessages(count, size)
+    for name, per_byte in (("per-byte send()", True),
+                           ("buffered", False)):
+        calls, nbytes, t = measure(msgs, per_byte, batch)
+        print("%-16s %6d msgs %9d send calls %8.3f s %8.2f MB/s" %
+              (name, len(msgs), calls, t, nbytes / t / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+ZeroCopy benchmark.
+
+Encodes FileSystem.write-like arguments, frames them with StreamChannel,
+then parses the stream back and decodes the payload, once with base64
+strings and once with ZeroCopy binary data. Reports bytes on the wire and
+throughput in MB/s.
+"""
+
+import sys
+import time
+
+from ..channel import Token, toJSONSequence, fromJSONSequence, toByteArray
+from ..channel.AbstractChannel import Message, ReaderThread
+from ..channel.StreamChannel import StreamChannel
+
+
+class MemoryChannel(StreamChannel):
+    """Stream channel that loops its output back to its input."""
+
+    def __init__(self, zero_copy):
+        super(MemoryChannel, self).__init__(None)
+        self.zero_copy = zero_copy
+        self.stream = bytearray()
+        self.stream_pos = 0
+
+    def putBufs(self, bufs):
+        for buf in bufs:
+            self.stream += buf
+
+    def getBuf(self, buf):
+        n = min(len(buf), len(self.stream) - self.stream_pos)
+        if n <= 0:
+            return -1
+        buf[:n] = self.stream[self.stream_pos:self.stream_pos + n]
+        self.stream_pos += n
+        return n
+
+
+def measure(count, size, zero_copy):
+    payload = bytearray(i & 0xff for i in range(size))
+    channel = MemoryChannel(zero_copy)
+    reader = ReaderThread(channel, None)
+    t0 = time.time()
+    for i in range(count):
+        msg = Message('C')
+        msg.token = Token(str(i))
+        msg.service = "FileSystem"
+        msg.name = "write"
+        msg.data = toJSONSequence(("ID0", i * size, payload), zero_copy)
+        channel.writeMessage(msg)
+    channel.flush()
+    wire = len(channel.stream)
+    for i in range(count):
+        msg = reader.readMessage()
+        data = toByteArray(fromJSONSequence(msg.data)[2])
+        assert len(data) == size
+    t = time.time() - t0
+    return wire, t
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if len(argv) > 0 else 500
+    size = int(argv[1]) if len(argv) > 1 else 0x10000
+    for name, zero_copy in (("base64", False), ("ZeroCopy", True)):
+        wire, t = measure(count, size, zero_copy)
+        print("%-9s %6d msgs %11d wire bytes %8.3f s %8.2f MB/s" %
+              (name, count, wire, t, count * size / t / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,8 @@ from .. import compat, protocol, transport, services, peer, errors
 from ..services import locator
 from ..channel import STATE_CLOSED, STATE_OPEN, STATE_OPENING
 from ..channel import Token, fromJSONSequence, toJSONSequence
+from ..channel import DecodedCommandListener, DecodedEventListener
+from . import DecodePool
 
 EOS = -1  # End Of Stream
 EOM = -2  # End Of Message
@@ -30,6 +32,8 @@ class Message(object):
         self.service = None
         self.name = None
         self.data = None
+        # decoded data, if decoded before the dispatch thread, see DecodePool
+        self.args = None
         self.is_canceled = None
         self.is_sent = None
         self.token = None
@@ -39,6 +43,12 @@ class Message(object):
         return "%s %s %s" % (self.type, self.service, self.name)
 
 
+def _wantsEvent(listener, name):
+    """Listeners that don't extend EventListener get all events."""
+    names = getattr(listener, "event_names", None)
+    return names is None or name in names
+
+
 class ReaderThread(threading.Thread):
     def __init__(self, channel, handleInput):
         super(ReaderThread, self).__init__(name="TCF Reader Thread")
@@ -47,6 +57,26 @@ class ReaderThread(threading.Thread):
         self.buf = bytearray()
         self.eos_err_report = None
         self.daemon = True
+        pool = DecodePool.getDecodePool()
+        self.sequence = pool.open(channel, handleInput) if pool else None
+
+    def post(self, msg):
+        """
+        Pass a received message to the dispatch thread. Called on the reader
+        thread, or the shared I/O loop thread.
+        """
+        if self.sequence is None:
+            protocol.invokeLater(self.handleInput, msg)
+        else:
+            self.sequence.post(msg)
+
+    def invokeLater(self, c, *args):
+        """Call c(*args) on the dispatch thread after the messages passed
+        to it with post()."""
+        if self.sequence is None:
+            protocol.invokeLater(c, *args)
+        else:
+            self.sequence.invokeLater(c, *args)
 
     def error(self):
         raise IOError("Protocol syntax error")
@@ -54,68 +84,74 @@ class ReaderThread(threading.Thread):
     def readBytes(self, end, buf=None):
         if buf is None:
             buf = bytearray()
-        while True:
-            n = self.channel.read()
-            if n <= 0:
-                if n == end:
-                    break
-                if n == EOM:
-                    raise IOError("Unexpected end of message")
-                if n < 0:
-                    raise IOError("Communication channel is closed by " +
-                                  "remote peer")
-            buf.append(n)
+        n = self.channel.readBytes(end, buf)
+        if n != end:
+            if n == EOM:
+                raise IOError("Unexpected end of message")
+            raise IOError("Communication channel is closed by remote peer")
         return buf
 
     def readString(self):
         del self.buf[:]
         return self.readBytes(0, self.buf).decode("UTF8")
 
+    def readMessage(self):
+        """
+        Read next message from the channel input stream.
+        @return Message object or None if end of stream is reached.
+        @raises IOError
+        """
+        while True:
+            n = self.channel.read()
+            if n != EOM:
+                break
+        if n == EOS:
+            try:
+                self.eos_err_report = self.readBytes(EOM)
+                reportLen = len(self.eos_err_report)
+                if reportLen == 0 or reportLen == 1 and \
+                   self.eos_err_report[0] == 0:
+                    self.eos_err_report = None
+            except:
+                pass
+            return None
+        msg = Message(n)
+        if self.channel.read() != 0:
+            self.error()
+        typeCode = msg.type
+        if typeCode == 'C':
+            msg.token = Token(self.readBytes(0))
+            msg.service = self.readString()
+            msg.name = self.readString()
+            msg.data = self.readBytes(EOM)
+        elif typeCode in 'PRN':
+            msg.token = Token(self.readBytes(0))
+            msg.data = self.readBytes(EOM)
+        elif typeCode == 'E':
+            msg.service = self.readString()
+            msg.name = self.readString()
+            msg.data = self.readBytes(EOM)
+        elif typeCode == 'F':
+            msg.data = self.readBytes(EOM)
+        else:
+            self.error()
+        return msg
+
     def run(self):
         try:
             while True:
-                n = self.channel.read()
-                if n == EOM:
-                    continue
-                if n == EOS:
-                    try:
-                        self.eos_err_report = self.readBytes(EOM)
-                        reportLen = len(self.eos_err_report)
-                        if reportLen == 0 or reportLen == 1 and \
-                           self.eos_err_report[0] == 0:
-                            self.eos_err_report = None
-                    except:
-                        pass
+                msg = self.readMessage()
+                if msg is None:
                     break
-                msg = Message(n)
-                if self.channel.read() != 0:
-                    self.error()
-                typeCode = msg.type
-                if typeCode == 'C':
-                    msg.token = Token(self.readBytes(0))
-                    msg.service = self.readString()
-                    msg.name = self.readString()
-                    msg.data = self.readBytes(EOM)
-                elif typeCode in 'PRN':
-                    msg.token = Token(self.readBytes(0))
-                    msg.data = self.readBytes(EOM)
-                elif typeCode == 'E':
-                    msg.service = self.readString()
-                    msg.name = self.readString()
-                    msg.data = self.readBytes(EOM)
-                elif typeCode == 'F':
-                    msg.data = self.readBytes(EOM)
-                else:
-                    self.error()
-                protocol.invokeLater(self.handleInput, msg)
+                self.post(msg)
                 delay = self.channel.local_congestion_level
                 if delay > 0:
                     time.sleep(delay / 1000.0)
-            protocol.invokeLater(self.handleEOS)
+            self.invokeLater(self.handleEOS)
         except Exception as x:
             try:
                 x.tb = sys.exc_info()[2]
-                protocol.invokeLater(self.channel.terminate, x)
+                self.invokeLater(self.channel.terminate, x)
             except:
                 # TCF event dispatcher has shut down
                 pass
@@ -161,6 +197,8 @@ class AbstractChannel(object):
         self.remote_service_by_name = {}
         self.channel_listeners = []
         self.event_listeners = {}
+        # (service, event name) -> listeners of the event
+        self.event_dispatch = {}
         self.command_servers = {}
         self.redirect_queue = []
         self.redirect_command = None
@@ -195,21 +233,8 @@ class AbstractChannel(object):
                         continue
                     msg.is_sent = True
                 if msg.trace:
-                    protocol.invokeLater(self.__traceMessageSent, msg)
-                self.write(msg.type)
-                self.write(0)
-                if msg.token:
-                    self.write(msg.token.id)
-                    self.write(0)
-                if msg.service:
-                    self.write(msg.service.encode("UTF8"))
-                    self.write(0)
-                if msg.name:
-                    self.write(msg.name.encode("UTF8"))
-                    self.write(0)
-                if msg.data:
-                    self.write(msg.data)
-                self.write(EOM)
+                    protocol.invokeLater(self._traceMessageSent, msg)
+                self.writeMessage(msg)
                 delay = 0
                 level = self.remote_congestion_level
                 if level > 0:
@@ -229,7 +254,28 @@ class AbstractChannel(object):
                 # TCF event dispatcher has shut down
                 pass
 
-    def __traceMessageSent(self, m):
+    def writeMessage(self, msg):
+        """
+        Write a message into the channel output stream.
+        @param msg - Message object.
+        @raises IOError
+        """
+        self.write(msg.type)
+        self.write(0)
+        if msg.token:
+            self.write(msg.token.id)
+            self.write(0)
+        if msg.service:
+            self.write(msg.service.encode("UTF8"))
+            self.write(0)
+        if msg.name:
+            self.write(msg.name.encode("UTF8"))
+            self.write(0)
+        if msg.data:
+            self.write(msg.data)
+        self.write(EOM)
+
+    def _traceMessageSent(self, m):
         for l in m.trace:
             try:
                 tokenID = None
@@ -243,21 +289,38 @@ class AbstractChannel(object):
     def start(self):
         assert protocol.isDispatchThread()
         protocol.invokeLater(self.__initServices)
+        self._startIO()
+
+    def _startIO(self):
+        """Start transmitting and receiving messages. Subclasses that do
+        not use the reader and transmitter threads override this method,
+        together with _notifyOutput() and _waitOutput()."""
         self.inp_thread.start()
         self.out_thread.start()
 
+    def _notifyOutput(self):
+        """Notify the transmitter that out_queue has new messages. Called
+        with out_lock held."""
+        self.out_lock.notify()
+
+    def _waitOutput(self, timeout):
+        """Wait until the transmitter has sent End-Of-Stream."""
+        self.out_thread.join(timeout)
+
     def __initServices(self):
         try:
             if self.proxy:
                 return
             if self.state == STATE_CLOSED:
                 return
+            # creates LocatorService on first use, which registers the local
+            # Locator service provider
+            locator_service = protocol.getLocator()
             services.onChannelCreated(self, self.local_service_by_name)
             self.__makeServiceByClassMap(self.local_service_by_name,
                                          self.local_service_by_class)
             args = list(self.local_service_by_name.keys())
-            self.sendEvent(protocol.getLocator(), "Hello",
-                           toJSONSequence((args,)))
+            self.sendEvent(locator_service, "Hello", toJSONSequence((args,)))
         except IOError as x:
             self.terminate(x)
 
@@ -336,6 +399,7 @@ class AbstractChannel(object):
                                 channel.remote_service_by_class.clear()
                                 channel.remote_service_by_name.clear()
                                 channel.event_listeners.clear()
+                                channel.event_dispatch.clear()
                         self.redirect_command = l.redirect(peer_id,
                                                            DoneRedirect())
                 else:
@@ -362,6 +426,7 @@ class AbstractChannel(object):
                             channel.remote_service_by_class.clear()
                             channel.remote_service_by_name.clear()
                             channel.event_listeners.clear()
+                            channel.event_dispatch.clear()
                     self.redirect_command = l.redirect(peer_attrs,
                                                        DoneRedirect())
                 self.state = STATE_OPENING
@@ -402,13 +467,21 @@ class AbstractChannel(object):
         if len(self.trace_listeners) == 0:
             self.trace_listeners = None
 
-    def addEventListener(self, service, listener):
+    def addEventListener(self, service, listener, names=None):
+        """
+        Add a listener of the events of a service.
+        @param names - names of the events to pass to the listener, None
+                       to use listener.event_names.
+        """
         assert protocol.isDispatchThread()
         svc_name = str(service)
         listener.svc_name = svc_name
+        if names is not None:
+            listener.event_names = frozenset(names)
         lst = self.event_listeners.get(svc_name) or []
         lst.append(listener)
         self.event_listeners[svc_name] = lst
+        self.event_dispatch.clear()
 
     def removeEventListener(self, service, listener):
         assert protocol.isDispatchThread()
@@ -422,6 +495,7 @@ class AbstractChannel(object):
                     del self.event_listeners[svc_name]
                 else:
                     del lst[i]
+                self.event_dispatch.clear()
                 return
 
     def addCommandServer(self, service, listener):
@@ -463,8 +537,8 @@ class AbstractChannel(object):
         with self.out_lock:
             del self.out_queue[:]
             self.out_queue.append(None)
-            self.out_lock.notify()
-        self.out_thread.join(timeout)
+            self._notifyOutput()
+        self._waitOutput(timeout)
 
     def _close(self, error):
         assert self.state != STATE_CLOSED
@@ -594,7 +668,7 @@ class AbstractChannel(object):
         msg.trace = self.trace_listeners
         with self.out_lock:
             self.out_queue.append(msg)
-            self.out_lock.notify()
+            self._notifyOutput()
 
     def sendCommand(self, service, name, args, listener):
         assert protocol.isDispatchThread()
@@ -715,7 +789,12 @@ class AbstractChannel(object):
                 token.getListener().progress(token, msg.data)
                 self.__sendCongestionLevel()
             elif typeCode == 'R':
-                token.getListener().result(token, msg.data)
+                l = token.getListener()
+                if msg.args is not None and \
+                        isinstance(l, DecodedCommandListener):
+                    l.resultArgs(token, msg.args)
+                else:
+                    l.result(token, msg.data)
                 self.__sendCongestionLevel()
             elif typeCode == 'N':
                 report = errors.ErrorReport("Command is not recognized",
@@ -756,22 +835,70 @@ class AbstractChannel(object):
                                              x)
                         self.notifying_channel_opened = False
                 else:
-                    lst = self.event_listeners.get(msg.service)
-                    if lst:
-                        for l in lst:
+                    # the arguments are decoded once, if any listener of
+                    # the event wants them decoded
+                    args = msg.args
+                    for l in self.__getEventListeners(msg.service, msg.name):
+                        if isinstance(l, DecodedEventListener):
+                            if args is None:
+                                args = fromJSONSequence(msg.data)
+                            l.eventArgs(msg.name, args)
+                        else:
                             l.event(msg.name, msg.data)
                     self.__sendCongestionLevel()
             elif typeCode == 'F':
-                length = len(msg.data)
-                if length > 0 and msg.data[length - 1] == '\0':
-                    length -= 1
-                self.remote_congestion_level = int(msg.data)
+                # the level is a decimal number terminated by a zero byte
+                self.remote_congestion_level = int(
+                    bytes(msg.data).rstrip(b'\0'))
             else:
                 assert False
         except Exception as x:
             x.tb = sys.exc_info()[2]
             self.terminate(x)
 
+    def decodeArgs(self, msg):
+        """
+        Decode the data of a received command result or event, if its
+        listeners want it decoded, so that the dispatch thread does not
+        have to. Called before the message is passed to the dispatch
+        thread, see DecodePool. Listener tables are read without locking, a
+        stale answer only makes the dispatch thread decode the data.
+        @param msg - received message, msg.args is set to the decoded data.
+        """
+        typeCode = msg.type
+        if typeCode == 'R':
+            cmd = self.out_tokens.get(msg.token.getID())
+            if cmd is None or not isinstance(cmd.token.getListener(),
+                                             DecodedCommandListener):
+                return
+        elif typeCode == 'E':
+            name = msg.name
+            lst = self.event_dispatch.get((msg.service, name))
+            if lst is None:
+                lst = tuple(self.event_listeners.get(msg.service, ()))
+            for l in lst:
+                if isinstance(l, DecodedEventListener) and \
+                        _wantsEvent(l, name):
+                    break
+            else:
+                return
+        else:
+            return
+        try:
+            msg.args = fromJSONSequence(msg.data)
+        except Exception:
+            # the error is reported when the dispatch thread decodes the data
+            pass
+
+    def __getEventListeners(self, service, name):
+        key = (service, name)
+        lst = self.event_dispatch.get(key)
+        if lst is None:
+            lst = tuple(l for l in self.event_listeners.get(service, ())
+                        if _wantsEvent(l, name))
+            self.event_dispatch[key] = lst
+        return lst
+
     def __sendCongestionLevel(self):
         self.local_congestion_cnt += 1
         if self.local_congestion_cnt < 8:
@@ -812,6 +939,24 @@ class AbstractChannel(object):
         """
         raise NotImplementedError("Abstract method")
 
+    def readBytes(self, end, buf):
+        """
+        Read bytes from the channel input stream and append them to a buffer
+        until given terminator is reached. The terminator is consumed, but not
+        appended. Subclasses should override this method if they can read
+        more than one byte at a time.
+        @param end - the terminator: 0 (end of field) or EOM.
+        @param buf - bytearray to append data bytes to.
+        @return the terminator that stopped the reading: 0, EOM or EOS.
+        @raises IOError
+        """
+        while True:
+            n = self.read()
+            if n <= 0:
+                if n == end or n < 0:
+                    return n
+            buf.append(n)
+
     def writeByte(self, n):
         """
         Write one byte into the channel output stream.
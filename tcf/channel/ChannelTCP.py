@@ -13,27 +13,40 @@ import socket
 
 from .. import compat
 from .. import protocol
+from . import IOLoop
 from .StreamChannel import StreamChannel
 
 
 class ChannelTCP(StreamChannel):
     """ChannelTCP is a channel implementation that works on top of TCP sockets
-    as a transport."""
+    as a transport.
 
-    def __init__(self, remote_peer, host, port):
+    If the shared I/O loop is enabled, see IOLoop.enable(), the socket is
+    served by the loop thread instead of the channel reader and transmitter
+    threads.
+
+    If sock is given, the channel uses this connected socket, e.g. accepted by
+    a server, instead of connecting to host and port."""
+
+    def __init__(self, remote_peer, host, port, sock=None):
         super(ChannelTCP, self).__init__(remote_peer)
         self.closed = False
         self.started = False
+        self.io_loop = IOLoop.getIOLoop()
+        self.io_conn = None
         channel = self
 
         class CreateSocket(object):
             def __call__(self):
                 try:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.connect((host, port))
-                    sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
-                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                    channel.socket = sock
+                    if sock is None:
+                        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                        s.connect((host, port))
+                    else:
+                        s = sock
+                    s.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    channel.socket = s
                     channel._onSocketConnected(None)
                 except Exception as x:
                     channel._onSocketConnected(x)
@@ -53,6 +66,24 @@ class ChannelTCP(StreamChannel):
             self.started = True
             self.start()
 
+    def _startIO(self):
+        if self.io_loop is None:
+            super(ChannelTCP, self)._startIO()
+        else:
+            self.io_conn = self.io_loop.addChannel(self)
+
+    def _notifyOutput(self):
+        if self.io_loop is None:
+            super(ChannelTCP, self)._notifyOutput()
+        elif self.io_conn is not None:
+            self.io_conn.scheduleOutput()
+
+    def _waitOutput(self, timeout):
+        if self.io_loop is None:
+            super(ChannelTCP, self)._waitOutput(timeout)
+        elif self.io_conn is not None:
+            self.io_conn.out_done.wait(timeout)
+
     def get(self):
         if self.closed:
             return -1
@@ -100,10 +131,30 @@ class ChannelTCP(StreamChannel):
             s = self.str2bytes(buf)
         self.socket.sendall(s)
 
-    def flush(self):
-        pass
+    def putBufs(self, bufs):
+        if self.closed:
+            return
+        if self.io_conn is not None:
+            # transmitted by the loop thread
+            self.io_conn.putBufs(bufs)
+            return
+        if len(bufs) == 1 or not hasattr(self.socket, "sendmsg"):
+            for buf in bufs:
+                self.socket.sendall(buf)
+            return
+        views = [memoryview(buf) for buf in bufs]
+        while views:
+            n = self.socket.sendmsg(views[:512])
+            while n > 0:
+                if n >= len(views[0]):
+                    n -= len(views.pop(0))
+                else:
+                    views[0] = views[0][n:]
+                    n = 0
 
     def stop(self):
         self.closed = True
-        if self.started:
+        if self.io_conn is not None:
+            self.io_loop.invoke(self.io_conn.close)
+        elif self.started:
             self.socket.close()
@@ -11,9 +11,10 @@
 
 from .. import protocol, errors, services
 from ..channel import Token, toJSONSequence, fromJSONSequence, dumpJSONObject
+from ..channel import DecodedCommandListener
 
 
-class Command(object):
+class Command(DecodedCommandListener):
     """This is utility class that helps to implement sending a command and
     receiving command result over TCF communication channel.
 
@@ -52,10 +53,9 @@ class Command(object):
         self.args = args
         t = None
         try:
-            # TODO zero_copy
-            # zero_copy = channel.isZeroCopySupported()
-            t = channel.sendCommand(service, command, toJSONSequence(args),
-                                    self)
+            zero_copy = channel.isZeroCopySupported()
+            t = channel.sendCommand(service, command,
+                                    toJSONSequence(args, zero_copy), self)
         except Exception as y:
             t = Token()
             protocol.invokeLater(self._error, y)
@@ -81,6 +81,12 @@ class Command(object):
         self.__done = True
         self.done(error, args)
 
+    def resultArgs(self, token, args):
+        assert self.token is token
+        assert not self.__done
+        self.__done = True
+        self.done(None, args)
+
     def terminated(self, token, error):
         assert self.token is token
         assert not self.__done
@@ -91,32 +97,51 @@ class Command(object):
         raise NotImplementedError("Abstract method")
 
     def getCommandString(self):
-        buf = str(self.service) + ' ' + str(self.command)
-        if self.args is not None:
-            i = 0
-            for arg in self.args:
-                if i == 0:
-                    buf += " "
-                else:
-                    buf += ", "
-                i += 1
-                try:
-                    buf += dumpJSONObject(arg)
-                except Exception as x:
-                    # Exception.message does not exist in python3, better use
-                    # str(Exception)
-                    buf += '***' + str(x) + '***'
-        return buf
+        return getCommandString(self.service, self.command, self.args)
 
     def toError(self, data, include_command_text=True):
         if not isinstance(data, dict):
             return None
-        errMap = data
-        bf = 'TCF error report:\n'
         if include_command_text:
-            cmd = self.getCommandString()
-            if len(cmd) > 120:
-                cmd = cmd[:120] + "..."
-            bf += 'Command: ' + str(cmd)
-        bf += errors.appendErrorProps(errMap)
-        return errors.ErrorReport(bf, errMap)
+            return toError(data, self.getCommandString())
+        return toError(data)
+
+
+def getCommandString(service, command, args):
+    """Get text representation of a command, used in error reports."""
+    buf = str(service) + ' ' + str(command)
+    if args is not None:
+        i = 0
+        for arg in args:
+            if i == 0:
+                buf += " "
+            else:
+                buf += ", "
+            i += 1
+            try:
+                buf += dumpJSONObject(arg)
+            except Exception as x:
+                # Exception.message does not exist in python3, better use
+                # str(Exception)
+                buf += '***' + str(x) + '***'
+    return buf
+
+
+def toError(data, command_string=None):
+    """
+    Convert TCF error report data to ErrorReport.
+    @param data - error report object as received in command result.
+    @param command_string - text of the command to include in the report.
+    @return ErrorReport, or None if data is not an error report.
+    """
+    if not isinstance(data, dict):
+        return None
+    errMap = data
+    bf = 'TCF error report:\n'
+    if command_string is not None:
+        cmd = command_string
+        if len(cmd) > 120:
+            cmd = cmd[:120] + "..."
+        bf += 'Command: ' + str(cmd)
+    bf += errors.appendErrorProps(errMap)
+    return errors.ErrorReport(bf, errMap)
@@ -0,0 +1,156 @@
+"""
+Decoding of received messages before they reach the dispatch thread.
+
+By default the data of received messages is decoded on the dispatch thread,
+by the listeners that use it, so JSON decoding of all channels competes with
+the callbacks for that one thread. When enabled with enable(), the data of
+command results and events that listeners want decoded, see
+DecodedCommandListener and DecodedEventListener, is decoded before the
+messages are passed to the dispatch thread: by the reader thread of the
+channel (or the shared I/O loop thread, see IOLoop), or by a pool of decoder
+threads shared by all channels. Messages of a channel reach the dispatch
+thread in the order they were received either way.
+
+Under the GIL the decoding threads and the dispatch thread still run one at
+a time, but the dispatch thread spends its time on callbacks only. On
+free-threaded Python builds the decoding runs in parallel.
+"""
+
+import collections
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # @UnresolvedImport
+
+from .. import protocol
+
+# maximum number of messages waiting for the decoder threads, a reader that
+# posts more messages waits
+QUEUE_SIZE = 1024
+
+_lock = threading.Lock()
+_enabled = False
+_threads = 0
+_pool = None
+
+
+def enable(enabled=True, threads=0):
+    """
+    Enable or disable decoding before the dispatch thread for channels that
+    are opened after the call. Channels that are already open keep their
+    decoding.
+    @param enabled - True to decode before the dispatch thread.
+    @param threads - number of decoder threads, 0 to decode on the reader
+                     thread of every channel.
+    """
+    global _enabled, _threads, _pool
+    with _lock:
+        if threads != _threads:
+            # the old pool keeps serving the channels that use it
+            _pool = None
+        _enabled = enabled
+        _threads = threads
+
+
+def isEnabled():
+    return _enabled
+
+
+def getDecodePool():
+    """
+    Get the decode pool for a new channel, decoder threads are started on
+    first use.
+    @return DecodePool, or None if decoding before the dispatch thread is
+            not enabled.
+    """
+    global _pool
+    if not _enabled:
+        return None
+    with _lock:
+        if _pool is None:
+            _pool = DecodePool(_threads)
+        return _pool
+
+
+class Sequence(object):
+    """Passes the messages of one channel to the dispatch thread, in the
+    order they were received, after their data is decoded."""
+
+    def __init__(self, pool, channel, handler):
+        self.pool = pool
+        self.channel = channel
+        self.handler = handler
+        self.lock = threading.Lock()
+        # [ready, callable, args] entries in order of posting
+        self.pending = collections.deque()
+
+    def post(self, msg):
+        """Decode the data of msg and pass msg to the handler on the
+        dispatch thread."""
+        if self.pool.queue is None:
+            self.channel.decodeArgs(msg)
+            protocol.invokeLater(self.handler, msg)
+            return
+        entry = [False, self.handler, (msg,)]
+        with self.lock:
+            self.pending.append(entry)
+        self.pool.queue.put((self, entry))
+
+    def invokeLater(self, c, *args):
+        """Call c(*args) on the dispatch thread after the messages posted
+        before."""
+        if self.pool.queue is None:
+            protocol.invokeLater(c, *args)
+            return
+        with self.lock:
+            self.pending.append([True, c, args])
+            self._flush()
+
+    def _decoded(self, entry):
+        with self.lock:
+            entry[0] = True
+            self._flush()
+
+    def _flush(self):
+        pending = self.pending
+        while pending and pending[0][0]:
+            ready, c, args = pending.popleft()
+            try:
+                protocol.invokeLater(c, *args)
+            except:
+                # TCF event dispatcher has shut down
+                pass
+
+
+class DecodePool(object):
+    """Decoder threads shared by channels, none to decode on the thread
+    that posts the messages."""
+
+    def __init__(self, threads):
+        self.queue = queue.Queue(QUEUE_SIZE) if threads > 0 else None
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self._run,
+                                      name="TCF Decoder %d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def open(self, channel, handler):
+        """
+        Create a message sequence of a channel.
+        @param handler - called with every message on the dispatch thread.
+        @return Sequence object.
+        """
+        return Sequence(self, channel, handler)
+
+    def _run(self):
+        while True:
+            seq, entry = self.queue.get()
+            try:
+                seq.channel.decodeArgs(entry[2][0])
+            except Exception as x:
+                protocol.log("Exception in TCF decoder", x)
+            seq._decoded(entry)
@@ -0,0 +1,327 @@
+"""
+Shared I/O loop for TCP channels.
+
+By default every channel runs a reader thread and a transmitter thread, so a
+client connected to hundreds of agents runs hundreds of threads. When the
+shared loop is enabled with enable(), new ChannelTCP channels use
+non-blocking sockets served by a single "TCF I/O Loop" thread, which
+multiplexes reads and writes of all the channels with the selectors module.
+The loop decodes incoming messages and passes them to the dispatch thread
+the same way as ReaderThread, and transmits the output queue of a channel
+from a per-channel buffer.
+
+The loop thread never sleeps, so congestion delays of the reader and
+transmitter threads are not applied to channels that use the loop.
+"""
+
+import collections
+import errno
+import socket
+import sys
+import threading
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+from .. import protocol
+from . import Token
+from .AbstractChannel import Message, EOS, EOM
+from .StreamChannel import StreamDecoder
+
+_lock = threading.Lock()
+_enabled = False
+_loop = None
+
+_would_block = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def enable(enabled=True):
+    """
+    Enable or disable the shared I/O loop for channels that are opened
+    after the call. Channels that are already open keep their threads.
+    @param enabled - True to use the shared loop.
+    """
+    global _enabled
+    if enabled and selectors is None:
+        raise RuntimeError("Shared I/O loop requires selectors module")
+    _enabled = enabled
+
+
+def isEnabled():
+    return _enabled
+
+
+def getIOLoop():
+    """
+    Get the shared I/O loop, the loop thread is started on first use.
+    @return IOLoop, or None if the shared loop is not enabled.
+    """
+    global _loop
+    if not _enabled:
+        return None
+    with _lock:
+        if _loop is None:
+            _loop = IOLoop()
+            _loop.start()
+        return _loop
+
+
+def parseMessage(data):
+    """
+    Convert a message decoded by StreamDecoder to Message.
+    @param data - message bytearray, without End-Of-Message marker.
+    @return Message object.
+    @raises IOError
+    """
+    if len(data) < 2 or data[1] != 0:
+        raise IOError("Protocol syntax error")
+    msg = Message(data[0])
+    typeCode = msg.type
+    pos = 2
+    if typeCode in 'CPRN':
+        end = data.index(b'\0', pos)
+        msg.token = Token(data[pos:end])
+        pos = end + 1
+    if typeCode in 'CE':
+        end = data.index(b'\0', pos)
+        msg.service = data[pos:end].decode("UTF8")
+        pos = end + 1
+        end = data.index(b'\0', pos)
+        msg.name = data[pos:end].decode("UTF8")
+        pos = end + 1
+    elif typeCode not in 'PRNF':
+        raise IOError("Protocol syntax error")
+    msg.data = data[pos:]
+    return msg
+
+
+class Connection(object):
+    """State of a channel served by the loop. Methods other than
+    scheduleOutput() are called on the loop thread only."""
+
+    def __init__(self, loop, channel):
+        self.loop = loop
+        self.channel = channel
+        self.sock = channel.socket
+        self.sock.setblocking(False)
+        self.decoder = StreamDecoder()
+        self.out = collections.deque()
+        self.events = selectors.EVENT_READ
+        self.output_scheduled = False
+        self.eos = False
+        self.out_closed = False
+        self.out_done = threading.Event()
+        self.registered = False
+        self.closed = False
+
+    def scheduleOutput(self):
+        """Schedule transmission of the channel output queue. Called with
+        the channel out_lock held."""
+        if not self.output_scheduled:
+            self.output_scheduled = True
+            self.loop.invoke(self.output)
+
+    def register(self):
+        self._setEvents(self.events)
+
+    def close(self):
+        self._setEvents(0)
+        self.closed = True
+        self.out_done.set()
+        try:
+            self.sock.close()
+        except socket.error as x:
+            protocol.log("Cannot close socket", x)
+
+    def _setEvents(self, events):
+        old = self.events if self.registered else 0
+        self.events = events
+        if self.closed or events == old:
+            return
+        selector = self.loop.selector
+        if not old:
+            selector.register(self.sock, events, self)
+            self.registered = True
+        elif events:
+            selector.modify(self.sock, events, self)
+        else:
+            selector.unregister(self.sock)
+            self.registered = False
+
+    def _fail(self, x):
+        self._setEvents(0)
+        self.closed = True
+        self.out_done.set()
+        if self.channel.closed:
+            return
+        try:
+            x.tb = sys.exc_info()[2]
+            self.channel.inp_thread.invokeLater(self.channel.terminate, x)
+        except:
+            # TCF event dispatcher has shut down
+            pass
+
+    def output(self):
+        channel = self.channel
+        with channel.out_lock:
+            self.output_scheduled = False
+            msgs = channel.out_queue[:]
+            del channel.out_queue[:]
+            for msg in msgs:
+                if msg and not msg.is_canceled:
+                    msg.is_sent = True
+        if self.out_closed or self.closed:
+            return
+        try:
+            for msg in msgs:
+                if not msg:
+                    channel.write(EOS)
+                    channel.write(EOM)
+                    self.out_closed = True
+                    break
+                if msg.is_canceled:
+                    continue
+                if msg.trace:
+                    protocol.invokeLater(channel._traceMessageSent, msg)
+                channel.writeMessage(msg)
+            channel.flush()
+        except Exception as x:
+            self._fail(x)
+            return
+        self.send()
+
+    def putBufs(self, bufs):
+        for buf in bufs:
+            self.out.append(memoryview(buf))
+
+    def send(self):
+        out = self.out
+        sock = self.sock
+        try:
+            while out:
+                if len(out) > 1 and hasattr(sock, "sendmsg"):
+                    n = sock.sendmsg([out[i] for i in
+                                      range(min(len(out), 512))])
+                else:
+                    n = sock.send(out[0])
+                while n > 0:
+                    if n >= len(out[0]):
+                        n -= len(out.popleft())
+                    else:
+                        out[0] = out[0][n:]
+                        n = 0
+        except socket.error as x:
+            if x.errno not in _would_block:
+                self._fail(x)
+                return
+        if out:
+            self._setEvents(self.events | selectors.EVENT_WRITE)
+        else:
+            self._setEvents(self.events & ~selectors.EVENT_WRITE)
+            if self.out_closed:
+                self.out_done.set()
+
+    def receive(self):
+        try:
+            n = self.sock.recv_into(self.loop.buf)
+        except socket.error as x:
+            if x.errno not in _would_block:
+                self._fail(x)
+            return
+        if n == 0:
+            self._endOfStream(None)
+            return
+        reader = self.channel.inp_thread
+        try:
+            for data in self.decoder.feed(self.loop.view[:n]):
+                if self.eos:
+                    self._endOfStream(data)
+                    return
+                if data is None:
+                    self.eos = True
+                    continue
+                reader.post(parseMessage(data))
+        except Exception as x:
+            self._fail(x)
+
+    def _endOfStream(self, report):
+        self._setEvents(self.events & ~selectors.EVENT_READ)
+        if self.channel.closed:
+            return
+        reader = self.channel.inp_thread
+        if report is not None and len(report) > 0 and \
+                not (len(report) == 1 and report[0] == 0):
+            reader.eos_err_report = report
+        try:
+            reader.invokeLater(reader.handleEOS)
+        except:
+            # TCF event dispatcher has shut down
+            pass
+
+
+class IOLoop(threading.Thread):
+    """I/O thread that serves sockets of all channels that use the shared
+    loop. Other threads pass work to the loop with invoke()."""
+
+    def __init__(self):
+        super(IOLoop, self).__init__(name="TCF I/O Loop")
+        self.daemon = True
+        self.selector = selectors.DefaultSelector()
+        self.buf = bytearray(0x10000)
+        self.view = memoryview(self.buf)
+        self.lock = threading.Lock()
+        self.queue = []
+        self.wakeup_sent = False
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+    def invoke(self, c, *args):
+        """Call c(*args) on the loop thread."""
+        with self.lock:
+            self.queue.append((c, args))
+            if self.wakeup_sent:
+                return
+            self.wakeup_sent = True
+        try:
+            self.wakeup_w.send(b'\0')
+        except socket.error:
+            # the wake up byte is already pending
+            pass
+
+    def addChannel(self, channel):
+        """
+        Start serving the socket of a connected channel.
+        @return Connection object of the channel.
+        """
+        conn = Connection(self, channel)
+        self.invoke(conn.register)
+        return conn
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                conn = key.data
+                if conn is None:
+                    try:
+                        while self.wakeup_r.recv(256):
+                            pass
+                    except socket.error:
+                        pass
+                    continue
+                if events & selectors.EVENT_WRITE and conn.registered:
+                    conn.send()
+                if events & selectors.EVENT_READ and conn.registered:
+                    conn.receive()
+            with self.lock:
+                queue = self.queue
+                self.queue = []
+                self.wakeup_sent = False
+            for c, args in queue:
+                try:
+                    c(*args)
+                except Exception as x:
+                    protocol.log("Exception in TCF I/O loop", x)
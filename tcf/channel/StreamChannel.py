@@ -36,8 +36,13 @@ class StreamChannel(AbstractChannel):
         super(StreamChannel, self).__init__(remote_peer, local_peer=local_peer)
         self.bin_data_size = 0
         self.buf = bytearray(0x1000)
+        self.buf_view = memoryview(self.buf)
         self.buf_pos = 0
         self.buf_len = 0
+        self.out_buf = bytearray()
+        self.out_chunks = []
+        self.out_size = 0
+        self.out_buf_limit = 0x100000
 
     def get(self):
         pass
@@ -64,63 +69,120 @@ class StreamChannel(AbstractChannel):
         for b in buf:
             self.put(b & 0xff)
 
+    def putBufs(self, bufs):
+        """Transmit a list of buffers. Subclasses can override this method to
+        send all the buffers with a single system call."""
+        for buf in bufs:
+            self.putBuf(buf)
+
+    def _fill(self):
+        """Refill the input buffer.
+
+        @return False if end of stream is reached.
+        """
+        self.buf_len = self.getBuf(self.buf)
+        self.buf_pos = 0
+        if self.buf_len <= 0:
+            self.buf_len = 0
+            return False
+        return True
+
+    def _readEscape(self):
+        """Decode an escape sequence, the ESC byte is already consumed.
+
+        @return ESC for an escaped ESC byte, EOM or EOS for the markers, or
+                None if the sequence was a binary data length prefix.
+        """
+        if self.buf_pos >= self.buf_len and not self._fill():
+            return EOS
+        n = self.buf[self.buf_pos]
+        self.buf_pos += 1
+        if n == 0:
+            return ESC
+        elif n == 1:
+            return EOM
+        elif n == 2:
+            return EOS
+        elif n == 3:
+            size = 0
+            for i in range(0, 100000, 7):
+                if self.buf_pos >= self.buf_len and not self._fill():
+                    return EOS
+                m = self.buf[self.buf_pos]
+                self.buf_pos += 1
+                size |= (m & 0x7f) << i
+                if (m & 0x80) == 0:
+                    break
+            self.bin_data_size = size
+            return None
+        raise IOError("Protocol syntax error")
+
     def read(self):
         while True:
-            while self.buf_pos >= self.buf_len:
-                self.buf_len = self.getBuf(self.buf)
-                self.buf_pos = 0
-                if self.buf_len < 0:
-                    return EOS
-            res = self.buf[self.buf_pos] & 0xff
+            if self.buf_pos >= self.buf_len and not self._fill():
+                return EOS
+            res = self.buf[self.buf_pos]
             self.buf_pos += 1
             if self.bin_data_size > 0:
                 self.bin_data_size -= 1
                 return res
             if res != ESC:
                 return res
-            while self.buf_pos >= self.buf_len:
-                self.buf_len = self.getBuf(self.buf)
-                self.buf_pos = 0
-                if self.buf_len < 0:
-                    return EOS
-            n = self.buf[self.buf_pos] & 0xff
-            self.buf_pos += 1
-            if n == 0:
-                return ESC
-            elif n == 1:
-                return EOM
-            elif n == 2:
-                return EOS
-            elif n == 3:
-                for i in range(0, 100000, 7):
-                    while self.buf_pos >= self.buf_len:
-                        self.buf_len = self.getBuf(self.buf)
-                        self.buf_pos = 0
-                        if self.buf_len < 0:
-                            return EOS
-                    m = self.buf[self.buf_pos] & 0xff
-                    self.buf_pos += 1
-                    self.bin_data_size |= (m & 0x7f) << i
-                    if (m & 0x80) == 0:
-                        break
-            else:
-                if n < 0:
+            res = self._readEscape()
+            if res is not None:
+                return res
+
+    def readBytes(self, end, data):
+        # Scan the input buffer for escape sequences and field separators
+        # with bytearray.find(), and copy whole runs of plain bytes at once.
+        buf = self.buf
+        view = self.buf_view
+        while True:
+            pos = self.buf_pos
+            if pos >= self.buf_len:
+                if not self._fill():
                     return EOS
-                assert False
+                pos = 0
+            lim = self.buf_len
+            size = self.bin_data_size
+            if size > 0:
+                stop = min(lim, pos + size)
+                data += view[pos:stop]
+                self.bin_data_size = size - (stop - pos)
+                self.buf_pos = stop
+                continue
+            esc = buf.find(ESC, pos, lim)
+            stop = lim if esc < 0 else esc
+            if end == 0:
+                sep = buf.find(0, pos, stop)
+                if sep >= 0:
+                    data += view[pos:sep]
+                    self.buf_pos = sep + 1
+                    return 0
+            data += view[pos:stop]
+            if esc < 0:
+                self.buf_pos = lim
+                continue
+            self.buf_pos = esc + 1
+            n = self._readEscape()
+            if n == ESC:
+                data.append(ESC)
+            elif n is not None:
+                return n
 
     def writeByte(self, n):
         if n == ESC:
-            self.put(ESC)
-            self.put(0)
+            self.out_buf += b'\x03\x00'
         elif n == EOM:
-            self.put(ESC)
-            self.put(1)
+            self.out_buf += b'\x03\x01'
         elif n == EOS:
-            self.put(ESC)
-            self.put(2)
+            self.out_buf += b'\x03\x02'
         else:
             assert n >= 0 and n <= 0xff
-            self.put(n)
+            self.out_buf.append(n)
+            self.out_size += 1
+            return
+        self.out_size += 2
 
     def write(self, buf):
         if isinstance(buf, int):
@@ -129,20 +191,108 @@ class StreamChannel(AbstractChannel):
         elif isinstance(buf, compat.strings):
             buf = bytearray(buf, 'utf-8')
 
-        if len(buf) > 32 and self.isZeroCopySupported():
-            self.put(ESC)
-            self.put(3)
-            n = len(buf)
+        n = len(buf)
+        if n > 32 and self.isZeroCopySupported():
+            out = self.out_buf
+            out.append(ESC)
+            out.append(3)
             while True:
                 if n <= 0x7f:
-                    self.put(n)
+                    out.append(n)
                     break
-                self.put((n & 0x7f) | 0x80)
+                out.append((n & 0x7f) | 0x80)
                 n >>= 7
-            self.putBuf(buf)
+            if len(buf) >= len(self.buf):
+                # Large binary blocks are transmitted without copying
+                self.out_chunks.append(out)
+                self.out_chunks.append(buf)
+                self.out_buf = bytearray()
+            else:
+                out += buf
         else:
-            for b in buf:
-                n = b & 0xff
-                self.put(n)
-                if n == ESC:
-                    self.put(0)
+            self.out_buf += buf.replace(b'\x03', b'\x03\x00')
+        self.out_size += len(buf)
+        if self.out_size >= self.out_buf_limit:
+            self.flush()
+
+    def flush(self):
+        if self.out_buf:
+            self.out_chunks.append(self.out_buf)
+            self.out_buf = bytearray()
+        if self.out_chunks:
+            chunks = self.out_chunks
+            self.out_chunks = []
+            self.out_size = 0
+            self.putBufs(chunks)
+
+
+class StreamDecoder(object):
+    """Incremental decoder of the stream channel framing, for transports
+    that receive data in arbitrary chunks instead of reading the stream.
+
+    feed() takes received bytes and returns the list of complete messages,
+    bytearrays with escape sequences removed, and None for each
+    End-Of-Stream marker.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.msg = bytearray()
+        self.bin_data_size = 0
+
+    def feed(self, data):
+        buf = self.buf
+        buf += data
+        n = len(buf)
+        pos = 0
+        out = []
+        while pos < n:
+            if self.bin_data_size > 0:
+                # raw ZeroCopy binary block
+                k = min(self.bin_data_size, n - pos)
+                self.msg += buf[pos:pos + k]
+                pos += k
+                self.bin_data_size -= k
+                continue
+            i = buf.find(b'\x03', pos)
+            if i < 0:
+                self.msg += buf[pos:]
+                pos = n
+                break
+            self.msg += buf[pos:i]
+            pos = i
+            if i + 1 >= n:
+                break
+            code = buf[i + 1]
+            if code == 0:
+                self.msg.append(ESC)
+                pos = i + 2
+            elif code == 1:
+                out.append(self.msg)
+                self.msg = bytearray()
+                pos = i + 2
+            elif code == 2:
+                out.append(None)
+                pos = i + 2
+            elif code == 3:
+                size = 0
+                shift = 0
+                j = i + 2
+                complete = False
+                while j < n:
+                    m = buf[j]
+                    j += 1
+                    size |= (m & 0x7f) << shift
+                    shift += 7
+                    if (m & 0x80) == 0:
+                        complete = True
+                        break
+                if not complete:
+                    # length is not received yet
+                    break
+                self.bin_data_size = size
+                pos = j
+            else:
+                raise IOError("Protocol syntax error")
+        del buf[:pos]
+        return out
@@ -10,9 +10,14 @@
 # *****************************************************************************
 
 import binascii
+import itertools
 import json
+import os
+import re
 import types
 
+from .. import compat
+
 # channel states
 STATE_OPENING = 0
 STATE_OPEN = 1
@@ -106,6 +111,8 @@ class EventListener(object):
     unless no such interface is defined.
     """
     svc_name = "<unknown>"
+    # names of the events passed to the listener, None for all events
+    event_names = None
 
     def event(self, name, data):
         """
@@ -116,6 +123,58 @@ class EventListener(object):
         pass
 
 
+class DecodedEventListener(EventListener):
+    """
+    Event listener that receives decoded event arguments. The channel
+    decodes the arguments of an event once and passes the same list to all
+    such listeners of the event, so the list must not be modified.
+    """
+
+    def event(self, name, data):
+        self.eventArgs(name, fromJSONSequence(data))
+
+    def eventArgs(self, name, args):
+        """
+        Called when service event message is received
+        @param name - event name
+        @param args - list of decoded event arguments
+        """
+        pass
+
+
+def _getFunction(obj, name):
+    f = getattr(obj, name, None)
+    return getattr(f, "__func__", f)
+
+
+def getEventNames(listener, interface, events):
+    """
+    Get names of the events a service listener handles, the events whose
+    methods of the listener interface are overridden by the listener.
+    @param listener - service listener object.
+    @param interface - service listener interface class, its methods do
+                       nothing.
+    @param events - sequence of event names, or (event name, method name)
+                    tuples for events handled by methods of other names.
+    @return set of event names, None for all events if listener does not
+            extend interface.
+    """
+    if not isinstance(listener, interface):
+        return None
+    cls = type(listener)
+    names = set()
+    for name in events:
+        if isinstance(name, tuple):
+            name, method = name
+        else:
+            method = name
+        if method in getattr(listener, "__dict__", ()) or \
+                _getFunction(cls, method) is not _getFunction(interface,
+                                                              method):
+            names.add(name)
+    return names
+
+
 class CommandServer(object):
     """
     Command server interface.
@@ -164,14 +223,216 @@ class CommandListener(object):
         pass
 
 
-def toJSONSequence(args):
+class DecodedCommandListener(CommandListener):
+    """
+    Command listener that receives decoded command results. Results decoded
+    before they reach the dispatch thread, see DecodePool, are passed to
+    resultArgs() without decoding them again.
+    """
+
+    def result(self, token, data):
+        self.resultArgs(token, fromJSONSequence(data))
+
+    def resultArgs(self, token, args):
+        """
+        Called when command result received from remote peer.
+        @param token - command handle
+        @param args - list of decoded result arguments
+        """
+        pass
+
+
+class JSONCodec(object):
+    """JSON codec of message arguments, implemented with the json module of
+    the standard library.
+
+    A codec encodes one argument with dumps() and decodes the UTF-8 JSON
+    text of one argument with loads(). Binary data in the arguments is
+    encoded as base64 strings.
+    """
+    name = "json"
+
+    def dumps(self, obj):
+        """@return JSON text of obj, str or UTF-8 bytes."""
+        return json.dumps(obj, separators=(',', ':'), cls=TCFJSONEncoder)
+
+    def loads(self, data):
+        """@return object decoded from bytes, bytearray or memoryview
+        data."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data.decode("UTF-8"))
+
+
+class OrjsonCodec(JSONCodec):
+    """JSON codec implemented with the orjson package, which decodes UTF-8
+    bytes without converting them to str. Values orjson does not support,
+    such as integers beyond 64 bits, are handled by the standard library
+    codec."""
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.fallback = JSONCodec()
+
+    def dumps(self, obj):
+        try:
+            return self.orjson.dumps(obj, default=_toJSONValue)
+        except TypeError:
+            return self.fallback.dumps(obj)
+
+    def loads(self, data):
+        try:
+            obj = self.orjson.loads(data)
+        except ValueError:
+            return self.fallback.loads(data)
+        # orjson reads integers beyond 64 bits as floats. Such integers have
+        # at least 19 digits, the values of a container are checked only if
+        # its text has that many digits in a row.
+        t = type(obj)
+        if t is float:
+            large = abs(obj) >= _LARGE_FLOAT
+        elif t is dict or t is list:
+            large = bytes(data).translate(_digits).find(_long_number) >= 0 \
+                and _hasLargeFloat(obj)
+        else:
+            return obj
+        if large:
+            return self.fallback.loads(data)
+        return obj
+
+
+# floats of at least this magnitude can be integers beyond 64 bits
+_LARGE_FLOAT = float(2 ** 63)
+
+# translation of digits to b'1' and other bytes to b'0'
+_digits = bytes(bytearray(0x31 if 0x30 <= i <= 0x39 else 0x30
+                          for i in range(256)))
+_long_number = b'1' * 19
+
+
+def _hasLargeFloat(obj):
+    # values are checked level by level, so that most of the loops run in C
+    items = [obj]
+    while items:
+        kinds = set(map(type, items))
+        if float in kinds:
+            for o in items:
+                if type(o) is float and abs(o) >= _LARGE_FLOAT:
+                    return True
+        nested = []
+        if dict in kinds:
+            nested.extend(itertools.chain.from_iterable(
+                map(dict.values, filter(dict.__instancecheck__, items))))
+        if list in kinds:
+            nested.extend(itertools.chain.from_iterable(
+                filter(list.__instancecheck__, items)))
+        items = nested
+    return False
+
+
+# name -> codec class, in order of preference
+CODECS = (("orjson", OrjsonCodec), ("json", JSONCodec))
+
+_codec = None
+
+
+def getCodec():
+    """@return JSON codec used to encode and decode message arguments."""
+    return _codec
+
+
+def setCodec(codec=None):
+    """
+    Select the JSON codec used by toJSONSequence() and fromJSONSequence().
+    @param codec - JSONCodec object, or codec name. None selects the codec
+                   named by the TCF_JSON_CODEC environment variable, or the
+                   first one of CODECS that is installed.
+    @return the selected codec.
+    """
+    global _codec
+    if codec is None:
+        codec = os.environ.get("TCF_JSON_CODEC")
+    if codec is None or isinstance(codec, compat.strings):
+        for name, cls in CODECS:
+            if codec is not None and name != codec:
+                continue
+            try:
+                _codec = cls()
+                return _codec
+            except ImportError:
+                if codec is not None:
+                    raise
+        raise ValueError("Unknown JSON codec: %s" % codec)
+    _codec = codec
+    return _codec
+
+
+def _toBase64JSON(data):
+    """@return JSON string of binary data as UTF-8 bytes."""
+    return b'"' + binascii.b2a_base64(data)[:-1] + b'"'
+
+
+class PreparedBinary(object):
+    """Binary command argument that is encoded once and sent many times,
+    e.g. the same file data written to several channels. The base64 JSON
+    form is computed on first use and kept."""
+
+    def __init__(self, data):
+        self.data = data if isinstance(data, bytearray) else bytearray(data)
+        self.json = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def getJSON(self):
+        if self.json is None:
+            self.json = _toBase64JSON(self.data)
+        return self.json
+
+
+def toJSONSequence(args, zero_copy=False):
     if args is None:
         return None
+    dumps = _codec.dumps
     sequence = []
+    binary = False
+    text = True
     for arg in args:
-        sequence.append(json.dumps(arg, separators=(',', ':'),
-                                   cls=TCFJSONEncoder))
-    if sequence:
+        if isinstance(arg, PreparedBinary):
+            if zero_copy:
+                sequence.append(arg.data)
+                binary = True
+            else:
+                sequence.append(arg.getJSON())
+                text = False
+        elif isinstance(arg, bytearray):
+            if zero_copy:
+                sequence.append(arg)
+                binary = True
+            else:
+                sequence.append(_toBase64JSON(arg))
+                text = False
+        else:
+            item = dumps(arg)
+            if not isinstance(item, compat.strings):
+                text = False
+            sequence.append(item)
+    if binary or not text:
+        # ZeroCopy: binary arguments are sent as "(<size>)" followed by
+        # <size> raw bytes instead of base64 strings
+        res = bytearray()
+        for item in sequence:
+            if isinstance(item, bytearray):
+                res += ('(%d)' % len(item)).encode('ascii')
+                res += item
+            elif isinstance(item, bytes):
+                res += item
+            else:
+                res += item.encode('UTF-8')
+            res.append(0)
+    elif sequence:
         res = '\0'.join(sequence) + '\0'
     else:
         res = ''
@@ -179,22 +440,95 @@ def toJSONSequence(args):
     return res
 
 
+# JSON string, start of ZeroCopy binary data or end of argument
+_json_token = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"|[(\0]', re.DOTALL)
+
+
+def _readBinary(byteArray, pos):
+    close = byteArray.find(b')', pos + 1)
+    if close < 0:
+        raise ValueError("Invalid binary data")
+    start = close + 1
+    end = start + int(byteArray[pos + 1:close])
+    if end > len(byteArray):
+        raise ValueError("Invalid binary data size")
+    return end, byteArray[start:end]
+
+
+def _readNestedBinary(byteArray, pos, end):
+    # Binary data nested in JSON objects or arrays is converted to base64
+    # strings, as if it was received from a peer without ZeroCopy support.
+    res = bytearray()
+    seg = pos
+    while True:
+        m = _json_token.search(byteArray, pos, end)
+        if m is None:
+            pos = end
+            break
+        c = byteArray[m.start()]
+        if c == 0:
+            pos = m.start()
+            break
+        if c == 0x28:
+            res += byteArray[seg:m.start()]
+            pos, data = _readBinary(byteArray, m.start())
+            res += b'"' + binascii.b2a_base64(data)[:-1] + b'"'
+            seg = pos
+        else:
+            pos = m.end()
+    res += byteArray[seg:pos]
+    return pos, res
+
+
+# messages up to this size are decoded with one call of the codec, copying
+# them is cheaper than decoding every argument separately
+_JOIN_SIZE = 0x1000
+
+
 def fromJSONSequence(byteArray):
-    if byteArray[-1] == 0:
-        del byteArray[-1]
-    jsonStr = byteArray.decode("UTF-8")
-    parts = jsonStr.split('\0')
+    end = len(byteArray)
+    if end > 0 and byteArray[end - 1] == 0:
+        end -= 1
+    loads = _codec.loads
+    if 0 < end <= _JOIN_SIZE and byteArray.find(b'(', 0, end) < 0:
+        # no binary data, zero bytes can't appear in JSON text: decode the
+        # arguments of a short message as one JSON array. Empty arguments
+        # make the array invalid, they are decoded one by one below.
+        try:
+            return loads(b'[' + byteArray[:end].replace(b'\0', b',') + b']')
+        except ValueError:
+            pass
+    # arguments are decoded from slices of the view, without copies
+    view = memoryview(byteArray)
     objects = []
-    for part in parts:
-        if part:
-            objects.append(json.loads(part))
+    pos = 0
+    while True:
+        if pos < end and byteArray[pos] == 0x28:
+            pos, data = _readBinary(byteArray, pos)
+            objects.append(data)
         else:
-            objects.append(None)
+            nxt = byteArray.find(0, pos, end)
+            if nxt < 0:
+                nxt = end
+            if byteArray.find(b'(', pos, nxt) >= 0:
+                nxt, part = _readNestedBinary(byteArray, pos, end)
+                objects.append(loads(part) if part else None)
+            elif nxt > pos:
+                objects.append(loads(view[pos:nxt]))
+            else:
+                objects.append(None)
+            pos = nxt
+        if pos >= end:
+            break
+        pos += 1
     return objects
 
 
 def dumpJSONObject(obj):
-    return json.dumps(obj, separators=(',', ':'), cls=TCFJSONEncoder)
+    res = _codec.dumps(obj)
+    if not isinstance(res, compat.strings):
+        res = res.decode('UTF-8')
+    return res
 
 
 def toByteArray(data):
@@ -220,3 +554,21 @@ class TCFJSONEncoder(json.JSONEncoder):
             return tuple(o)
         else:
             json.JSONEncoder.default(self, o)
+
+
+def _toJSONValue(o):
+    """Convert an object the codec can't encode to a JSON value, as
+    TCFJSONEncoder does."""
+    if isinstance(o, bytearray):
+        return binascii.b2a_base64(o)[:-1].decode('ascii')
+    elif isinstance(o, bytes):
+        return o.decode('utf-8')
+    elif hasattr(o, '__json__'):
+        return o.__json__()
+    elif hasattr(o, '__iter__'):
+        return tuple(o)
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    type(o).__name__)
+
+
+setCodec()
@@ -22,10 +22,13 @@ It also provides utility methods for posting asynchronous events,
 including delayed events (timers).
 """
 
+import binascii
+import heapq
+import itertools
+import os
 import sys
 import threading
 import time
-import uuid
 
 from . import EventQueue
 
@@ -39,9 +42,7 @@ def startEventQueue():
         return
     _event_queue = EventQueue.EventQueue(on_shutdown=shutdownDiscovery)
     _event_queue.start()
-    # initialize LocatorService
-    from .services.local.LocatorService import LocatorService
-    _event_queue.invokeLater(LocatorService)
+    # LocatorService is created on first use, see getLocator()
     # start timer dispatcher
     _timer_dispatcher = threading.Thread(target=_dispatch_timers)
     _timer_dispatcher.setName("TCF Timer Dispatcher")
@@ -114,15 +115,19 @@ def invokeLaterWithDelay(delay, c, *args, **kwargs):
                      If delay <= 0 the event is posted into the
                      "ready" queue without delay.
     @param c - the callable to be executed asynchronously.
+    @return Timer object, which can be used to cancel the event.
     """
     if delay <= 0:
-        _event_queue.invokeLater(c, *args, **kwargs)
+        t = Timer(0, c, *args, **kwargs)
+        _event_queue.invokeLater(t)
     else:
+        t = Timer(time.time() + delay / 1000., c, *args, **kwargs)
         with _timer_queue_lock:
-            _timer_queue.append(Timer(time.time() + delay / 1000., c, *args,
-                                      **kwargs))
-            _timer_queue.sort()
-            _timer_queue_lock.notify()
+            t.queued = True
+            heapq.heappush(_timer_queue, (t.time, t.id, t))
+            if _timer_queue[0][2] is t:
+                _timer_queue_lock.notify()
+    return t
 
 
 def invokeAndWait(c, *args, **kwargs):
@@ -155,10 +160,19 @@ def invokeAndWait(c, *args, **kwargs):
             runLock.wait()
             return doRun.result
 
-_agentID = str(uuid.uuid4())
+_agentID = None
 
 
 def getAgentID():
+    global _agentID
+    if _agentID is None:
+        # random (version 4) UUID, without the cost of importing uuid module
+        b = bytearray(os.urandom(16))
+        b[6] = b[6] & 0x0f | 0x40
+        b[8] = b[8] & 0x3f | 0x80
+        h = binascii.hexlify(b).decode("ascii")
+        _agentID = "%s-%s-%s-%s-%s" % (h[:8], h[8:12], h[12:16], h[16:20],
+                                       h[20:])
     return _agentID
 
 _logger = None
@@ -203,9 +217,8 @@ def log(msg, x=None):
 
 def startDiscovery():
     "Start discovery of remote peers if not running yet"
-    # initialize LocatorService
     from .services.local.LocatorService import LocatorService
-    if LocatorService.locator:
+    if getLocator():
         invokeAndWait(LocatorService.startup)
 
 
@@ -220,12 +233,27 @@ def getLocator():
     """
     Get instance of the framework locator service.
     The service can be used to discover available remote peers.
-    @return instance of LocatorService.
+    The service is created on first call, discovery of remote peers is
+    started by startDiscovery().
+    @return instance of LocatorService, None if the event queue is not
+            started.
     """
     from .services.local.LocatorService import LocatorService
+    if LocatorService.locator is None and _event_queue and \
+            not _event_queue.isShutdown():
+        if isDispatchThread():
+            _createLocator()
+        else:
+            invokeAndWait(_createLocator)
     return LocatorService.locator
 
 
+def _createLocator():
+    from .services.local.LocatorService import LocatorService
+    if LocatorService.locator is None:
+        LocatorService()
+
+
 def getOpenChannels():
     """
     Return an array of all open channels.
@@ -410,40 +438,66 @@ def removeTransportProvider(provider):
 
 
 class Timer(object):
-    timer_cnt = 0
+    """
+    Handle of an event posted by invokeLaterWithDelay().
+    """
+    __slots__ = ('id', 'time', 'run', 'args', 'kwargs', 'queued', 'canceled',
+                 'done')
+    _ids = itertools.count()
 
     def __init__(self, time, run, *args, **kwargs):
-        self.id = Timer.timer_cnt
-        Timer.timer_cnt += 1
+        self.id = next(Timer._ids)
         self.time = time
         self.run = run
         self.args = args
         self.kwargs = kwargs
+        self.queued = False
+        self.canceled = False
+        self.done = False
 
     def __lt__(self, x):
-        return self.__cmp__(x) == -1
-
-    def __cmp__(self, x):
-        if x is self:
-            return 0
-        if self.time < x.time:
-            return -1
-        if self.time > x.time:
-            return +1
-        if self.id < x.id:
-            return -1
-        if self.id > x.id:
-            return +1
-        assert False
-        return 0
+        return (self.time, self.id) < (x.time, x.id)
+
+    def __call__(self):
+        if self.canceled:
+            return
+        self.done = True
+        self.run(*self.args, **self.kwargs)
+
+    def cancel(self):
+        """
+        Cancel the event.
+        Canceled timers are removed from the timer queue lazily.
+        @return False if the event is already dispatched or canceled.
+        """
+        global _timer_canceled_cnt
+        with _timer_queue_lock:
+            if self.done or self.canceled:
+                return False
+            self.canceled = True
+            if self.queued:
+                _timer_canceled_cnt += 1
+                if _timer_canceled_cnt > 1024 and \
+                   _timer_canceled_cnt * 2 > len(_timer_queue):
+                    _purge_timers()
+        return True
 
 _timer_queue_lock = threading.Condition()
+# heap of (time, id, Timer) tuples
 _timer_queue = []
 _timer_queue_alive = False
+_timer_canceled_cnt = 0
+
+
+def _purge_timers():
+    global _timer_canceled_cnt
+    _timer_queue[:] = [e for e in _timer_queue if not e[2].canceled]
+    heapq.heapify(_timer_queue)
+    _timer_canceled_cnt = 0
 
 
 def _dispatch_timers():
-    global _timer_queue_alive
+    global _timer_queue_alive, _timer_canceled_cnt
 
     _timer_queue_alive = True
 
@@ -454,12 +508,17 @@ def _dispatch_timers():
                     _timer_queue_lock.wait()
                 else:
                     tm = time.time()
-                    t = _timer_queue[0]
-                    if t.time > tm:
+                    t = _timer_queue[0][2]
+                    if t.canceled:
+                        heapq.heappop(_timer_queue)
+                        t.queued = False
+                        _timer_canceled_cnt -= 1
+                    elif t.time > tm:
                         _timer_queue_lock.wait(t.time - tm)
                     else:
-                        _timer_queue.pop(0)
-                        invokeLater(t.run, *t.args, **t.kwargs)
+                        heapq.heappop(_timer_queue)
+                        t.queued = False
+                        invokeLater(t)
     except RuntimeError:
         # Event queue is shut down, exit this thread
         pass
@@ -9,7 +9,6 @@
 # *     Wind River Systems - initial API and implementation
 # *****************************************************************************
 
-import collections
 import threading
 from .. import protocol
 
@@ -41,9 +40,8 @@ def removeServiceProvider(provider):
 
 def onChannelCreated(channel, services_by_name):
     with _lock:
-        # TODO ZeroCopy support is incomplete
-        # zero_copy = ZeroCopy()
-        # services_by_name[zero_copy.getName()] = zero_copy
+        zero_copy = ZeroCopy()
+        services_by_name[zero_copy.getName()] = zero_copy
         for provider in _providers:
             try:
                 arr = provider.getLocalService(channel)
@@ -109,14 +107,14 @@ class Service(object):
     def _makeCallback(self, done):
         """Turn *done* into a callable.
 
-        If *done* is already a :class:`collections.Callable`, it is returned
-        as is, else, it is made callable, and returned.
+        If *done* is callable, it is wrapped into a :class:`GenericCallback`,
+        else it is returned as is.
 
         :param done: The item to make callable.
 
         :returns: The callable value of *done*
         """
-        if isinstance(done, collections.Callable):
+        if callable(done):
             return GenericCallback(done)
         return done
 
@@ -837,7 +837,9 @@ class FileSystemService(services.Service):
                        file from where to start writing. If offset is negative
                        then writing starts from current position in the file.
         :type offset: |int|
-        :param data: Byte array that contains data for writing.
+        :param data: Byte array that contains data for writing, or a
+                     *channel.PreparedBinary* shared by several writes, then
+                     all of it is written.
         :type data: |bytearray|
         :param data_pos: Offset in *data* of first byte to write.
         :type data_pos: |int|
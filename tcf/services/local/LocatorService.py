@@ -517,7 +517,9 @@ class LocatorService(locator.LocatorService):
                               struct.pack('iL', nBytes,
                                           names.buffer_info()[0])))[0]
 
-        namestr = names.tostring()
+        # array.tostring() was removed in Python 3.9
+        namestr = names.tobytes() if hasattr(names, 'tobytes') \
+            else names.tostring()
         if namestr and isinstance(namestr[0], int):
             namestr = ''.join(chr(b) for b in namestr)
         res = []
@@ -26,14 +26,18 @@ class BPCommand(Command):
         self.__cb.doneCommand(self.token, error)
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = (("status", "breakpointStatusChanged"), "contextAdded",
+              "contextChanged", "contextRemoved")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, breakpoints.BreakpointsListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "status":
                 assert len(args) == 2
                 self.listener.breakpointStatusChanged(args[0], args[1])
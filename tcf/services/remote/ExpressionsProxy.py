@@ -147,14 +147,17 @@ class ExpressionsProxy(expressions.ExpressionsService):
             self.channel.removeEventListener(self, l)
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("valueChanged",)
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, expressions.ExpressionsListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "valueChanged":
                 assert len(args) == 1
                 self.listener.valueChanged(args[0])
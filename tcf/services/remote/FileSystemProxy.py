@@ -456,7 +456,11 @@ class FileSystemProxy(filesystem.FileSystemService):
         assert handle.getService() is self
         done = self._makeCallback(done)
         _id = handle.id
-        binary = bytearray(data[data_pos:data_pos + data_size])
+        if isinstance(data, channel.PreparedBinary):
+            # already encoded data, shared by several writes
+            binary = data
+        else:
+            binary = bytearray(data[data_pos:data_pos + data_size])
         service = self
 
         class WriteCommand(FileSystemCommand):
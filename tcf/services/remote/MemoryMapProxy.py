@@ -68,14 +68,17 @@ class MemoryMapProxy(memorymap.MemoryMapService):
             self.channel.removeEventListener(self, l)
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("changed",)
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, memorymap.MemoryMapListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "changed":
                 assert len(args) == 1
                 self.listener.changed(args[0])
@@ -248,14 +248,18 @@ class MemoryCommand(Command):
         return e
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("contextAdded", "contextChanged", "contextRemoved",
+              "memoryChanged")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, memory.MemoryListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "contextAdded":
                 assert len(args) == 1
                 self.listener.contextAdded(_toContextArray(self.service,
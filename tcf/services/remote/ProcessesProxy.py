@@ -225,14 +225,17 @@ class ProcessesProxy(processes.ProcessesService):
             self.channel.removeEventListener(self, l)
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("exited",)
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, processes.ProcessesListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "exited":
                 assert len(args) == 2
                 self.listener.exited(args[0], args[1])
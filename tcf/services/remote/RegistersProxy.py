@@ -190,14 +190,17 @@ def _toValuesArray(o):
     return arr
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("contextChanged", "registerChanged")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, registers.RegistersListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "contextChanged":
                 self.listener.contextChanged()
             elif name == "registerChanged":
@@ -98,14 +98,19 @@ class RunContext(runcontrol.RunControlContext):
         return RCCommand(cmd, args).token
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("contextSuspended", "contextResumed", "contextAdded",
+              "contextChanged", "contextRemoved", "contextException",
+              "containerSuspended", "containerResumed", "contextStateChanged")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, runcontrol.RunControlListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "contextSuspended":
                 assert len(args) == 4
                 self.listener.contextSuspended(args[0], args[1], args[2],
@@ -136,7 +136,7 @@ class StreamsProxy(streams.StreamsService):
     def write(self, stream_id, buf, offset, size, done):
         done = self._makeCallback(done)
         service = self
-        binary = buf[offset:offset + size]
+        binary = bytearray(buf[offset:offset + size])
 
         class WriteCommand(Command):
             def __init__(self):
@@ -152,14 +152,17 @@ class StreamsProxy(streams.StreamsService):
         return WriteCommand().token
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("created", "disposed")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, streams.StreamsListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "created":
                 if len(args) == 3:
                     self.listener.created(args[0], args[1], args[2])
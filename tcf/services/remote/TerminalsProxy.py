@@ -127,14 +127,17 @@ class TerminalsProxy(terminals.TerminalsService):
             self.channel.removeEventListener(self, l)
 
 
-class ChannelEventListener(channel.EventListener):
+class ChannelEventListener(channel.DecodedEventListener):
+    events = ("exited", "winSizeChanged")
+
     def __init__(self, service, listener):
         self.service = service
         self.listener = listener
+        self.event_names = channel.getEventNames(
+            listener, terminals.TerminalsListener, self.events)
 
-    def event(self, name, data):
+    def eventArgs(self, name, args):
         try:
-            args = channel.fromJSONSequence(data)
             if name == "exited":
                 assert len(args) == 2
                 self.listener.exited(args[0], args[1])
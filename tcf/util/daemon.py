@@ -0,0 +1,476 @@
+"""
+Local daemon that keeps TCF channels open for short-lived command line tools.
+
+Opening a channel takes a TCP connect and a Hello exchange, which is much
+longer than a single file operation. The daemon holds one channel per
+target and serves download, upload and directory listing requests from
+local clients over a UNIX domain socket, so a client only pays for one local
+round-trip. Use getDaemonClient() to get a Client if the daemon is running,
+and a DirectClient over a new channel otherwise; both have the same
+interface.
+
+The local protocol is a sequence of frames, each a 4 byte big-endian length
+followed by the payload. A request is a JSON object frame, followed by data
+frames and an empty frame for uploads. The daemon replies with data frames
+(file contents, or JSON directory entries), an empty frame and a JSON status
+frame with "Error" and "Result" strings. The empty frame is always sent, so
+a client can tell an error status from data.
+"""
+
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # @UnresolvedImport
+
+from .. import connect, protocol
+from .. import channel as tcfchannel
+from ..services import filesystem
+from . import fscache, transfer, walker
+
+_frame_header = struct.Struct(">I")
+_end = object()
+
+# max number of downloaded chunks waiting to be sent to a client
+QUEUE_SIZE = 64
+
+
+def getSocketPath():
+    """Get daemon socket path, TCF_DAEMON_SOCKET environment variable or a
+    per-user file in the temporary directory."""
+    path = os.environ.get("TCF_DAEMON_SOCKET")
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(),
+                        "tcf-tools-%d.sock" % os.getuid())
+
+
+def _recvExact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n <= 0:
+            raise IOError("Connection closed")
+        pos += n
+    return buf
+
+
+def sendFrame(sock, data=b""):
+    sock.sendall(_frame_header.pack(len(data)) + bytes(data))
+
+
+def recvFrame(sock):
+    size = _frame_header.unpack(bytes(_recvExact(sock, 4)))[0]
+    return _recvExact(sock, size) if size else bytearray()
+
+
+def sendJSON(sock, obj):
+    sendFrame(sock, json.dumps(obj, separators=(',', ':')).encode("UTF-8"))
+
+
+def recvJSON(sock):
+    return json.loads(recvFrame(sock).decode("UTF-8"))
+
+
+def recvData(sock):
+    """Iterate over data frames until an empty frame."""
+    while True:
+        data = recvFrame(sock)
+        if not data:
+            break
+        yield data
+
+
+def _attrsToList(attrs):
+    if attrs is None:
+        return None
+    return [attrs.flags, attrs.size, attrs.uid, attrs.gid, attrs.permissions,
+            attrs.atime, attrs.mtime, attrs.attributes]
+
+
+def _listToAttrs(a):
+    if a is None:
+        return None
+    return filesystem.FileAttrs(*a)
+
+
+class Result(object):
+    """Result of a request served by the daemon."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class Client(object):
+    """Client of a running daemon. Every request uses its own connection."""
+
+    def __init__(self, target, path=None):
+        self.target = target
+        self.path = path or getSocketPath()
+
+    def _connect(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            request["Target"] = self.target
+            sendJSON(sock, request)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _status(self, sock):
+        status = recvJSON(sock)
+        if status.get("Error"):
+            raise IOError(status["Error"])
+        return Result(status.get("Result", ""))
+
+    def isRunning(self):
+        """Check that the daemon accepts connections."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def download(self, path, out):
+        sock = self._connect({"Op": "download", "Path": path})
+        try:
+            for data in recvData(sock):
+                out.write(data)
+            return self._status(sock)
+        finally:
+            sock.close()
+
+    def upload(self, path, inp, attrs=None, delta=False):
+        sock = self._connect({"Op": "upload", "Path": path, "Delta": delta,
+                              "Attrs": _attrsToList(attrs)})
+        try:
+            while True:
+                data = inp.read(transfer.CHUNK_SIZE)
+                if not data:
+                    break
+                sendFrame(sock, data)
+            sendFrame(sock)
+            for data in recvData(sock):
+                pass
+            return self._status(sock)
+        finally:
+            sock.close()
+
+    def walk(self, path, recursive=True, onerror=None):
+        sock = self._connect({"Op": "walk", "Path": path,
+                              "Recursive": recursive})
+        try:
+            for data in recvData(sock):
+                item = json.loads(data.decode("UTF-8"))
+                dirpath = item["Dir"]
+                if "Error" in item:
+                    if onerror is not None:
+                        onerror(dirpath, item["Error"])
+                    continue
+                for name, attrs in item["Entries"]:
+                    yield dirpath, filesystem.DirEntry(name, None,
+                                                       _listToAttrs(attrs))
+            self._status(sock)
+        finally:
+            sock.close()
+
+
+class DirectClient(object):
+    """Client interface over an open channel, used when the daemon is not
+    running."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def download(self, path, out):
+        return transfer.download(self.channel, path, out)
+
+    def upload(self, path, inp, attrs=None, delta=False):
+        if delta:
+            return transfer.deltaUpload(self.channel, path, inp, attrs=attrs)
+        return transfer.upload(self.channel, path, inp, attrs=attrs)
+
+    def walk(self, path, recursive=True, onerror=None):
+        return walker.walk(self.channel, path, recursive=recursive,
+                           onerror=onerror)
+
+
+def getDaemonClient(target, path=None):
+    """
+    Get a client of the running daemon.
+    @return Client, or None if the daemon is not running.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    client = Client(target, path)
+    if not client.isRunning():
+        return None
+    return client
+
+
+def _errorText(x):
+    if isinstance(x, Exception) and len(x.args) == 2 and \
+            x.args[0] == "TCF task aborted":
+        x = x.args[1]
+    return str(x)
+
+
+class _QueueWriter(object):
+    """File object that passes written data to the connection thread, so
+    the dispatch thread never blocks on a slow client."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def write(self, data):
+        self.items.put(bytes(data))
+
+
+class _QueueDownload(transfer.Download):
+    """Download into a queue read by the connection thread. No reads are
+    issued while queue_size chunks are queued, in flight or out of order;
+    the connection thread resumes the download when it takes data from the
+    queue, so a slow client does not make the daemon buffer the file."""
+
+    def __init__(self, channel, path, items, queue_size=QUEUE_SIZE):
+        super(_QueueDownload, self).__init__(channel, path,
+                                             _QueueWriter(items))
+        self.items = items
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.paused = False
+
+    def _readMore(self):
+        while self.error is None and self.eof_pos is None and \
+                self.in_flight < self.window:
+            with self.lock:
+                if self.items.qsize() + self.in_flight + len(self.chunks) >= \
+                        self.queue_size:
+                    self.paused = True
+                    return
+            self._read(self.read_pos, self.chunk_size)
+            self.read_pos += self.chunk_size
+        if self.in_flight == 0:
+            self._close()
+
+    def taken(self):
+        """Called by the connection thread after it takes data from the
+        queue."""
+        with self.lock:
+            if not self.paused:
+                return
+            self.paused = False
+        protocol.invokeLater(self._readMore)
+
+    def cancel(self, error):
+        """Stop the download, called by the connection thread when the
+        client is gone."""
+        def stop():
+            if self.error is None:
+                self.error = error
+            if self.paused:
+                self.paused = False
+                self._readMore()
+        protocol.invokeLater(stop)
+
+
+class _PendingChannel(object):
+    """Channel being opened by one client thread, other threads that need
+    the same target wait for it."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.channel = None
+        self.error = None
+
+
+class Server(object):
+    """The daemon. Holds a channel per target and serves every client
+    connection with its own thread.
+
+    @param cache_ttl - if not None, FileSystem metadata of the channels is
+                       cached for that many seconds, see fscache.
+    """
+
+    def __init__(self, path=None, cache_ttl=None):
+        self.path = path or getSocketPath()
+        self.cache_ttl = cache_ttl
+        self.channels = {}
+        self.opening = {}
+        self.lock = threading.Lock()
+        self.sock = None
+
+    def getChannel(self, target):
+        """Get open channel to target, reconnect if the channel is closed.
+        The lock is not held while a channel is opened, so an unreachable
+        target only delays the requests for that target."""
+        with self.lock:
+            c = self.channels.get(target)
+            if c is not None and c.getState() != tcfchannel.STATE_CLOSED:
+                return c
+            pending = self.opening.get(target)
+            opener = pending is None
+            if opener:
+                pending = self.opening[target] = _PendingChannel()
+        if not opener:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.channel
+        try:
+            c = connect(target)
+            if self.cache_ttl is not None:
+                protocol.invokeAndWait(fscache.enable, c, ttl=self.cache_ttl)
+            pending.channel = c
+        except Exception as x:
+            pending.error = x
+            raise
+        finally:
+            with self.lock:
+                del self.opening[target]
+                if pending.channel is not None:
+                    self.channels[target] = pending.channel
+            pending.event.set()
+        return c
+
+    def bind(self):
+        if os.path.exists(self.path):
+            if Client(None, self.path).isRunning():
+                raise IOError("Daemon is already running: " + self.path)
+            # stale socket of a daemon that was killed
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(16)
+
+    def serve(self):
+        """Accept client connections until close() is called."""
+        if self.sock is None:
+            self.bind()
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                break
+            t = threading.Thread(target=self._serveClient, args=(conn,),
+                                 name="TCF Daemon Client")
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        sock = self.sock
+        if sock is not None:
+            self.sock = None
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        for c in list(self.channels.values()):
+            protocol.invokeLater(c.close)
+
+    def _serveClient(self, conn):
+        try:
+            try:
+                request = recvJSON(conn)
+            except IOError:
+                # connection check of isRunning()
+                return
+            op = request.get("Op")
+            try:
+                handler = self.handlers.get(op)
+                if handler is None:
+                    raise IOError("Unknown request: %s" % op)
+                result = handler(self, conn, request)
+                error = None
+            except Exception as x:
+                result = None
+                error = _errorText(x)
+            sendFrame(conn)
+            sendJSON(conn, {"Error": error,
+                            "Result": "" if result is None else str(result)})
+        except (IOError, socket.error, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _download(self, conn, request):
+        c = self.getChannel(request["Target"])
+        items = queue.Queue()
+        d = _QueueDownload(c, request["Path"], items)
+
+        def done(error, download):
+            items.put(_end)
+        protocol.invokeLater(d.start, done)
+        while True:
+            data = items.get()
+            if data is _end:
+                break
+            d.taken()
+            try:
+                sendFrame(conn, data)
+            except Exception as x:
+                d.cancel(x)
+                raise
+        if d.error is not None:
+            raise d.error
+        return d
+
+    def _upload(self, conn, request):
+        with tempfile.SpooledTemporaryFile(max_size=0x1000000) as inp:
+            for data in recvData(conn):
+                inp.write(data)
+            inp.seek(0)
+            c = self.getChannel(request["Target"])
+            attrs = _listToAttrs(request.get("Attrs"))
+            if request.get("Delta"):
+                return transfer.deltaUpload(c, request["Path"], inp,
+                                            attrs=attrs)
+            return transfer.upload(c, request["Path"], inp, attrs=attrs)
+
+    def _walk(self, conn, request):
+        c = self.getChannel(request["Target"])
+
+        def onerror(dirpath, error):
+            sendJSON(conn, {"Dir": dirpath, "Error": str(error)})
+        batch = []
+        batch_dir = None
+        for dirpath, e in walker.walk(c, request["Path"],
+                                      recursive=request.get("Recursive"),
+                                      onerror=onerror):
+            if dirpath != batch_dir or len(batch) >= 256:
+                if batch:
+                    sendJSON(conn, {"Dir": batch_dir, "Entries": batch})
+                batch = []
+                batch_dir = dirpath
+            batch.append([e.filename, _attrsToList(e.attrs)])
+        if batch:
+            sendJSON(conn, {"Dir": batch_dir, "Entries": batch})
+
+    handlers = {
+        "download": _download,
+        "upload": _upload,
+        "walk": _walk,
+    }
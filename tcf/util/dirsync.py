@@ -0,0 +1,286 @@
+"""
+One-way synchronization of a local directory tree to a remote one.
+
+Local files are compared with remote file attributes (size and
+modification time), only changed or missing files are uploaded. Uploaded
+files get the local modification time, so unchanged files are skipped on
+the next run. Missing directories are created level by level, with all
+directories of a level created in parallel. Optionally, remote files and
+directories that don't exist locally are removed.
+"""
+
+import os
+import time
+
+from .. import protocol
+from ..services import filesystem
+from . import task, transfer, walker
+
+FILES_WINDOW = 4
+WINDOW = 16
+
+
+class Batch(object):
+    """Run asynchronous operations on the dispatch thread, with at most
+    window operations in flight.
+
+    Each operation is a tuple (path, op), op is called as op(done) and must
+    eventually call done(error).
+    """
+
+    def __init__(self, ops, window=WINDOW):
+        self.ops = iter(ops)
+        self.window = window
+        self.in_flight = 0
+        self.errors = []
+        self.finished = False
+        self._callback = None
+
+    def start(self, done=None):
+        assert protocol.isDispatchThread()
+        self._callback = done
+        self._runMore()
+
+    def _runMore(self):
+        while not self.finished and self.in_flight < self.window:
+            try:
+                path, op = next(self.ops)
+            except StopIteration:
+                break
+            self._run(path, op)
+        if self.in_flight == 0 and not self.finished:
+            self.finished = True
+            if self._callback:
+                self._callback(None, self.errors)
+
+    def _run(self, path, op):
+        batch = self
+
+        def done(error):
+            batch.in_flight -= 1
+            if error:
+                batch.errors.append((path, error))
+            batch._runMore()
+        self.in_flight += 1
+        try:
+            op(done)
+        except Exception as x:
+            done(x)
+
+
+def runBatch(ops, window=WINDOW):
+    """
+    Run operations with Batch and wait for completion. Must not be called on
+    the dispatch thread.
+    @return list of (path, error) tuples of failed operations.
+    """
+    if not ops:
+        return []
+    return task.Task(Batch(ops, window).start).get()
+
+
+def isSameFile(local_attrs, remote_attrs):
+    """Compare size and modification time, with one second resolution."""
+    if remote_attrs is None or not remote_attrs.isFile():
+        return False
+    if not remote_attrs.flags & filesystem.ATTR_ACMODTIME:
+        return False
+    return local_attrs.size == remote_attrs.size and \
+        local_attrs.mtime // 1000 == remote_attrs.mtime // 1000
+
+
+class DirSync(object):
+    """Synchronize a local directory to a remote directory.
+
+    Statistics of the last run() are kept in the object fields.
+    """
+
+    def __init__(self, channel, local_path, remote_path, delete=False,
+                 files_window=FILES_WINDOW, window=WINDOW):
+        self.channel = channel
+        self.local_path = local_path
+        self.remote_path = remote_path.rstrip('/') or '/'
+        self.delete = delete
+        self.files_window = files_window
+        self.window = window
+        self.uploaded = 0
+        self.skipped = 0
+        self.size = 0
+        self.dirs_created = 0
+        self.removed = 0
+        self.errors = []
+        self.time = 0
+
+    def _remotePath(self, rel):
+        if not rel:
+            return self.remote_path
+        return walker.joinPath(self.remote_path, rel)
+
+    def _stat(self, path, done):
+        class DoneStat(filesystem.DoneStat):
+            def doneStat(self, token, error, attrs):
+                done(error, attrs)
+        transfer.getFileSystem(self.channel).stat(path, DoneStat())
+
+    def _listLocal(self):
+        files = {}
+        dirs = set()
+        for dirpath, dirnames, filenames in os.walk(self.local_path):
+            rel = os.path.relpath(dirpath, self.local_path)
+            rel = '' if rel == '.' else rel.replace(os.sep, '/')
+            for name in dirnames:
+                dirs.add(rel + '/' + name if rel else name)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if not os.path.isfile(path):
+                    continue
+                files[rel + '/' + name if rel else name] = \
+                    transfer.getLocalFileAttrs(path)
+        return files, dirs
+
+    def _listRemote(self):
+        """@return dict of remote paths relative to remote_path and their
+        attributes, or None if remote_path does not exist."""
+        try:
+            attrs = task.Task(self._stat, self.remote_path).get()
+        except Exception as x:
+            error = x.args[-1]
+            if isinstance(error, filesystem.FileSystemException) and \
+                    error.getStatus() == filesystem.STATUS_NO_SUCH_FILE:
+                return None
+            raise error
+        if not attrs.isDirectory():
+            raise IOError("Not a directory: " + self.remote_path)
+        remote = {}
+        prefix = len(self.remote_path.rstrip('/')) + 1
+        for dirpath, entry in walker.walk(self.channel, self.remote_path,
+                                          self.window,
+                                          onerror=self._onWalkError):
+            path = walker.joinPath(dirpath, entry.filename)
+            remote[path[prefix:]] = entry.attrs
+        return remote
+
+    def _onWalkError(self, path, error):
+        self.errors.append((path, error))
+
+    def _mkdir(self, path):
+        sync = self
+
+        def op(done):
+            class DoneMkDir(filesystem.DoneMkDir):
+                def doneMkDir(self, token, error):
+                    if not error:
+                        sync.dirs_created += 1
+                    done(error)
+            transfer.getFileSystem(sync.channel).mkdir(path, None,
+                                                       DoneMkDir())
+        return path, op
+
+    def _remove(self, path, is_dir):
+        sync = self
+
+        def op(done):
+            class DoneRemove(filesystem.DoneRemove):
+                def doneRemove(self, token, error):
+                    if not error:
+                        sync.removed += 1
+                    done(error)
+            fs = transfer.getFileSystem(sync.channel)
+            if is_dir:
+                fs.rmdir(path, DoneRemove())
+            else:
+                fs.remove(path, DoneRemove())
+        return path, op
+
+    def _upload(self, rel, attrs, window):
+        sync = self
+        path = self._remotePath(rel)
+        local_path = os.path.join(self.local_path, *rel.split('/'))
+
+        def op(done):
+            inp = open(local_path, 'rb')
+
+            def doneUpload(error, upload):
+                inp.close()
+                sync.size += upload.size
+                if not error:
+                    sync.uploaded += 1
+                done(error)
+            transfer.Upload(sync.channel, path, inp, window=window,
+                            attrs=attrs).start(doneUpload)
+        return path, op
+
+    def _runByDepth(self, paths, make_op, reverse=False):
+        levels = {}
+        for p in paths:
+            levels.setdefault(p.count('/'), []).append(p)
+        for depth in sorted(levels, reverse=reverse):
+            self.errors += runBatch([make_op(p) for p in sorted(levels[depth])],
+                                    self.window)
+
+    def run(self):
+        """
+        Synchronize the directories. Must not be called on the dispatch
+        thread.
+        @return self, errors of individual files are collected in errors.
+        """
+        time0 = time.time()
+        local_files, local_dirs = self._listLocal()
+        remote = self._listRemote()
+        if remote is None:
+            self.errors += runBatch([self._mkdir(self.remote_path)])
+            if self.errors:
+                raise self.errors[0][1]
+            remote = {}
+
+        def isRemoteDir(rel):
+            attrs = remote.get(rel)
+            return attrs is not None and attrs.isDirectory()
+
+        if self.delete:
+            # remove remote entries that don't exist locally or have a
+            # different type, files first, then directories bottom up
+            stale_files = [p for p, a in remote.items()
+                           if not a.isDirectory() and p not in local_files]
+            stale_dirs = [p for p, a in remote.items()
+                          if a.isDirectory() and p not in local_dirs]
+            self.errors += runBatch([self._remove(self._remotePath(p), False)
+                                     for p in stale_files], self.window)
+            self._runByDepth(stale_dirs,
+                             lambda p: self._remove(self._remotePath(p), True),
+                             reverse=True)
+            for p in stale_files + stale_dirs:
+                del remote[p]
+
+        self._runByDepth([p for p in local_dirs if not isRemoteDir(p)],
+                         lambda p: self._mkdir(self._remotePath(p)))
+
+        changed = []
+        for rel in sorted(local_files):
+            attrs = local_files[rel]
+            if isSameFile(attrs, remote.get(rel)):
+                self.skipped += 1
+            else:
+                changed.append(rel)
+        files_window = max(1, min(self.files_window, len(changed)))
+        window = max(1, (self.channel.pending_command_limit - 1) //
+                     files_window)
+        self.errors += runBatch([self._upload(rel, local_files[rel], window)
+                                 for rel in changed], files_window)
+        self.time = time.time() - time0
+        return self
+
+    def __str__(self):
+        return ("%d files uploaded (%d bytes), %d skipped, "
+                "%d directories created, %d removed, %d errors in %.3f s" %
+                (self.uploaded, self.size, self.skipped, self.dirs_created,
+                 self.removed, len(self.errors), self.time))
+
+
+def sync(channel, local_path, remote_path, delete=False):
+    """
+    Synchronize a local directory to a remote directory.
+    Must not be called on the dispatch thread.
+    @return DirSync object with statistics and errors.
+    """
+    return DirSync(channel, local_path, remote_path, delete).run()
@@ -0,0 +1,317 @@
+"""
+Run one operation on many agents concurrently.
+
+A Fleet opens channels to a list of targets, at most connect_window
+channels at a time are being opened, and runs the same operation on every
+target as soon as its channel is open. Results are reported as they
+complete. Every target has its own timeout that covers opening the channel
+and then the wait for every message from the target, so a long upload does
+not time out as long as the target keeps replying. Open channels are kept,
+so further operations on the same Fleet don't connect again.
+
+An operation is a callable op(channel, done) that is called on the dispatch
+thread and must eventually call done(error, value). command() and push()
+make operations for a generic service command and a file upload.
+"""
+
+import time
+
+from .. import _parse_params, compat, peer, protocol
+from .. import channel as tcfchannel
+from ..channel import toJSONSequence
+from . import transfer
+from .sync import decodeResult
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # @UnresolvedImport
+
+CONNECT_WINDOW = 32
+TIMEOUT = 10.0
+DISCOVERY_WAIT = 2.0
+
+
+def getTargetName(target):
+    """Get target name, a "TCP:host:port" string or a peer ID."""
+    if isinstance(target, compat.strings):
+        return target
+    return target.getID()
+
+
+def discover(wait=DISCOVERY_WAIT):
+    """
+    Get peers discovered by the Locator service.
+    @param wait - seconds to wait for peers to respond.
+    @return list of peers.
+    """
+    from .. import peers
+    peers()
+    time.sleep(wait)
+    return list((peers() or {}).values())
+
+
+def command(service, name, *args):
+    """
+    Make an operation that sends a command. The value of the result is the
+    command result arguments, a single argument is unwrapped, an error
+    report of the remote peer is an error of the result.
+    """
+    def op(channel, done):
+        if channel.getRemoteService(service) is None:
+            raise IOError("Remote peer has no %s service" % service)
+
+        class CommandListener(tcfchannel.CommandListener):
+            def result(self, token, data):
+                try:
+                    error, res = decodeResult(service, name, args, data)
+                except Exception as x:
+                    error, res = x, None
+                done(error, res)
+
+            def terminated(self, token, error):
+                done(error, None)
+        channel.sendCommand(service, name, toJSONSequence(args),
+                            CommandListener())
+    return op
+
+
+class _FileRange(object):
+    """Reader of a seekable file object from an offset, so that several
+    uploads can read the same file object."""
+
+    def __init__(self, inp, offset):
+        self.inp = inp
+        self.offset = offset
+
+    def read(self, size=-1):
+        self.inp.seek(self.offset)
+        data = self.inp.read(size)
+        self.offset += len(data)
+        return data
+
+
+def push(inp, path, attrs=None, chunk_size=transfer.CHUNK_SIZE):
+    """
+    Make an operation that uploads a local file into a remote file.
+    @param inp - binary file object to read the file contents from.
+    @param attrs - optional FileAttrs to set after the data is written.
+    Targets share a transfer.MultiUpload: every chunk is read and encoded
+    once for all the targets that upload at the same time, and each target
+    runs its own pipelined upload, so slow targets don't stall fast ones.
+    Targets that connect after the first chunk was dropped start a new
+    MultiUpload that reads the file again, which needs a seekable inp. The
+    value of the result is the upload object of the target.
+    """
+    seekable = getattr(inp, "seekable", lambda: False)()
+    start = inp.tell() if seekable else 0
+    multi = [None]
+
+    def op(channel, done):
+        m = multi[0]
+        if m is None or not m.canAdd():
+            if m is not None and not seekable:
+                raise IOError("Input is not seekable, cannot read it again")
+            reader = _FileRange(inp, start) if seekable else inp
+            m = multi[0] = transfer.MultiUpload([], path, reader, chunk_size,
+                                                attrs=attrs)
+        m.add(channel, done)
+    return op
+
+
+class Result(object):
+    """Result of an operation on one target. Times are in seconds, time is
+    the total latency including connect_time."""
+
+    def __init__(self, target):
+        self.target = target
+        self.error = None
+        self.value = None
+        self.connect_time = 0
+        self.time = 0
+
+    def __str__(self):
+        if self.error:
+            return "%s: %s" % (self.target, self.error)
+        return "%s: %s" % (self.target, self.value)
+
+
+class Summary(object):
+    """Aggregate latency statistics of results, in seconds."""
+
+    def __init__(self, results):
+        times = sorted(r.time for r in results if not r.error)
+        self.count = len(results)
+        self.failed = self.count - len(times)
+        self.min = self.median = self.p90 = self.max = 0
+        if times:
+            self.min = times[0]
+            self.median = times[len(times) // 2]
+            self.p90 = times[min(len(times) - 1, len(times) * 9 // 10)]
+            self.max = times[-1]
+
+    def __str__(self):
+        return "%d targets, %d failed, latency ms min %.1f median %.1f " \
+            "p90 %.1f max %.1f" % (
+                self.count, self.failed, self.min * 1000,
+                self.median * 1000, self.p90 * 1000, self.max * 1000)
+
+
+class _TargetRun(object):
+    """State of an operation on one target, on the dispatch thread."""
+
+    def __init__(self, fleet, target, op, report):
+        self.fleet = fleet
+        self.target = target
+        self.op = op
+        self.report = report
+        self.result = Result(getTargetName(target))
+        self.channel = None
+        self.connecting = False
+        self.finished = False
+        self.timer = None
+        self.trace = None
+        self.time0 = None
+        # time of the last message from the target
+        self.time_active = None
+
+    def start(self):
+        # latency is counted from here, not from when the run was queued
+        self.time0 = self.time_active = time.time()
+        fleet = self.fleet
+        self.timer = protocol.invokeLaterWithDelay(
+            fleet.timeout * 1000, self._timeout)
+        c = fleet.channels.get(self.result.target)
+        if c is not None and c.getState() == tcfchannel.STATE_OPEN:
+            self.channel = c
+            self._runOp()
+            return
+        target = self.target
+        if isinstance(target, compat.strings):
+            target = peer.TransientPeer(_parse_params(target))
+        try:
+            c = target.openChannel()
+        except Exception as x:
+            self._finish(x, None)
+            return
+        self.channel = c
+        self.connecting = True
+        fleet.connecting += 1
+        run = self
+
+        class ChannelListener(tcfchannel.ChannelListener):
+            def onChannelOpened(self):
+                c.removeChannelListener(self)
+                if run.finished:
+                    return
+                run._connected()
+                run.result.connect_time = time.time() - run.time0
+                fleet.channels[run.result.target] = c
+                run._runOp()
+
+            def onChannelClosed(self, error):
+                if not run.finished:
+                    run._connected()
+                    run._finish(error or IOError("Channel closed"), None)
+        c.addChannelListener(ChannelListener())
+
+    def _connected(self):
+        if self.connecting:
+            self.connecting = False
+            self.fleet.connecting -= 1
+            self.fleet._connectMore()
+
+    def _runOp(self):
+        run = self
+
+        class TraceListener(tcfchannel.TraceListener):
+            def onMessageReceived(self, t, token, service, name, data):
+                run.time_active = time.time()
+        self.time_active = time.time()
+        self.trace = TraceListener()
+        self.channel.addTraceListener(self.trace)
+        try:
+            self.op(self.channel, self._finish)
+        except Exception as x:
+            self._finish(x, None)
+
+    def _timeout(self):
+        if self.finished:
+            return
+        idle = time.time() - self.time_active
+        if idle < self.fleet.timeout:
+            self.timer = protocol.invokeLaterWithDelay(
+                (self.fleet.timeout - idle) * 1000, self._timeout)
+            return
+        error = IOError("No response in %g s" % self.fleet.timeout)
+        c = self.channel
+        self._connected()
+        self._finish(error, None)
+        if c is not None:
+            # the channel state is unknown, don't reuse it
+            if self.fleet.channels.get(self.result.target) is c:
+                del self.fleet.channels[self.result.target]
+            c.terminate(error)
+
+    def _finish(self, error, value):
+        if self.finished:
+            return
+        self.finished = True
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.trace is not None:
+            self.channel.removeTraceListener(self.trace)
+        self.result.error = error
+        self.result.value = value
+        self.result.time = time.time() - self.time0
+        self.report(self.result)
+
+
+class Fleet(object):
+    """Operations on a list of targets, "TCP:host:port" strings or peers.
+    """
+
+    def __init__(self, targets, connect_window=CONNECT_WINDOW,
+                 timeout=TIMEOUT):
+        self.targets = list(targets)
+        self.connect_window = connect_window
+        self.timeout = timeout
+        self.channels = {}
+        self.connecting = 0
+        self.waiting = []
+
+    def start(self, op, report):
+        """
+        Start an operation on all targets. Must be called on the dispatch
+        thread.
+        @param op - operation, op(channel, done).
+        @param report - callable invoked with a Result for every target.
+        """
+        assert protocol.isDispatchThread()
+        self.waiting.extend(_TargetRun(self, t, op, report)
+                            for t in self.targets)
+        self._connectMore()
+
+    def _connectMore(self):
+        while self.waiting and self.connecting < self.connect_window:
+            self.waiting.pop(0).start()
+
+    def run(self, op):
+        """
+        Run an operation on all targets. Must not be called on the dispatch
+        thread.
+        @return iterator over Result objects, in order of completion.
+        """
+        results = queue.Queue()
+        protocol.invokeLater(self.start, op, results.put)
+        for _ in range(len(self.targets)):
+            yield results.get()
+
+    def close(self):
+        """Close the open channels."""
+        def closeChannels():
+            for c in self.channels.values():
+                if c.getState() != tcfchannel.STATE_CLOSED:
+                    c.close()
+            self.channels.clear()
+        protocol.invokeAndWait(closeChannels)
@@ -0,0 +1,280 @@
+"""
+Follow growing remote files, like tail -f.
+
+A Follower keeps the remote file open and polls its size with fstat. Only
+appended bytes are read. The poll delay starts at min_delay and doubles up
+to max_delay while the file does not change, and it goes back to min_delay
+when new data arrives. The file is truncated when its size drops below the
+read offset; it is then read again from the start. The file is rotated when
+the path refers to another file: stat(path) reports a different "INode"
+attribute, or, if the agent does not report inodes, a size smaller than the
+open file. The rest of the old file is read first, then the new file is
+opened. After an error the file is reopened and read from where it
+stopped, unless it was replaced or truncated meanwhile.
+
+Followers are driven by the dispatch thread and use timers for polling, not
+threads, so one process can follow many files on many agents.
+"""
+
+from .. import protocol
+from ..services import filesystem
+from . import transfer
+
+MIN_DELAY = 100
+MAX_DELAY = 2000
+
+
+class FollowListener(object):
+    """Follower callbacks, called on the dispatch thread."""
+
+    def data(self, follower, data):
+        """Called with the bytes appended to the file, in file order."""
+        pass
+
+    def truncated(self, follower):
+        """Called when the file got truncated, it is read from the start."""
+        pass
+
+    def rotated(self, follower):
+        """Called when the path refers to a new file, it is read from the
+        start."""
+        pass
+
+    def error(self, follower, error):
+        """Called when the file can't be opened or read. The follower
+        retries after max_delay."""
+        pass
+
+
+def _getINode(attrs):
+    if attrs is None or not attrs.attributes:
+        return None
+    return attrs.attributes.get("INode")
+
+
+class Follower(object):
+    """Follow one remote file.
+
+    @param tail_bytes - number of bytes before the current end of the file
+                        to report first, None to report the whole file.
+    @param min_delay, max_delay - poll delay limits in milliseconds.
+
+    The tail_end field is the file offset where the data that was in the
+    file when following started ends: data reported before it is the
+    initial tail read, data after it was appended later. It is None if the
+    file could not be opened at start, and after truncation or rotation.
+    """
+
+    def __init__(self, channel, path, listener, tail_bytes=0,
+                 min_delay=MIN_DELAY, max_delay=MAX_DELAY,
+                 chunk_size=transfer.CHUNK_SIZE, window=4):
+        self.channel = channel
+        self.path = path
+        self.listener = listener
+        self.tail_bytes = tail_bytes
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.chunk_size = chunk_size
+        self.window = window
+        self.delay = min_delay
+        self.offset = 0
+        self.tail_end = None
+        self.handle = None
+        self.attrs = None
+        self.fs = None
+        self.timer = None
+        self.stopped = False
+
+    def start(self):
+        """Start following. Must be called on the dispatch thread."""
+        assert protocol.isDispatchThread()
+        try:
+            self.fs = transfer.getFileSystem(self.channel)
+        except Exception as x:
+            self.listener.error(self, x)
+            return
+        self._open(True)
+
+    def stop(self):
+        """Stop following and close the file."""
+        assert protocol.isDispatchThread()
+        self.stopped = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self._closeHandle()
+
+    def _closeHandle(self):
+        if self.handle is not None:
+            self.fs.close(self.handle, filesystem.DoneClose())
+            self.handle = None
+
+    def _schedule(self, delay):
+        if not self.stopped:
+            self.timer = protocol.invokeLaterWithDelay(delay, self._poll)
+
+    def _error(self, error):
+        self._closeHandle()
+        self.listener.error(self, error)
+        self._schedule(self.max_delay)
+
+    def _open(self, first):
+        follower = self
+
+        class DoneStat(filesystem.DoneStat):
+            def doneStat(self, token, error, attrs):
+                if follower.stopped:
+                    return
+                if error:
+                    follower._error(error)
+                    return
+                old = follower.attrs
+                follower.attrs = attrs
+                if first:
+                    if follower.tail_bytes is not None:
+                        follower.offset = max(0, attrs.size -
+                                              follower.tail_bytes)
+                    follower.tail_end = attrs.size
+                elif old is not None:
+                    # reopened after an error, continue where it stopped
+                    # unless the path now refers to another file
+                    follower._checkReopened(old, attrs)
+                follower._poll()
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                if follower.stopped:
+                    if handle is not None:
+                        follower.fs.close(handle, filesystem.DoneClose())
+                    return
+                if error:
+                    follower._error(error)
+                    return
+                follower.handle = handle
+                follower.fs.fstat(handle, DoneStat())
+        self.fs.open(self.path, filesystem.TCF_O_READ, None, DoneOpen())
+
+    def _checkReopened(self, old, attrs):
+        inode = _getINode(old)
+        new_inode = _getINode(attrs)
+        if inode is not None and new_inode is not None and \
+                inode != new_inode:
+            self.offset = 0
+            self.tail_end = None
+            self.listener.rotated(self)
+        elif attrs.size < self.offset:
+            self.offset = 0
+            self.tail_end = None
+            self.listener.truncated(self)
+
+    def _poll(self):
+        self.timer = None
+        if self.stopped:
+            return
+        if self.handle is None:
+            self._open(False)
+            return
+        follower = self
+        # fstat of the open file and stat of the path are sent together
+        results = {}
+
+        class DoneStat(filesystem.DoneStat):
+            def __init__(self, name):
+                self.name = name
+
+            def doneStat(self, token, error, attrs):
+                results[self.name] = (error, attrs)
+                if len(results) == 2 and not follower.stopped:
+                    follower._check(results["fstat"], results["stat"])
+        self.fs.fstat(self.handle, DoneStat("fstat"))
+        self.fs.stat(self.path, DoneStat("stat"))
+
+    def _check(self, fstat, stat):
+        error, attrs = fstat
+        if error:
+            self._error(error)
+            return
+        size = attrs.size
+        if size < self.offset:
+            self.offset = 0
+            self.tail_end = None
+            self.listener.truncated(self)
+        if size > self.offset:
+            self._read(size)
+            return
+        error, path_attrs = stat
+        if not error and self._isRotated(attrs, path_attrs):
+            self._closeHandle()
+            self.offset = 0
+            self.tail_end = None
+            self.attrs = None
+            self.listener.rotated(self)
+            self.delay = self.min_delay
+            self._open(False)
+            return
+        self.delay = min(self.delay * 2, self.max_delay)
+        self._schedule(self.delay)
+
+    def _isRotated(self, attrs, path_attrs):
+        inode = _getINode(attrs)
+        path_inode = _getINode(path_attrs)
+        if inode is not None and path_inode is not None:
+            return inode != path_inode
+        return path_attrs.size < attrs.size
+
+    def _read(self, size):
+        """Read bytes from offset to size, window reads in flight, and
+        report them in order."""
+        follower = self
+        offsets = list(range(self.offset, size, self.chunk_size))
+        done = {}
+        state = {"next": 0, "in_flight": 0, "short": False}
+
+        class DoneRead(filesystem.DoneRead):
+            def __init__(self, offset):
+                self.offset = offset
+
+            def doneRead(self, token, error, data, eof):
+                state["in_flight"] -= 1
+                if follower.stopped:
+                    return
+                done[self.offset] = (error, data)
+                # report in order, stop at an error or a short read
+                while not state["short"] and follower.offset in done:
+                    error, data = done.pop(follower.offset)
+                    expected = min(follower.chunk_size,
+                                   size - follower.offset)
+                    if error:
+                        state["short"] = True
+                        follower._error(error)
+                        return
+                    if data:
+                        follower.offset += len(data)
+                        follower.listener.data(follower, data)
+                    if not data or len(data) < expected:
+                        state["short"] = True
+                sendMore()
+
+        def sendMore():
+            while not state["short"] and state["next"] < len(offsets) and \
+                    state["in_flight"] < follower.window:
+                offset = offsets[state["next"]]
+                state["next"] += 1
+                state["in_flight"] += 1
+                follower.fs.read(follower.handle, offset,
+                                 min(follower.chunk_size, size - offset),
+                                 DoneRead(offset))
+            if state["in_flight"] == 0 and follower.handle is not None:
+                follower.delay = follower.min_delay
+                follower._schedule(follower.delay)
+        sendMore()
+
+
+def follow(channel, path, listener, **kwargs):
+    """
+    Create and start a Follower. Can be called from any thread.
+    @return Follower object, use stop() on the dispatch thread to stop it.
+    """
+    f = Follower(channel, path, listener, **kwargs)
+    protocol.invokeLater(f.start)
+    return f
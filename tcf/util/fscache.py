@@ -0,0 +1,462 @@
+"""
+Metadata cache over the FileSystem service.
+
+MetadataCache is a FileSystem service that forwards commands to the remote
+proxy and keeps the results of stat, lstat, realpath and whole directory
+listings (opendir and readdir until eof) in a bounded LRU cache with a time
+to live, keyed by path. Concurrent requests for the same entry share one
+command. Errors are not cached, except "no such file", so existence checks
+are cached too.
+
+Commands sent through the cache invalidate the entries they may change:
+remove, rmdir, rename, setstat, mkdir, symlink and copy invalidate their
+paths and the listings of the parent directories; open with create or
+truncate flags invalidates the file that was opened, and so do the first
+write or fsetstat on a handle and its close. Changes
+made by other clients of the agent are seen when entries expire.
+
+The cache is opt-in, enable() installs it as the FileSystem service of a
+channel, so every tool that gets the service from the channel uses it.
+"""
+
+import collections
+import posixpath
+import time
+
+from .. import protocol
+from ..services import filesystem
+
+TTL = 2.0
+MAX_ENTRIES = 4096
+
+# kinds of cached entries, keys are (kind, path)
+_KINDS = ("stat", "lstat", "realpath", "dir")
+
+_now = getattr(time, "monotonic", time.time)
+
+
+def _isCacheable(error):
+    return error is None or \
+        isinstance(error, filesystem.FileSystemException) and \
+        error.getStatus() == filesystem.STATUS_NO_SUCH_FILE
+
+
+class _CachedDirHandle(filesystem.FileHandle):
+    """Handle of a directory listing served from the cache."""
+
+    def __init__(self, service, path, entries):
+        super(_CachedDirHandle, self).__init__(service, "cached:" + path)
+        self.entries = entries
+
+
+class _Pending(object):
+    """Command in flight, waiters get its result. The result is not stored
+    if the entry was invalidated while the command was running."""
+
+    def __init__(self):
+        self.waiters = []
+        self.stale = False
+
+
+class _DirRead(object):
+    """Directory listing being read, from opendir to eof."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.stale = False
+
+
+class MetadataCache(filesystem.FileSystemService):
+    """FileSystem service that caches metadata of the wrapped service.
+
+    @param fs - FileSystem service proxy.
+    @param max_entries - maximum number of cached paths.
+    @param ttl - seconds a result is valid.
+    """
+
+    def __init__(self, fs, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.fs = fs
+        self.channel = getattr(fs, "channel", None)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.file_paths = {}
+        self.written = set()
+        self.dir_reads = set()
+        self.dir_handles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        total = self.hits + self.misses
+        return "%d hits, %d misses (%.0f%% hit rate), %d entries" % (
+            self.hits, self.misses, total and self.hits * 100.0 / total,
+            len(self.entries))
+
+    def getName(self):
+        return self.fs.getName()
+
+    def clear(self):
+        """Drop all cached entries."""
+        self.entries.clear()
+        for p in self.pending.values():
+            p.stale = True
+        for read in self.dir_reads:
+            read.stale = True
+
+    # cache
+
+    def _get(self, key, send, deliver):
+        """Deliver cached result of key, or send the command with
+        send(store) and deliver its result. Results are tuples of the
+        done callback arguments after the token."""
+        assert protocol.isDispatchThread()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if _now() - entry[0] < self.ttl:
+                self.entries[key] = self.entries.pop(key)
+                self.hits += 1
+                protocol.invokeLater(deliver, None, *entry[1])
+                return None
+            del self.entries[key]
+        p = self.pending.get(key)
+        if p is not None:
+            # the same command is in flight, no need to send another one
+            self.hits += 1
+            p.waiters.append(deliver)
+            return None
+        self.misses += 1
+        p = self.pending[key] = _Pending()
+        p.waiters.append(deliver)
+        cache = self
+
+        def store(token, *result):
+            if cache.pending.get(key) is p:
+                del cache.pending[key]
+            if not p.stale and _isCacheable(result[0]):
+                cache._put(key, result)
+            for w in p.waiters:
+                w(token, *result)
+        return send(store)
+
+    def _put(self, key, result):
+        self.entries.pop(key, None)
+        self.entries[key] = (_now(), result)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _invalidate(self, path, recursive=False):
+        """Invalidate entries of path and the listing of its parent, and
+        with recursive the entries of everything below path."""
+        if path is None:
+            return
+        keys = [(kind, path) for kind in _KINDS]
+        parent = posixpath.dirname(path.rstrip("/")) if path != "/" else None
+        if parent:
+            keys.append(("dir", parent))
+        for key in keys:
+            self.entries.pop(key, None)
+            p = self.pending.get(key)
+            if p is not None:
+                p.stale = True
+        for read in self.dir_reads:
+            if read.path == path or read.path == parent:
+                read.stale = True
+        if not recursive:
+            return
+        prefix = path.rstrip("/") + "/"
+        for key in [k for k in self.entries if k[1].startswith(prefix)]:
+            del self.entries[key]
+        for key, p in self.pending.items():
+            if key[1].startswith(prefix):
+                p.stale = True
+        for read in self.dir_reads:
+            if read.path.startswith(prefix):
+                read.stale = True
+
+    def _mutate(self, paths, send, recursive=False):
+        """Invalidate paths before a command is sent and again when it is
+        done, so results of commands that overlap it are not stored."""
+        for path in paths:
+            self._invalidate(path, recursive)
+        cache = self
+
+        def invalidate():
+            for path in paths:
+                cache._invalidate(path, recursive)
+        return send(invalidate)
+
+    # cached commands
+
+    def stat(self, path, done):
+        done = self._makeCallback(done)
+        return self._getStat("stat", path, done)
+
+    def lstat(self, path, done):
+        done = self._makeCallback(done)
+        return self._getStat("lstat", path, done)
+
+    def _getStat(self, name, path, done):
+        fs = self.fs
+
+        def send(store):
+            class DoneStat(filesystem.DoneStat):
+                def doneStat(self, token, error, attrs):
+                    store(token, error, attrs)
+            return getattr(fs, name)(path, DoneStat())
+        return self._get((name, path), send, done.doneStat)
+
+    def realpath(self, path, done):
+        done = self._makeCallback(done)
+        fs = self.fs
+
+        def send(store):
+            class DoneRealPath(filesystem.DoneRealPath):
+                def doneRealPath(self, token, error, real_path):
+                    store(token, error, real_path)
+            return fs.realpath(path, DoneRealPath())
+        return self._get(("realpath", path), send, done.doneRealPath)
+
+    def opendir(self, path, done):
+        done = self._makeCallback(done)
+        key = ("dir", path)
+        entry = self.entries.get(key)
+        if entry is not None and _now() - entry[0] < self.ttl:
+            self.hits += 1
+            self.entries[key] = self.entries.pop(key)
+            handle = _CachedDirHandle(self, path, entry[1][1])
+            protocol.invokeLater(done.doneOpen, None, None, handle)
+            return None
+        self.misses += 1
+        cache = self
+        # the listing is stored when readdir gets to eof
+        read = _DirRead(path)
+        self.dir_reads.add(read)
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                if handle is None:
+                    cache.dir_reads.discard(read)
+                else:
+                    cache.dir_handles[handle] = read
+                done.doneOpen(token, error, handle)
+        return self.fs.opendir(path, DoneOpen())
+
+    def readdir(self, handle, done):
+        done = self._makeCallback(done)
+        if isinstance(handle, _CachedDirHandle):
+            entries, handle.entries = handle.entries, []
+            protocol.invokeLater(done.doneReadDir, None, None, entries, True)
+            return None
+        cache = self
+
+        class DoneReadDir(filesystem.DoneReadDir):
+            def doneReadDir(self, token, error, entries, eof):
+                read = cache.dir_handles.get(handle)
+                if read is not None:
+                    eof_error = isinstance(
+                        error, filesystem.FileSystemException) and \
+                        error.getStatus() == filesystem.STATUS_EOF
+                    if error and not eof_error:
+                        cache._endDirRead(handle, False)
+                    else:
+                        read.entries.extend(entries or [])
+                        if eof or eof_error:
+                            cache._endDirRead(handle, True)
+                done.doneReadDir(token, error, entries, eof)
+        return self.fs.readdir(handle, DoneReadDir())
+
+    def _endDirRead(self, handle, complete):
+        read = self.dir_handles.pop(handle)
+        self.dir_reads.discard(read)
+        if complete and not read.stale:
+            self._put(("dir", read.path), (None, read.entries))
+
+    def close(self, handle, done):
+        done = self._makeCallback(done)
+        if isinstance(handle, _CachedDirHandle):
+            protocol.invokeLater(done.doneClose, None, None)
+            return None
+        path = self.file_paths.pop(handle, None)
+        if handle in self.dir_handles:
+            # closed before eof, the listing is incomplete
+            self._endDirRead(handle, False)
+        if handle not in self.written:
+            return self.fs.close(handle, done)
+        self.written.discard(handle)
+        cache = self
+
+        def send(invalidate):
+            class DoneClose(filesystem.DoneClose):
+                def doneClose(self, token, error):
+                    invalidate()
+                    done.doneClose(token, error)
+            return cache.fs.close(handle, DoneClose())
+        return self._mutate([path], send)
+
+    # commands that invalidate the cache
+
+    def open(self, file_name, flags, attrs, done):  # @ReservedAssignment
+        done = self._makeCallback(done)
+        cache = self
+        modify = flags & (filesystem.TCF_O_WRITE | filesystem.TCF_O_CREAT |
+                          filesystem.TCF_O_TRUNC)
+
+        def send(invalidate):
+            class DoneOpen(filesystem.DoneOpen):
+                def doneOpen(self, token, error, handle):
+                    if modify:
+                        invalidate()
+                        if handle is not None:
+                            cache.file_paths[handle] = file_name
+                    done.doneOpen(token, error, handle)
+            return cache.fs.open(file_name, flags, attrs, DoneOpen())
+        if not modify:
+            return send(None)
+        return self._mutate([file_name], send)
+
+    def write(self, handle, offset, data, data_pos, data_size, done):
+        done = self._makeCallback(done)
+        self._written(handle)
+        return self.fs.write(handle, offset, data, data_pos, data_size, done)
+
+    def fsetstat(self, handle, attrs, done):
+        done = self._makeCallback(done)
+        self._written(handle)
+        return self.fs.fsetstat(handle, attrs, done)
+
+    def _written(self, handle):
+        """Invalidate the file of handle on its first write or fsetstat, and
+        again when it is closed, instead of on every write."""
+        if handle in self.written:
+            return
+        path = self.file_paths.get(handle)
+        if path is not None:
+            self.written.add(handle)
+            self._invalidate(path)
+
+    def setstat(self, path, attrs, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneSetStat(filesystem.DoneSetStat):
+                def doneSetStat(self, token, error):
+                    invalidate()
+                    done.doneSetStat(token, error)
+            return cache.fs.setstat(path, attrs, DoneSetStat())
+        return self._mutate([path], send)
+
+    def mkdir(self, path, attrs, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneMkDir(filesystem.DoneMkDir):
+                def doneMkDir(self, token, error):
+                    invalidate()
+                    done.doneMkDir(token, error)
+            return cache.fs.mkdir(path, attrs, DoneMkDir())
+        return self._mutate([path], send)
+
+    def remove(self, file_name, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneRemove(filesystem.DoneRemove):
+                def doneRemove(self, token, error):
+                    invalidate()
+                    done.doneRemove(token, error)
+            return cache.fs.remove(file_name, DoneRemove())
+        return self._mutate([file_name], send)
+
+    def rmdir(self, path, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneRemove(filesystem.DoneRemove):
+                def doneRemove(self, token, error):
+                    invalidate()
+                    done.doneRemove(token, error)
+            return cache.fs.rmdir(path, DoneRemove())
+        return self._mutate([path], send, True)
+
+    def rename(self, old_path, new_path, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneRename(filesystem.DoneRename):
+                def doneRename(self, token, error):
+                    invalidate()
+                    done.doneRename(token, error)
+            return cache.fs.rename(old_path, new_path, DoneRename())
+        return self._mutate([old_path, new_path], send, True)
+
+    def symlink(self, link_path, target_path, done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneSymLink(filesystem.DoneSymLink):
+                def doneSymLink(self, token, error):
+                    invalidate()
+                    done.doneSymLink(token, error)
+            return cache.fs.symlink(link_path, target_path, DoneSymLink())
+        return self._mutate([link_path], send)
+
+    def copy(self, src_path, dst_path, copy_permissions, copy_ownership,
+             done):
+        done = self._makeCallback(done)
+        cache = self
+
+        def send(invalidate):
+            class DoneCopy(filesystem.DoneCopy):
+                def doneCopy(self, token, error):
+                    invalidate()
+                    done.doneCopy(token, error)
+            return cache.fs.copy(src_path, dst_path, copy_permissions,
+                                 copy_ownership, DoneCopy())
+        return self._mutate([dst_path], send, True)
+
+    # commands that are not cached
+
+    def read(self, handle, offset, length, done):
+        return self.fs.read(handle, offset, length, done)
+
+    def fstat(self, handle, done):
+        return self.fs.fstat(handle, done)
+
+    def roots(self, done):
+        return self.fs.roots(done)
+
+    def readlink(self, path, done):
+        return self.fs.readlink(path, done)
+
+    def user(self, done):
+        return self.fs.user(done)
+
+
+def enable(channel, max_entries=MAX_ENTRIES, ttl=TTL):
+    """
+    Install a MetadataCache as the FileSystem service of a channel.
+    Must be called on the dispatch thread, the channel must be open.
+    @return the MetadataCache, the existing one if it is already installed.
+    @raises IOError if the remote peer has no FileSystem service.
+    """
+    assert protocol.isDispatchThread()
+    fs = channel.getRemoteService(filesystem.NAME)
+    if fs is None:
+        raise IOError("Remote peer has no FileSystem service")
+    if isinstance(fs, MetadataCache):
+        return fs
+    cache = MetadataCache(fs, max_entries, ttl)
+    channel.remote_service_by_name[filesystem.NAME] = cache
+    for cls, service in list(channel.remote_service_by_class.items()):
+        if service is fs:
+            channel.remote_service_by_class[cls] = cache
+    return cache
@@ -0,0 +1,396 @@
+"""
+Standard file objects for remote files.
+
+open() returns an io object (BufferedReader, BufferedWriter, BufferedRandom
+or TextIOWrapper, as the built-in open() does) over RemoteFile, a raw file
+object on top of the FileSystem service, so remote files can be used with
+shutil.copyfileobj(), tarfile, zipfile and the like:
+
+    with remotefile.open(channel, "/var/log/messages", "r") as f:
+        for line in f:
+            ...
+
+Reads are split into chunk_size read commands that are sent at once, so a
+read of any size costs one round-trip. Sequential reads are prefetched,
+the read-ahead doubles with every sequential read up to window commands
+ahead of the current position, random access resets it. Writes are sent without
+waiting for the replies, with at most window writes in flight; an error of
+such a write is raised by a later read, write, seek or close().
+
+The methods block, they must not be called on the dispatch thread.
+"""
+
+import io
+import os
+import threading
+
+from .. import protocol
+from ..services import filesystem
+from . import task, transfer
+
+
+def _modeToFlags(mode):
+    """Convert an open() mode string to FileSystem open flags."""
+    chars = set(mode)
+    if len(chars) != len(mode) or chars - set("rwxab+t") or \
+            len(chars & set("rwxa")) != 1 or "b" in chars and "t" in chars:
+        raise ValueError("invalid mode: %r" % mode)
+    if "r" in chars:
+        flags = filesystem.TCF_O_READ
+    elif "w" in chars:
+        flags = filesystem.TCF_O_WRITE | filesystem.TCF_O_CREAT | \
+            filesystem.TCF_O_TRUNC
+    elif "x" in chars:
+        flags = filesystem.TCF_O_WRITE | filesystem.TCF_O_CREAT | \
+            filesystem.TCF_O_EXCL
+    else:
+        flags = filesystem.TCF_O_WRITE | filesystem.TCF_O_CREAT | \
+            filesystem.TCF_O_APPEND
+    if "+" in chars:
+        flags |= filesystem.TCF_O_READ | filesystem.TCF_O_WRITE
+    return flags
+
+
+def _toIOError(error):
+    """FileSystem errors are IOErrors with a status, they are raised as
+    they are, so callers can check getStatus()."""
+    if isinstance(error, IOError):
+        return error
+    return IOError(str(error))
+
+
+def _call(target, *args):
+    """Run target(*args, done) on the dispatch thread and wait for the
+    result, errors are raised as IOError."""
+    try:
+        return task.Task(target, *args).get()
+    except Exception as x:
+        if len(x.args) == 2 and x.args[0] == "TCF task aborted":
+            raise _toIOError(x.args[1])
+        raise
+
+
+class _Read(object):
+    """A read command, data is valid when the event is set."""
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+        self.data = None
+        self.eof = False
+        self.error = None
+        self.event = threading.Event()
+
+
+class RemoteFile(io.RawIOBase):
+    """Raw file object of a remote file.
+
+    Not thread safe, as other raw file objects; use it from one thread at a
+    time.
+    """
+
+    def __init__(self, channel, path, mode="r", chunk_size=transfer.CHUNK_SIZE,
+                 window=transfer.WINDOW):
+        super(RemoteFile, self).__init__()
+        flags = _modeToFlags(mode)
+        self.channel = channel
+        self.name = path
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.window = transfer.getWindow(channel, window)
+        self.pos = 0
+        self.seq_end = 0
+        self.ahead = 1
+        self.reads = []
+        self.lock = threading.Condition()
+        self.writes = 0
+        self.write_error = None
+        self._readable = bool(flags & filesystem.TCF_O_READ)
+        self._writable = bool(flags & filesystem.TCF_O_WRITE)
+        self.handle = None
+        self.fs, self.handle = _call(self._open, path, flags)
+        if "a" in mode:
+            self.pos = self._getSize()
+
+    def _open(self, path, flags, done):
+        fs = transfer.getFileSystem(self.channel)
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                done(error, (fs, handle))
+        fs.open(path, flags, None, DoneOpen())
+
+    def _fstat(self, done):
+        class DoneStat(filesystem.DoneStat):
+            def doneStat(self, token, error, attrs):
+                done(error, attrs)
+        self.fs.fstat(self.handle, DoneStat())
+
+    def _fsetstat(self, attrs, done):
+        class DoneSetStat(filesystem.DoneSetStat):
+            def doneSetStat(self, token, error):
+                done(error, None)
+        self.fs.fsetstat(self.handle, attrs, DoneSetStat())
+
+    def _close(self, done):
+        class DoneClose(filesystem.DoneClose):
+            def doneClose(self, token, error):
+                done(error, None)
+        self.fs.close(self.handle, DoneClose())
+
+    def _getSize(self):
+        self._waitWrites()
+        return _call(self._fstat).size
+
+    # io.RawIOBase interface
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._getSize() + offset
+        else:
+            raise ValueError("invalid whence: %r" % whence)
+        if pos < 0:
+            raise ValueError("negative seek position %d" % pos)
+        self.pos = pos
+        return pos
+
+    def truncate(self, size=None):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        if size is None:
+            size = self.pos
+        self._waitWrites()
+        self._discardReads()
+        attrs = filesystem.FileAttrs(filesystem.ATTR_SIZE, size, 0, 0, 0, 0,
+                                     0, None)
+        _call(self._fsetstat, attrs)
+        return size
+
+    def readinto(self, b):
+        if not self._readable:
+            raise io.UnsupportedOperation("File not open for reading")
+        n = len(b)
+        if n == 0:
+            return 0
+        self._waitWrites()
+        pos = self.pos
+        if pos == self.seq_end:
+            # sequential access, read further ahead
+            self.ahead = min(self.window, self.ahead * 2)
+        else:
+            self.ahead = 1
+            if self._find(pos) is None:
+                # prefetched data is not going to be used
+                self._discardReads()
+        self._request(pos, n)
+        copied = 0
+        while copied < n:
+            offset = pos + copied
+            r = self._find(offset)
+            if r is None:
+                # not requested yet, or a read returned less data than
+                # requested
+                self._request(offset, n - copied)
+                continue
+            r.event.wait()
+            if r.error is not None:
+                self._discardReads()
+                raise _toIOError(r.error)
+            start = offset - r.offset
+            end = min(len(r.data), start + n - copied)
+            if end <= start:
+                if r.eof:
+                    break
+                self.reads.remove(r)
+                if copied > 0 or not r.data:
+                    # short read of a pipe, device or procfs file, don't
+                    # request the same offset again
+                    break
+                continue
+            b[copied:copied + end - start] = r.data[start:end]
+            copied += end - start
+            if end == len(r.data) and r.eof:
+                break
+        self.pos = self.seq_end = pos + copied
+        # drop consumed reads
+        self.reads = [r for r in self.reads
+                      if r.offset + r.size > self.pos]
+        return copied
+
+    def write(self, b):
+        if not self._writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        data = bytearray(b)
+        self._discardReads()
+        for i in range(0, len(data), self.chunk_size):
+            chunk = data[i:i + self.chunk_size]
+            with self.lock:
+                while self.writes >= self.window and self.write_error is None:
+                    self.lock.wait()
+                self._checkWriteError()
+                self.writes += 1
+            protocol.invokeLater(self._sendWrite, self.pos + i, chunk)
+        self.pos += len(data)
+        self.seq_end = None
+        return len(data)
+
+    def flush(self):
+        if not self.closed:
+            self._waitWrites()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._waitWrites()
+        finally:
+            self._discardReads()
+            super(RemoteFile, self).close()
+            if self.handle is None:
+                # open failed
+                pass
+            elif protocol.isDispatchThread():
+                # garbage collected on the dispatch thread, can't wait
+                self.fs.close(self.handle, filesystem.DoneClose())
+            else:
+                _call(self._close)
+
+    # read-ahead
+
+    def _find(self, offset):
+        for r in self.reads:
+            if r.offset <= offset < r.offset + r.size:
+                return r
+        return None
+
+    def _request(self, pos, size):
+        """Send read commands for data from pos that is not requested yet:
+        size bytes and ahead chunks of read-ahead, at most window chunks."""
+        end = pos + min(max(size, self.ahead * self.chunk_size),
+                        self.window * self.chunk_size)
+        new = []
+        offset = pos
+        while offset < end:
+            r = self._find(offset)
+            if r is not None:
+                offset = r.offset + r.size
+                continue
+            stop = min(end, offset + self.chunk_size)
+            for r in self.reads:
+                if offset < r.offset < stop:
+                    stop = r.offset
+            r = _Read(offset, stop - offset)
+            self.reads.append(r)
+            new.append(r)
+            offset = stop
+        if new:
+            protocol.invokeLater(self._sendReads, new)
+
+    def _sendReads(self, reads):
+        class DoneRead(filesystem.DoneRead):
+            def __init__(self, r):
+                self.r = r
+
+            def doneRead(self, token, error, data, eof):
+                r = self.r
+                r.error = error
+                r.data = data or bytearray()
+                r.eof = eof
+                r.event.set()
+        for r in reads:
+            try:
+                self.fs.read(self.handle, r.offset, r.size, DoneRead(r))
+            except Exception as x:
+                r.error = x
+                r.event.set()
+
+    def _discardReads(self):
+        # replies of reads in flight are ignored
+        del self.reads[:]
+
+    # write-behind
+
+    def _sendWrite(self, offset, data):
+        f = self
+
+        class DoneWrite(filesystem.DoneWrite):
+            def doneWrite(self, token, error):
+                f._doneWrite(error)
+        try:
+            self.fs.write(self.handle, offset, data, 0, len(data),
+                          DoneWrite())
+        except Exception as x:
+            self._doneWrite(x)
+
+    def _doneWrite(self, error):
+        with self.lock:
+            self.writes -= 1
+            if error is not None and self.write_error is None:
+                self.write_error = error
+            self.lock.notify_all()
+
+    def _checkWriteError(self):
+        if self.write_error is not None:
+            error = self.write_error
+            self.write_error = None
+            raise _toIOError(error)
+
+    def _waitWrites(self):
+        """Wait for the writes in flight, raise the first error."""
+        with self.lock:
+            while self.writes > 0:
+                self.lock.wait()
+            self._checkWriteError()
+
+
+def open(channel, path, mode="r", buffering=-1, encoding=None, errors=None,
+         newline=None, chunk_size=transfer.CHUNK_SIZE,
+         window=transfer.WINDOW):
+    """
+    Open a remote file, the arguments are the same as of the built-in
+    open(). Must not be called on the dispatch thread.
+    @param channel - open TCF channel.
+    @param chunk_size - size of read and write commands, also the default
+                        buffer size.
+    @param window - maximum number of read or write commands in flight.
+    @return file object.
+    """
+    raw = RemoteFile(channel, path, mode, chunk_size, window)
+    binary = "b" in mode
+    try:
+        if buffering == 0:
+            if not binary:
+                raise ValueError("can't have unbuffered text I/O")
+            return raw
+        buffer_size = chunk_size if buffering in (-1, 1) else buffering
+        if raw.readable() and raw.writable():
+            f = io.BufferedRandom(raw, buffer_size)
+        elif raw.writable():
+            f = io.BufferedWriter(raw, buffer_size)
+        else:
+            f = io.BufferedReader(raw, buffer_size)
+        if binary:
+            return f
+        return io.TextIOWrapper(f, encoding, errors, newline,
+                                line_buffering=buffering == 1)
+    except:
+        raw.close()
+        raise
@@ -12,7 +12,51 @@
 import threading
 import types
 from .. import protocol
-from ..channel.Command import Command
+from ..channel import fromJSONSequence
+from ..channel.Command import Command, getCommandString, toError
+
+
+def splitResult(service, command, args, toError):
+    """
+    Split generic command result arguments into error and result.
+    @param toError - callable that converts error report data to an error
+                     object.
+    @return tuple (error, result arguments).
+    """
+    # error result is usually in args[0], but there are exceptions
+    if service == "StackTrace" and command == "getContext":
+        return toError(args[1]), (args[0],)
+    if service == "Expressions" and command == "evaluate":
+        return toError(args[1]), (args[0], args[2])
+    if service == "FileSystem" and command in ('read', 'readdir', 'roots'):
+        return toError(args[1]), (args[0],) + tuple(args[2:])
+    if service == "Streams" and command == 'read':
+        return toError(args[1]), (args[0],) + tuple(args[2:])
+    if service == "Diagnostics":
+        if command.startswith("echo"):
+            return None, (args[0],)
+        return None, None
+    return toError(args[0]), args[1:]
+
+
+def decodeResult(service, command, args, data):
+    """
+    Decode generic command result data and split it into error and result.
+    @param args - command arguments, included in error reports.
+    @return tuple (error, result), result is the result arguments with a
+            single argument unwrapped, or None if there are none.
+    """
+    res = fromJSONSequence(data)
+    error = None
+    if res:
+        def makeError(report):
+            return toError(report, getCommandString(service, command, args))
+        error, res = splitResult(service, command, res, makeError)
+    if not res:
+        res = None
+    elif len(res) == 1:
+        res = res[0]
+    return error, res
 
 
 class DispatchWrapper(object):
@@ -94,28 +138,9 @@ class CommandControl(object):
 
             def done(self, error, args):  # @IgnorePep8
                 resultArgs = None
-                rcmds = ('read', 'readdir', 'roots')
                 if not error and args:
-                    # error result is usually in args[0],
-                    # but there are exceptions
-                    if service == "StackTrace" and command == "getContext":
-                        error = self.toError(args[1])
-                        resultArgs = (args[0],)
-                    elif service == "Expressions" and command == "evaluate":
-                        error = self.toError(args[1])
-                        resultArgs = (args[0], args[2])
-                    elif service == "FileSystem" and command in rcmds:
-                        error = self.toError(args[1])
-                        resultArgs = (args[0],) + tuple(args[2:])
-                    elif service == "Streams" and command == 'read':
-                        error = self.toError(args[1])
-                        resultArgs = (args[0],) + tuple(args[2:])
-                    elif service == "Diagnostics":
-                        if command.startswith("echo"):
-                            resultArgs = (args[0],)
-                    else:
-                        error = self.toError(args[0])
-                        resultArgs = args[1:]
+                    error, resultArgs = splitResult(service, command, args,
+                                                    self.toError)
                 cmdCtrl._doneCommand(self.token, error, resultArgs)
 
             def wait(self, timeout=None):
@@ -0,0 +1,918 @@
+"""
+Pipelined file transfer over TCF FileSystem service.
+
+Transfers keep several read or write commands in flight at increasing file
+offsets, so a transfer is not limited by the channel round-trip time.
+Striped transfers spread the commands of one file over several channels to
+the same agent, for links where a single connection is the bottleneck.
+Transfer objects are driven by the TCF dispatch thread, use the blocking
+functions (e.g. download()) from other threads.
+"""
+
+import os
+import stat
+import time
+
+from .. import protocol
+from ..channel import PreparedBinary
+from ..services import filesystem
+from . import task
+
+CHUNK_SIZE = 0x10000
+WINDOW = 16
+BUFFER_SIZE = 0x4000000
+
+
+def getFileSystem(channel):
+    """
+    Get FileSystem service proxy of a channel.
+    Must be called on the dispatch thread.
+    @raises IOError if the remote peer has no FileSystem service.
+    """
+    fs = channel.getRemoteService(filesystem.NAME)
+    if fs is None:
+        raise IOError("Remote peer has no FileSystem service")
+    return fs
+
+
+def getLocalFileAttrs(path):
+    """
+    Get permissions and access/modification times of a local file.
+    @return FileAttrs object suitable for FileSystem.setstat.
+    """
+    st = os.stat(path)
+    return filesystem.FileAttrs(
+        filesystem.ATTR_PERMISSIONS | filesystem.ATTR_ACMODTIME, st.st_size,
+        0, 0, stat.S_IMODE(st.st_mode), int(st.st_atime * 1000),
+        int(st.st_mtime * 1000), None)
+
+
+def getWindow(channel, window):
+    """Limit number of commands in flight below channel pending command
+    limit."""
+    return max(1, min(window, channel.pending_command_limit - 1))
+
+
+class Transfer(object):
+    """Base class of pipelined transfers.
+
+    Subclasses implement _start() and call _done() once, when the transfer is
+    complete or failed.
+    """
+
+    def __init__(self, channel, path, chunk_size=CHUNK_SIZE, window=WINDOW):
+        self.channel = channel
+        self.path = path
+        self.chunk_size = chunk_size
+        self.window = window
+        self.size = 0
+        self.time = 0
+        self.error = None
+        self._time0 = None
+        self._callback = None
+
+    def start(self, done=None):
+        """
+        Start the transfer. Must be called on the dispatch thread.
+        @param done - callable invoked as done(error, transfer) when the
+                      transfer is complete.
+        """
+        assert protocol.isDispatchThread()
+        self._callback = done
+        self._time0 = time.time()
+        self.window = getWindow(self.channel, self.window)
+        try:
+            self.fs = getFileSystem(self.channel)
+            self._start()
+        except Exception as x:
+            self._done(x)
+
+    def _start(self):
+        raise NotImplementedError("Abstract method")
+
+    def _done(self, error):
+        self.time = time.time() - self._time0
+        self.error = error
+        if self._callback:
+            self._callback(error, self)
+
+    def getThroughput(self):
+        """@return transfer throughput in bytes per second."""
+        if self.time <= 0:
+            return 0
+        return self.size / self.time
+
+    def __str__(self):
+        return "%d bytes in %.3f s, %.2f MB/s" % (
+            self.size, self.time, self.getThroughput() / 1e6)
+
+
+class Download(Transfer):
+    """Download a remote file into a local file object.
+
+    Data is written to the output in file order as soon as it is available;
+    only chunks received out of order are kept in memory.
+    """
+
+    def __init__(self, channel, path, out, chunk_size=CHUNK_SIZE,
+                 window=WINDOW):
+        super(Download, self).__init__(channel, path, chunk_size, window)
+        self.out = out
+        self.handle = None
+        self.read_pos = 0
+        self.write_pos = 0
+        self.eof_pos = None
+        self.in_flight = 0
+        self.chunks = {}
+
+    def _start(self):
+        download = self
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                if error:
+                    download._done(error)
+                    return
+                download.handle = handle
+                download._readMore()
+        self.fs.open(self.path, filesystem.TCF_O_READ, None, DoneOpen())
+
+    def _readMore(self):
+        while self.error is None and self.eof_pos is None and \
+                self.in_flight < self.window:
+            self._read(self.read_pos, self.chunk_size)
+            self.read_pos += self.chunk_size
+        if self.in_flight == 0:
+            self._close()
+
+    def _read(self, offset, length):
+        download = self
+
+        class DoneRead(filesystem.DoneRead):
+            def doneRead(self, token, error, data, eof):
+                download.in_flight -= 1
+                download._doneRead(offset, length, error, data, eof)
+        self.in_flight += 1
+        self.fs.read(self.handle, offset, length, DoneRead())
+
+    def _doneRead(self, offset, length, error, data, eof):
+        if error:
+            if self.error is None:
+                self.error = error
+        elif self.eof_pos is None or offset < self.eof_pos:
+            n = len(data)
+            if n > 0:
+                self.chunks[offset] = data
+            if eof or n == 0:
+                self.eof_pos = offset + n
+            elif n < length:
+                # short read, request the rest of the chunk
+                self._read(offset + n, length - n)
+            try:
+                self._flush()
+            except Exception as x:
+                self.error = x
+        self._readMore()
+
+    def _flush(self):
+        chunks = self.chunks
+        while self.write_pos in chunks:
+            data = chunks.pop(self.write_pos)
+            self.out.write(data)
+            self.write_pos += len(data)
+            self.size += len(data)
+
+    def _close(self):
+        download = self
+        if self.handle is None:
+            self._done(self.error)
+            return
+
+        class DoneClose(filesystem.DoneClose):
+            def doneClose(self, token, error):
+                download._done(download.error or error)
+        handle = self.handle
+        self.handle = None
+        self.fs.close(handle, DoneClose())
+
+
+class Upload(Transfer):
+    """Upload a local file object into a remote file.
+
+    The input is read in chunks of chunk_size bytes, so at most window chunks
+    are held in memory regardless of file size. No new writes are issued
+    while the remote peer reports congestion and a write is still in flight.
+    When all data is written the remote file size and optional attributes
+    are set with fsetstat, then the file is closed.
+    """
+
+    def __init__(self, channel, path, inp, chunk_size=CHUNK_SIZE,
+                 window=WINDOW, attrs=None,
+                 flags=filesystem.TCF_O_WRITE | filesystem.TCF_O_CREAT |
+                 filesystem.TCF_O_TRUNC):
+        super(Upload, self).__init__(channel, path, chunk_size, window)
+        self.inp = inp
+        self.attrs = attrs
+        self.flags = flags
+        self.handle = None
+        self.offset = 0
+        self.in_flight = 0
+        self.eof = False
+
+    def _start(self):
+        upload = self
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                if error:
+                    upload._done(error)
+                    return
+                upload.handle = handle
+                upload._writeMore()
+        self.fs.open(self.path, self.flags, None, DoneOpen())
+
+    def _writeMore(self):
+        while self.error is None and not self.eof and \
+                self.in_flight < self.window:
+            if self.in_flight > 0 and self.channel.remote_congestion_level > 0:
+                break
+            try:
+                data = self.inp.read(self.chunk_size)
+            except Exception as x:
+                self.error = x
+                break
+            if not data:
+                self.eof = True
+                break
+            self._write(self.offset, data)
+            self.offset += len(data)
+        if self.in_flight == 0:
+            self._finish()
+
+    def _write(self, offset, data):
+        upload = self
+
+        class DoneWrite(filesystem.DoneWrite):
+            def doneWrite(self, token, error):
+                upload.in_flight -= 1
+                if error:
+                    if upload.error is None:
+                        upload.error = error
+                else:
+                    upload.size += len(data)
+                upload._writeMore()
+        self.in_flight += 1
+        self.fs.write(self.handle, offset, data, 0, len(data), DoneWrite())
+
+    def _finish(self):
+        if self.error is not None:
+            self._close()
+            return
+        upload = self
+        attrs = self.attrs
+        flags = filesystem.ATTR_SIZE
+        if attrs is not None:
+            flags |= attrs.flags
+        else:
+            attrs = filesystem.FileAttrs(0, 0, 0, 0, 0, 0, 0, None)
+        attrs = filesystem.FileAttrs(flags, self.offset, attrs.uid, attrs.gid,
+                                     attrs.permissions, attrs.atime,
+                                     attrs.mtime, attrs.attributes)
+
+        class DoneSetStat(filesystem.DoneSetStat):
+            def doneSetStat(self, token, error):
+                upload.error = error
+                upload._close()
+        self.fs.fsetstat(self.handle, attrs, DoneSetStat())
+
+    def _close(self):
+        upload = self
+
+        class DoneClose(filesystem.DoneClose):
+            def doneClose(self, token, error):
+                upload._done(upload.error or error)
+        handle = self.handle
+        self.handle = None
+        self.fs.close(handle, DoneClose())
+
+
+class DeltaUpload(Upload):
+    """Upload a local file, writing only the blocks that differ from the
+    remote file.
+
+    Remote blocks are read with pipelined read commands and compared with
+    the same blocks of the local file, blocks that differ are written back at
+    their offset. Blocks beyond the remote end of file are written without
+    reading. The input must be seekable. size counts written bytes, matched
+    counts bytes that were already up to date.
+    """
+
+    def __init__(self, channel, path, inp, chunk_size=CHUNK_SIZE,
+                 window=WINDOW, attrs=None):
+        super(DeltaUpload, self).__init__(
+            channel, path, inp, chunk_size, window, attrs,
+            filesystem.TCF_O_READ | filesystem.TCF_O_WRITE |
+            filesystem.TCF_O_CREAT)
+        self.matched = 0
+        self.local_size = None
+        self.remote_size = None
+
+    def _writeMore(self):
+        if self.local_size is None:
+            try:
+                self.inp.seek(0, os.SEEK_END)
+                self.local_size = self.inp.tell()
+            except Exception as x:
+                self.error = x
+        while self.error is None and self.offset < self.local_size and \
+                self.in_flight < self.window:
+            if self.in_flight > 0 and self.channel.remote_congestion_level > 0:
+                break
+            offset = self.offset
+            length = min(self.chunk_size, self.local_size - offset)
+            self.offset += length
+            if self.remote_size is not None and offset >= self.remote_size:
+                data = self._readLocal(offset, length)
+                if data is not None:
+                    self._write(offset, data)
+            else:
+                self._compare(offset, length)
+        if self.in_flight == 0:
+            self._finish()
+
+    def _readLocal(self, offset, length):
+        try:
+            self.inp.seek(offset)
+            return self.inp.read(length)
+        except Exception as x:
+            self.error = x
+            return None
+
+    def _compare(self, offset, length):
+        upload = self
+
+        class DoneRead(filesystem.DoneRead):
+            def doneRead(self, token, error, data, eof):
+                upload.in_flight -= 1
+                upload._doneCompare(offset, length, error, data, eof)
+        self.in_flight += 1
+        self.fs.read(self.handle, offset, length, DoneRead())
+
+    def _doneCompare(self, offset, length, error, data, eof):
+        if error:
+            if self.error is None:
+                self.error = error
+        elif self.error is None:
+            if eof or len(data) < length:
+                end = offset + len(data)
+                if eof and (self.remote_size is None or
+                            end < self.remote_size):
+                    self.remote_size = end
+            local = self._readLocal(offset, length)
+            if local is not None:
+                if data == local:
+                    self.matched += length
+                else:
+                    self._write(offset, local)
+        self._writeMore()
+
+    def __str__(self):
+        return "%d bytes written, %d bytes unchanged in %.3f s" % (
+            self.size, self.matched, self.time)
+
+
+# returned by MultiUpload._getChunk() when the chunk buffer is full
+_stalled = object()
+
+
+class _TargetUpload(Upload):
+    """Upload to one channel of MultiUpload, chunks come from the shared
+    chunk buffer instead of the input file."""
+
+    def __init__(self, multi, channel, path, chunk_size, window, attrs):
+        super(_TargetUpload, self).__init__(channel, path, None, chunk_size,
+                                            window, attrs)
+        self.multi = multi
+        self.chunk_index = 0
+        self.finished = False
+        # True while the target is in the stalled list of multi
+        self.stalled = False
+        # True while the target is counted in multi.positions
+        self.counted = False
+
+    def _writeMore(self):
+        if self.handle is None:
+            # resumed after the upload failed and closed the file
+            return
+        multi = self.multi
+        while self.error is None and not self.eof and \
+                self.in_flight < self.window:
+            if self.in_flight > 0 and self.channel.remote_congestion_level > 0:
+                break
+            try:
+                chunk = multi._getChunk(self)
+            except Exception as x:
+                self.error = x
+                break
+            if chunk is _stalled:
+                break
+            if chunk is None:
+                self.eof = True
+                break
+            self._write(self.offset, chunk)
+            self.offset += len(chunk)
+            multi._advance(self)
+        multi._release(self)
+        if self.in_flight == 0 and (self.eof or self.error is not None):
+            self._finish()
+
+
+class MultiUpload(object):
+    """Upload one local file object to the same path over several channels.
+
+    Every chunk is read from the input once and encoded once, as a
+    channel.PreparedBinary, and written to all the channels. Each channel
+    runs its own pipelined Upload with its own window, so a slow target
+    does not hold back the others: a chunk is kept until every target has
+    sent it, and only when the kept chunks exceed buffer_size a target that
+    needs a new chunk waits for the slowest one.
+
+    The upload objects of the targets, in the order of channels, are in the
+    uploads field; each has its own size, time and error. More targets can
+    join with add() until the first chunk is dropped, see canAdd().
+    """
+
+    def __init__(self, channels, path, inp, chunk_size=CHUNK_SIZE,
+                 window=WINDOW, attrs=None, buffer_size=BUFFER_SIZE):
+        self.uploads = []
+        self.path = path
+        self.window = window
+        self.attrs = attrs
+        self.inp = inp
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        # chunks by index, from first_index to read_index - 1
+        self.chunks = {}
+        self.chunks_size = 0
+        # number of running targets by the index of their next chunk
+        self.positions = {}
+        self.read_index = 0
+        self.first_index = 0
+        self.eof_index = None
+        self.read_error = None
+        self.read_size = 0
+        self.stalled = []
+        self.running = 0
+        self.time = 0
+        self._callback = None
+        self._time0 = 0
+        for c in channels:
+            self._join(_TargetUpload(self, c, path, chunk_size, window,
+                                     attrs))
+
+    def start(self, done=None):
+        """
+        Start the uploads. Must be called on the dispatch thread.
+        @param done - callable invoked as done(None, multi_upload) when all
+                      the uploads are complete or failed.
+        """
+        assert protocol.isDispatchThread()
+        self._callback = done
+        self._time0 = time.time()
+        self.running = len(self.uploads)
+        if not self.uploads:
+            self._doneTarget(None, None)
+        for u in self.uploads:
+            u.start(self._doneTarget)
+
+    def canAdd(self):
+        """@return True if a new target can still get all the chunks."""
+        return self.first_index == 0 and self.read_error is None
+
+    def add(self, channel, done=None):
+        """
+        Start the upload to one more channel. Must be called on the dispatch
+        thread, and only while canAdd() is True.
+        @param done - callable invoked as done(error, upload) when the upload
+                      to the channel is complete.
+        @return the upload object of the channel.
+        """
+        assert protocol.isDispatchThread()
+        assert self.canAdd()
+        upload = self._join(_TargetUpload(self, channel, self.path,
+                                          self.chunk_size, self.window,
+                                          self.attrs))
+        self.running += 1
+        if not self._time0:
+            self._time0 = time.time()
+        multi = self
+
+        def doneTarget(error, upload):
+            if done:
+                done(error, upload)
+            multi._doneTarget(error, upload)
+        upload.start(doneTarget)
+        return upload
+
+    def _join(self, upload):
+        self.uploads.append(upload)
+        upload.counted = True
+        self.positions[0] = self.positions.get(0, 0) + 1
+        return upload
+
+    def _advance(self, upload):
+        index = upload.chunk_index
+        upload.chunk_index = index + 1
+        if upload.counted:
+            self._uncount(index)
+            self.positions[index + 1] = self.positions.get(index + 1, 0) + 1
+
+    def _uncount(self, index):
+        n = self.positions[index] - 1
+        if n:
+            self.positions[index] = n
+        else:
+            del self.positions[index]
+
+    def _doneTarget(self, error, upload):
+        if upload is not None:
+            upload.finished = True
+            self.running -= 1
+            self._release(upload)
+        if self.running == 0:
+            self.time = time.time() - self._time0
+            if self._callback:
+                self._callback(None, self)
+
+    def _getChunk(self, upload):
+        index = upload.chunk_index
+        chunk = self.chunks.get(index)
+        if chunk is not None:
+            return chunk
+        if self.read_error is not None:
+            raise self.read_error
+        if self.eof_index is not None and index >= self.eof_index:
+            return None
+        assert index == self.read_index
+        if self.chunks_size >= self.buffer_size:
+            if not upload.stalled:
+                upload.stalled = True
+                self.stalled.append(upload)
+            return _stalled
+        try:
+            data = self.inp.read(self.chunk_size)
+        except Exception as x:
+            self.read_error = x
+            raise
+        if not data:
+            self.eof_index = index
+            return None
+        chunk = PreparedBinary(data)
+        self.chunks[index] = chunk
+        self.chunks_size += len(chunk)
+        self.read_index += 1
+        self.read_size += len(chunk)
+        return chunk
+
+    def _release(self, upload):
+        """Drop chunks that are sent to all running targets, resume targets
+        that wait for buffer space."""
+        if upload.counted and (upload.finished or upload.error is not None):
+            upload.counted = False
+            self._uncount(upload.chunk_index)
+        while self.first_index < self.read_index and \
+                self.first_index not in self.positions:
+            self.chunks_size -= len(self.chunks.pop(self.first_index))
+            self.first_index += 1
+        if self.stalled and self.chunks_size < self.buffer_size:
+            stalled = self.stalled
+            self.stalled = []
+            for u in stalled:
+                u.stalled = False
+                protocol.invokeLater(u._writeMore)
+
+    def getErrors(self):
+        """@return list of (channel, error) of failed uploads."""
+        return [(u.channel, u.error) for u in self.uploads if u.error]
+
+    def __str__(self):
+        return "%d bytes read once, uploaded to %d of %d targets in %.3f s" \
+            % (self.read_size, len(self.uploads) - len(self.getErrors()),
+               len(self.uploads), self.time)
+
+
+class _Stripe(object):
+    """Channel of a striped transfer, with its own handle of the file."""
+
+    def __init__(self, channel, window):
+        self.channel = channel
+        self.window = window
+        self.fs = None
+        self.handle = None
+        self.in_flight = 0
+
+
+def _startStripes(stripes):
+    for s in stripes:
+        s.window = getWindow(s.channel, s.window)
+        s.fs = getFileSystem(s.channel)
+
+
+def _pickStripe(stripes, force=False):
+    """Get the least busy channel that can take another command: it has
+    less than window commands in flight and no congestion. If force is
+    True, the least busy channel is returned even if it is full."""
+    best = None
+    for s in stripes:
+        if not force:
+            if s.in_flight >= s.window:
+                continue
+            if s.in_flight > 0 and s.channel.remote_congestion_level > 0:
+                continue
+        if best is None or s.in_flight < best.in_flight:
+            best = s
+    return best
+
+
+def _openStripes(stripes, path, flags, done):
+    """Open the file on every channel, call done(error) when all the opens
+    are done. Handles are kept even if some of the opens failed, so that
+    they can be closed."""
+    state = {"left": len(stripes), "error": None}
+
+    class DoneOpen(filesystem.DoneOpen):
+        def __init__(self, stripe):
+            self.stripe = stripe
+
+        def doneOpen(self, token, error, handle):
+            state["left"] -= 1
+            if error:
+                if state["error"] is None:
+                    state["error"] = error
+            else:
+                self.stripe.handle = handle
+            if state["left"] == 0:
+                done(state["error"])
+    for s in stripes:
+        s.fs.open(path, flags, None, DoneOpen(s))
+
+
+def _closeStripes(stripes, done):
+    """Close the open handles, call done(error) when all are closed."""
+    stripes = [s for s in stripes if s.handle is not None]
+    state = {"left": len(stripes), "error": None}
+    if not stripes:
+        done(None)
+        return
+
+    class DoneClose(filesystem.DoneClose):
+        def doneClose(self, token, error):
+            state["left"] -= 1
+            if error and state["error"] is None:
+                state["error"] = error
+            if state["left"] == 0:
+                done(state["error"])
+    for s in stripes:
+        handle = s.handle
+        s.handle = None
+        s.fs.close(handle, DoneClose())
+
+
+class StripedDownload(Download):
+    """Download a remote file over several channels to the same agent.
+
+    Every channel opens the file with its own handle. Chunks are requested
+    in file order, each from the least busy channel, so the file is read in
+    byte ranges spread over the channels, each channel with its own window of
+    commands in flight. The chunks are written to the output in file order,
+    as in Download.
+    """
+
+    def __init__(self, channels, path, out, chunk_size=CHUNK_SIZE,
+                 window=WINDOW):
+        super(StripedDownload, self).__init__(channels[0], path, out,
+                                              chunk_size, window)
+        self.stripes = [_Stripe(c, window) for c in channels]
+
+    def _start(self):
+        download = self
+        _startStripes(self.stripes)
+
+        def done(error):
+            if error:
+                download.error = error
+                download._close()
+                return
+            download.handle = download.stripes[0].handle
+            download._readMore()
+        _openStripes(self.stripes, self.path, filesystem.TCF_O_READ, done)
+
+    def _readMore(self):
+        while self.error is None and self.eof_pos is None and \
+                _pickStripe(self.stripes) is not None:
+            self._read(self.read_pos, self.chunk_size)
+            self.read_pos += self.chunk_size
+        if self.in_flight == 0:
+            self._close()
+
+    def _read(self, offset, length):
+        download = self
+        stripe = _pickStripe(self.stripes, True)
+
+        class DoneRead(filesystem.DoneRead):
+            def doneRead(self, token, error, data, eof):
+                stripe.in_flight -= 1
+                download.in_flight -= 1
+                download._doneRead(offset, length, error, data, eof)
+        stripe.in_flight += 1
+        self.in_flight += 1
+        stripe.fs.read(stripe.handle, offset, length, DoneRead())
+
+    def _close(self):
+        download = self
+        self.handle = None
+
+        def done(error):
+            download._done(download.error or error)
+        _closeStripes(self.stripes, done)
+
+    def __str__(self):
+        return "%s over %d channels" % (
+            super(StripedDownload, self).__str__(), len(self.stripes))
+
+
+class StripedUpload(Upload):
+    """Upload a local file object into a remote file over several channels
+    to the same agent.
+
+    The file is created or truncated over the first channel, then opened
+    for writing over the others. The input is read in order, and every chunk
+    is written at its offset over the least busy channel. When all writes
+    are done the size and attributes are set over the first channel, then
+    all the handles are closed.
+    """
+
+    def __init__(self, channels, path, inp, chunk_size=CHUNK_SIZE,
+                 window=WINDOW, attrs=None):
+        super(StripedUpload, self).__init__(channels[0], path, inp,
+                                            chunk_size, window, attrs)
+        self.stripes = [_Stripe(c, window) for c in channels]
+
+    def _start(self):
+        upload = self
+        _startStripes(self.stripes)
+
+        def doneOthers(error):
+            if error:
+                upload.error = error
+                upload._close()
+                return
+            upload._writeMore()
+
+        def doneFirst(error):
+            if error:
+                upload._done(error)
+                return
+            upload.handle = upload.stripes[0].handle
+            _openStripes(upload.stripes[1:], upload.path,
+                         filesystem.TCF_O_WRITE, doneOthers)
+        _openStripes(self.stripes[:1], self.path, self.flags, doneFirst)
+
+    def _writeMore(self):
+        while self.error is None and not self.eof and \
+                _pickStripe(self.stripes) is not None:
+            try:
+                data = self.inp.read(self.chunk_size)
+            except Exception as x:
+                self.error = x
+                break
+            if not data:
+                self.eof = True
+                break
+            self._write(self.offset, data)
+            self.offset += len(data)
+        if self.in_flight == 0:
+            self._finish()
+
+    def _write(self, offset, data):
+        upload = self
+        stripe = _pickStripe(self.stripes, True)
+
+        class DoneWrite(filesystem.DoneWrite):
+            def doneWrite(self, token, error):
+                stripe.in_flight -= 1
+                upload.in_flight -= 1
+                if error:
+                    if upload.error is None:
+                        upload.error = error
+                else:
+                    upload.size += len(data)
+                upload._writeMore()
+        stripe.in_flight += 1
+        self.in_flight += 1
+        stripe.fs.write(stripe.handle, offset, data, 0, len(data),
+                        DoneWrite())
+
+    def _close(self):
+        upload = self
+        self.handle = None
+
+        def done(error):
+            upload._done(upload.error or error)
+        _closeStripes(self.stripes, done)
+
+    def __str__(self):
+        return "%s over %d channels" % (
+            super(StripedUpload, self).__str__(), len(self.stripes))
+
+
+def download(channel, path, out, chunk_size=CHUNK_SIZE, window=WINDOW):
+    """
+    Download a remote file. Must not be called on the dispatch thread.
+    @param channel - open TCF channel.
+    @param path - remote file path.
+    @param out - binary file object to write the file contents to.
+    @return Download object with transfer statistics.
+    @raises Exception if the transfer fails.
+    """
+    d = Download(channel, path, out, chunk_size, window)
+    return task.Task(d.start).get()
+
+
+def upload(channel, path, inp, chunk_size=CHUNK_SIZE, window=WINDOW,
+           attrs=None):
+    """
+    Upload a local file. Must not be called on the dispatch thread.
+    @param channel - open TCF channel.
+    @param path - remote file path, the file is created or truncated.
+    @param inp - binary file object to read the file contents from.
+    @param attrs - FileAttrs to set on the remote file, or None.
+    @return Upload object with transfer statistics.
+    @raises Exception if the transfer fails.
+    """
+    u = Upload(channel, path, inp, chunk_size, window, attrs)
+    return task.Task(u.start).get()
+
+
+def deltaUpload(channel, path, inp, chunk_size=CHUNK_SIZE, window=WINDOW,
+                attrs=None):
+    """
+    Upload a local file, rewriting only the blocks that differ from the
+    remote file. Must not be called on the dispatch thread.
+    @param channel - open TCF channel.
+    @param path - remote file path, the file is created if it does not exist.
+    @param inp - seekable binary file object to read the file contents from.
+    @param attrs - FileAttrs to set on the remote file, or None.
+    @return DeltaUpload object with transfer statistics.
+    @raises Exception if the transfer fails.
+    """
+    u = DeltaUpload(channel, path, inp, chunk_size, window, attrs)
+    return task.Task(u.start).get()
+
+
+def multiUpload(channels, path, inp, chunk_size=CHUNK_SIZE, window=WINDOW,
+                attrs=None):
+    """
+    Upload a local file to several channels, reading it once. Must not be
+    called on the dispatch thread.
+    @param channels - open TCF channels.
+    @param path - remote file path, the file is created or truncated.
+    @param inp - binary file object to read the file contents from.
+    @param attrs - FileAttrs to set on the remote files, or None.
+    @return MultiUpload object, failed targets are in getErrors().
+    """
+    u = MultiUpload(channels, path, inp, chunk_size, window, attrs)
+    return task.Task(u.start).get()
+
+
+def stripedDownload(channels, path, out, chunk_size=CHUNK_SIZE,
+                    window=WINDOW):
+    """
+    Download a remote file over several channels to the same agent. Must
+    not be called on the dispatch thread.
+    @param channels - open TCF channels.
+    @param path - remote file path.
+    @param out - binary file object to write the file contents to.
+    @param window - max number of commands in flight on each channel.
+    @return StripedDownload object with transfer statistics.
+    @raises Exception if the transfer fails.
+    """
+    d = StripedDownload(channels, path, out, chunk_size, window)
+    return task.Task(d.start).get()
+
+
+def stripedUpload(channels, path, inp, chunk_size=CHUNK_SIZE, window=WINDOW,
+                  attrs=None):
+    """
+    Upload a local file over several channels to the same agent. Must not be
+    called on the dispatch thread.
+    @param channels - open TCF channels.
+    @param path - remote file path, the file is created or truncated.
+    @param inp - binary file object to read the file contents from.
+    @param window - max number of commands in flight on each channel.
+    @param attrs - FileAttrs to set on the remote file, or None.
+    @return StripedUpload object with transfer statistics.
+    @raises Exception if the transfer fails.
+    """
+    u = StripedUpload(channels, path, inp, chunk_size, window, attrs)
+    return task.Task(u.start).get()
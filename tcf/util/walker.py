@@ -0,0 +1,196 @@
+"""
+Recursive remote directory walker over TCF FileSystem service.
+
+Walker reads several directories at once: each directory is read with a
+sequence of readdir commands until eof, and up to window directories are
+open at the same time. Use walk() to iterate over the entries from a thread
+other than the dispatch thread.
+"""
+
+import collections
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # @UnresolvedImport
+
+from .. import protocol
+from ..services import filesystem
+from .transfer import getFileSystem, getWindow
+
+WINDOW = 8
+
+
+def joinPath(dirpath, name):
+    if not dirpath or dirpath.endswith('/'):
+        return dirpath + name
+    return dirpath + '/' + name
+
+
+def isEOF(error):
+    return isinstance(error, filesystem.FileSystemException) and \
+        error.getStatus() == filesystem.STATUS_EOF
+
+
+class Walker(object):
+    """Walks a remote directory tree on the dispatch thread.
+
+    Clients subclass Walker and override onEntries(), onError() and
+    onDone().
+    """
+
+    def __init__(self, channel, path, window=WINDOW, recursive=True):
+        self.channel = channel
+        self.path = path
+        self.window = window
+        self.recursive = recursive
+        self.dirs = collections.deque()
+        self.active = 0
+        self.canceled = False
+        self.finished = False
+
+    def start(self):
+        """Start walking. Must be called on the dispatch thread."""
+        assert protocol.isDispatchThread()
+        self.window = getWindow(self.channel, self.window)
+        try:
+            self.fs = getFileSystem(self.channel)
+        except Exception as x:
+            self.onError(self.path, x)
+            self._walkMore()
+            return
+        self.dirs.append(self.path)
+        self._walkMore()
+
+    def cancel(self):
+        """Stop opening new directories. Directories that are being read are
+        closed, then onDone() is called."""
+        assert protocol.isDispatchThread()
+        self.canceled = True
+        self.dirs.clear()
+
+    def onEntries(self, dirpath, entries):
+        """
+        Called with a batch of directory entries.
+        @param dirpath - path of the directory.
+        @param entries - list of DirEntry objects, without "." and "..".
+        """
+        pass
+
+    def onError(self, dirpath, error):
+        """Called when a directory cannot be opened or read."""
+        pass
+
+    def onDone(self):
+        """Called once, when the walk is complete."""
+        pass
+
+    def _walkMore(self):
+        while self.dirs and self.active < self.window:
+            self._openDir(self.dirs.popleft())
+        if self.active == 0 and not self.finished:
+            self.finished = True
+            self.onDone()
+
+    def _openDir(self, path):
+        walker = self
+
+        class DoneOpen(filesystem.DoneOpen):
+            def doneOpen(self, token, error, handle):
+                if error:
+                    walker.active -= 1
+                    walker.onError(path, error)
+                    walker._walkMore()
+                else:
+                    walker._readDir(path, handle)
+        self.active += 1
+        self.fs.opendir(path, DoneOpen())
+
+    def _readDir(self, path, handle):
+        walker = self
+
+        class DoneReadDir(filesystem.DoneReadDir):
+            def doneReadDir(self, token, error, entries, eof):
+                if error:
+                    if not isEOF(error):
+                        walker.onError(path, error)
+                    eof = True
+                elif entries:
+                    walker._addEntries(path, entries)
+                if eof or walker.canceled:
+                    walker._closeDir(handle)
+                else:
+                    walker._readDir(path, handle)
+                walker._walkMore()
+        self.fs.readdir(handle, DoneReadDir())
+
+    def _addEntries(self, path, entries):
+        entries = [e for e in entries if e.filename not in ('.', '..')]
+        if self.recursive and not self.canceled:
+            for e in entries:
+                if e.attrs is not None and e.attrs.isDirectory():
+                    self.dirs.append(joinPath(path, e.filename))
+        self.onEntries(path, entries)
+
+    def _closeDir(self, handle):
+        walker = self
+
+        class DoneClose(filesystem.DoneClose):
+            def doneClose(self, token, error):
+                walker.active -= 1
+                walker._walkMore()
+        self.fs.close(handle, DoneClose())
+
+
+def walk(channel, path, window=WINDOW, recursive=True, onerror=None):
+    """
+    Iterate over entries of a remote directory tree.
+    Must not be called on the dispatch thread.
+
+    Entries of different directories are interleaved, in the order they are
+    received.
+
+    @param channel - open TCF channel.
+    @param path - remote directory path.
+    @param window - max number of directories read at the same time.
+    @param recursive - if False, only the directory itself is listed.
+    @param onerror - callable invoked as onerror(dirpath, error) for
+                     subdirectories that cannot be read, errors are
+                     ignored if None.
+    @return generator of (dirpath, DirEntry) tuples.
+    @raises Exception if the directory itself cannot be read.
+    """
+    assert not protocol.isDispatchThread()
+    items = queue.Queue()
+
+    class QueueWalker(Walker):
+        def onEntries(self, dirpath, entries):
+            items.put((dirpath, entries, None))
+
+        def onError(self, dirpath, error):
+            items.put((dirpath, None, error))
+
+        def onDone(self):
+            items.put(None)
+
+    walker = QueueWalker(channel, path, window, recursive)
+    protocol.invokeLater(walker.start)
+    done = False
+    try:
+        while True:
+            item = items.get()
+            if item is None:
+                done = True
+                break
+            dirpath, entries, error = item
+            if error is not None:
+                if dirpath == path:
+                    raise error
+                if onerror is not None:
+                    onerror(dirpath, error)
+                continue
+            for entry in entries:
+                yield dirpath, entry
+    finally:
+        if not done:
+            protocol.invokeLater(walker.cancel)
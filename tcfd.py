@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import signal
+from common import *
+
+parser = argparse.ArgumentParser(description='Keeps channels to agents open for cat.py, ls.py and put.py.')
+parser.add_argument('-s', '--socket', help='UNIX socket path, default is $TCF_DAEMON_SOCKET or a per-user file in the temporary directory')
+parser.add_argument('-c', '--cache-ttl', type=float, metavar='SECONDS', help='cache remote file metadata and directory listings for SECONDS')
+args = parser.parse_args()
+
+tcf.protocol.startEventQueue()
+server = daemon.Server(args.socket, args.cache_ttl)
+try:
+    server.bind()
+    # Connect in advance, so the first request does not wait for Hello
+    server.getChannel(TARGET)
+except Exception as e:
+    print('Error: ', e.args[-1], file=sys.stderr)
+    sys.exit(1)
+
+print('Listening on', server.path, file=sys.stderr)
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+try:
+    server.serve()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.close()